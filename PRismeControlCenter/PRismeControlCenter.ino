@@ -8,12 +8,59 @@
  */
 #include <robopoly.h>
 #include <LinearCamera.h>
+#include <util/delay.h>
+#include <util/crc16.h>
+#include <string.h>
 
 unsigned char i, j;
 char serialValue;
 unsigned int intTime;
 char leftSpeed, rightSpeed;
 unsigned char irSensors[5];
+unsigned char *lcam_dataPtr;
+
+// streaming state, when enabled a frame is sent after every pause
+unsigned char streaming;
+unsigned int streamPause, streamWait;
+
+// baud rates the host can switch to (9600, 19200, 38400, 57600, 115200,
+// 250000, 500000 and 1000000), as UBRR values in double speed mode on a 16 MHz
+// clock: UBRR = F_CPU / (8 * rate) - 1
+#define BAUDRATE_COUNT 8
+#define BAUD_NAK 0xff
+// milliseconds to wait for the host to confirm a new rate
+#define BAUD_CONFIRM_TIMEOUT 500
+const unsigned int baudrateRegisters[BAUDRATE_COUNT] = {207, 103, 51, 34, 16, 7, 3, 1};
+unsigned char baudrateIndex;
+
+// framed data responses: sync marker, sequence number, length, payload then
+// a CRC-16/CCITT of the sequence number, length and payload, high byte first
+#define FRAME_SYNC_0 0xa5
+#define FRAME_SYNC_1 0x5a
+#define FRAME_SIZE 107
+unsigned char framing, frameSequence;
+unsigned int frameCrc;
+
+// compressed data responses: a keyframe every keyframeInterval frames and in
+// between the differences to the previous frame, as runs of unchanged bytes,
+// of differences that fit in a nibble or of new values, see encodeDelta
+#define DELTA_FLAG 0x80
+#define DELTA_ZEROS 0x00
+#define DELTA_NIBBLES 0x40
+#define DELTA_LITERALS 0x80
+#define DELTA_RUN_MAX 64
+#define SMALL(d) ((signed char)(d) >= -8 && (signed char)(d) <= 7)
+#define UNCHANGED(k) (frame[k] == previousFrame[k])
+// a single unchanged byte costs less in a run of nibbles
+#define UNCHANGED_RUN(k) (UNCHANGED(k) && ((k) + 1 == FRAME_SIZE || UNCHANGED((k) + 1)))
+unsigned char frame[FRAME_SIZE], previousFrame[FRAME_SIZE], delta[FRAME_SIZE];
+unsigned char keyframeInterval, keyframeWait;
+
+void sendByte(unsigned char value)
+{
+  serialRaw(value);
+  frameCrc = _crc_xmodem_update(frameCrc, value);
+}
 
 unsigned char infraRedAnalogRead()
 {
@@ -34,14 +81,180 @@ unsigned char infraRedAnalogRead()
   digital_write(PORTC, 0, 0);
 }
 
+unsigned char encodeDelta()
+{
+  // encode the differences between previousFrame and frame into delta,
+  // returns their length or 0 when they aren't shorter than a keyframe
+  unsigned char k = 0, start, length = 0, n;
+  while(k < FRAME_SIZE)
+  {
+    start = k;
+    if(UNCHANGED_RUN(k))
+    {
+      while(k < FRAME_SIZE && k - start < DELTA_RUN_MAX && UNCHANGED(k)) k++;
+      if(length + 1 >= FRAME_SIZE) return 0;
+      delta[length++] = DELTA_ZEROS | (k - start - 1);
+    }
+    else if(SMALL(frame[k] - previousFrame[k]))
+    {
+      while(k < FRAME_SIZE && k - start < DELTA_RUN_MAX && SMALL(frame[k] - previousFrame[k]) && !UNCHANGED_RUN(k)) k++;
+      if(length + 1 + (k - start + 1) / 2 >= FRAME_SIZE) return 0;
+      delta[length++] = DELTA_NIBBLES | (k - start - 1);
+      // two differences per byte, high nibble first
+      for(n = start; n < k; n += 2)
+      {
+        delta[length] = (frame[n] - previousFrame[n]) << 4;
+        if(n + 1 < k)
+        {
+          delta[length] |= (frame[n + 1] - previousFrame[n + 1]) & 0x0f;
+        }
+        length++;
+      }
+    }
+    else
+    {
+      while(k < FRAME_SIZE && k - start < DELTA_RUN_MAX && !SMALL(frame[k] - previousFrame[k])) k++;
+      if(length + 1 + (k - start) >= FRAME_SIZE) return 0;
+      delta[length++] = DELTA_LITERALS | (k - start - 1);
+      for(n = start; n < k; n++)
+      {
+        delta[length++] = frame[n];
+      }
+    }
+  }
+  return length;
+}
+
+void sendData()
+{
+  unsigned char length = FRAME_SIZE;
+  unsigned char *payload = frame;
+  // acquire before sending anything so the frame goes out in one burst
+  lcam_integrate(intTime);
+  lcam_read();
+  infraRedAnalogRead();
+  // linear camera data then IR sensor values
+  for(i = 0; i < 102; i++)
+  {
+    frame[i] = *(lcam_dataPtr + i);
+  }
+  for(i = 0; i < 5; i++)
+  {
+    frame[102 + i] = irSensors[4 - i];
+  }
+  if(framing && keyframeInterval)
+  {
+    if(keyframeWait == 0)
+    {
+      keyframeWait = keyframeInterval - 1;
+    }
+    else
+    {
+      keyframeWait--;
+      if((length = encodeDelta()))
+      {
+        payload = delta;
+      }
+      else
+      {
+        length = FRAME_SIZE;
+      }
+    }
+    memcpy(previousFrame, frame, FRAME_SIZE);
+  }
+  frameCrc = 0xffff;
+  if(framing)
+  {
+    serialRaw(FRAME_SYNC_0);
+    serialRaw(FRAME_SYNC_1);
+    sendByte(frameSequence++);
+    sendByte(payload == delta ? DELTA_FLAG | length : length);
+  }
+  for(i = 0; i < length; i++)
+  {
+    sendByte(payload[i]);
+  }
+  if(framing)
+  {
+    serialRaw(frameCrc >> 8);
+    serialRaw(frameCrc & 0xff);
+  }
+}
+
+void sendInfrared()
+{
+  // IR sensor values alone, the camera is neither integrated nor read, in a
+  // frame of their own when framing is enabled, never compressed
+  infraRedAnalogRead();
+  frameCrc = 0xffff;
+  if(framing)
+  {
+    serialRaw(FRAME_SYNC_0);
+    serialRaw(FRAME_SYNC_1);
+    sendByte(frameSequence++);
+    sendByte(5);
+  }
+  for(i = 0; i < 5; i++)
+  {
+    sendByte(irSensors[4 - i]);
+  }
+  if(framing)
+  {
+    serialRaw(frameCrc >> 8);
+    serialRaw(frameCrc & 0xff);
+  }
+}
+
+void setBaudrate(unsigned char index)
+{
+  UCSR0A |= (1 << U2X0);
+  UBRR0 = baudrateRegisters[index];
+  baudrateIndex = index;
+}
+
+void switchBaudrate(unsigned char index)
+{
+  unsigned char previous = baudrateIndex;
+  unsigned int wait;
+  if(index >= BAUDRATE_COUNT)
+  {
+    serialRaw(BAUD_NAK);
+    return;
+  }
+  // acknowledge at the current rate and wait for the byte to leave the UART
+  serialRaw(index);
+  while(!(UCSR0A & (1 << UDRE0)));
+  UCSR0A |= (1 << TXC0);
+  while(!(UCSR0A & (1 << TXC0)));
+  setBaudrate(index);
+  // the host confirms with a data request at the new rate, anything else or
+  // nothing at all means the link doesn't work at this rate
+  for(wait = BAUD_CONFIRM_TIMEOUT; wait && !serialAvailable(); wait--)
+  {
+    _delay_ms(1);
+  }
+  if(serialAvailable() && serialRead() == 'd')
+  {
+    sendData();
+  }
+  else
+  {
+    setBaudrate(previous);
+  }
+}
+
 int main()
 {
   pin_mode(PORTC, 2, 1);
   serialSetup();
+  setBaudrate(0);
   lcam_setup();
-  unsigned char *lcam_dataPtr = lcam_getdata();
+  lcam_dataPtr = lcam_getdata();
 
   intTime = 100;
+  streaming = 0;
+  framing = 0;
+  keyframeInterval = 0;
   
   // emitter pin
   pin_mode(PORTC, 0, 1);
@@ -57,19 +270,10 @@ int main()
       switch(serialRead())
       {
       case 'd':
-        // send linear camera data
-        lcam_integrate(intTime);
-        lcam_read();
-        for(i = 0; i < 102; i++)
-        {
-          serialRaw(*(lcam_dataPtr + i));
-        }
-        // send IR sensor values
-        infraRedAnalogRead();
-        for(i = 0; i < 5; i++)
-        {
-          serialRaw(irSensors[4 - i]);
-        }
+        sendData();
+        break;
+      case 'i':
+        sendInfrared();
         break;
       case 't':
         while(!serialAvailable());
@@ -91,7 +295,57 @@ int main()
         break;
       case 'r':
         setSpeed(0, 0);
+        streaming = 0;
+        framing = 0;
+        keyframeInterval = 0;
+        setBaudrate(0);
+        break;
+      case 'a':
+        // start streaming, pause between frames in milliseconds
+        while(!serialAvailable());
+        streamPause = ((unsigned char)serialRead() << 8);
+        while(!serialAvailable());
+        streamPause += (unsigned char)serialRead();
+        streamWait = 0;
+        streaming = 1;
+        break;
+      case 'x':
+        streaming = 0;
+        break;
+      case 'b':
+        // switch to another baud rate, see switchBaudrate
+        while(!serialAvailable());
+        switchBaudrate(serialRead());
+        break;
+      case 'f':
+        // enable or disable framed data responses, the sequence restarts
+        while(!serialAvailable());
+        framing = serialRead();
+        frameSequence = 0;
+        keyframeWait = 0;
         break;
+      case 'z':
+        // compress framed data responses with a keyframe every given number
+        // of frames, 0 to disable, the next frame is a keyframe
+        while(!serialAvailable());
+        keyframeInterval = serialRead();
+        keyframeWait = 0;
+        break;
+      }
+    }
+    else if(streaming)
+    {
+      // push frames without waiting for requests, commands are still handled
+      // between frames
+      if(streamWait == 0)
+      {
+        sendData();
+        streamWait = streamPause;
+      }
+      else
+      {
+        _delay_ms(1);
+        streamWait--;
       }
     }
   }
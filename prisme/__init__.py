@@ -0,0 +1,2 @@
+# PRisme host side library: serial protocol, acquisition and tooling shared by
+# the control center application, the device emulator and the benchmarks
@@ -0,0 +1,6 @@
+# python -m prisme: headless mode, see prisme.cli
+import sys
+
+from prisme import cli
+
+sys.exit(cli.main())
@@ -0,0 +1,404 @@
+# acquisition and protocol layer, independent of any user interface: reads
+# frames from a PRisme (or a replayed session) and sends it commands
+import time, threading, collections
+from timeit import default_timer as clock
+
+import serial
+
+from prisme import protocol
+from prisme.frame import FramePool, readInto
+from prisme.framebuffer import FrameBuffer
+from prisme.framing import FrameParser, isFramed
+from prisme.scheduler import CommandScheduler, RequestScheduler
+from prisme.latency import Latencies, COMMAND_WRITTEN, STAGE_REQUESTED, STAGE_FIRST_BYTE, STAGE_COMPLETE, STAGE_DECODED, STAGE_POSTED, STAGE_DRAWN
+
+# data requests kept in flight when polling the device instead of streaming
+PIPELINE_DEPTH = 2
+# frames preallocated per acquisition, consumers must not hold more than this
+FRAME_POOL_SIZE = 8
+
+# consecutive timeouts tolerated with framed data responses, the requests are
+# sent again after each of them
+MAX_TIMEOUTS = 3
+
+# seconds slept at most while no request is due, the acquisition still stops
+# promptly
+IDLE_WAIT = 0.05
+
+# reasons given to onDisconnect, None when stopped on request
+DISCONNECT_TIMEOUT = 'timeout'
+DISCONNECT_ERROR = 'error'
+
+def openLink(port, baudrate=protocol.DEFAULT_BAUDRATE, speed=1.0):
+    # serial port, or session file (.prs) replayed at the given speed, devices
+    # start at the default rate, see negotiateBaudrate
+    if port.endswith('.prs'):
+        from prisme.replay import ReplaySerial
+        return ReplaySerial(port, speed)
+    return serial.Serial(port=port, baudrate=baudrate, timeout=1, writeTimeout=1)
+
+def readIntTime(link):
+    # handshake: load the integration time value (2 bytes) from the device,
+    # None when it doesn't answer
+    link.write(protocol.CMD_CONFIG)
+    data = link.read(2)
+    if len(data) < 2:
+        return None
+    return protocol.decodeIntTime(data)
+
+def handshake(link):
+    # readIntTime, and if the device doesn't answer look for it at the other
+    # rates: a host that went away without resetting it may have left it at a
+    # faster one, it is then reset back to the default rate
+    intTime = readIntTime(link)
+    if intTime is not None or not hasattr(link, 'baudrate'):
+        return intTime
+    baudrate, timeout = link.baudrate, link.timeout
+    link.timeout = 0.1
+    try:
+        for rate in protocol.negotiableBaudrates():
+            link.baudrate = rate
+            link.reset_input_buffer()
+            if readIntTime(link) is not None:
+                link.write(protocol.CMD_RESET)
+                link.flush()
+                # USB adapters may still hold the bytes after the flush, they
+                # would be garbled by changing the rate under them
+                time.sleep(0.05)
+                break
+        else:
+            return None
+    finally:
+        link.baudrate, link.timeout = baudrate, timeout
+    link.reset_input_buffer()
+    return readIntTime(link)
+
+def switchBaudrate(link, baudrate):
+    # ask the device to switch to baudrate and confirm with a probe frame,
+    # returns whether both sides now use it, the link is left at the previous
+    # rate otherwise, None when the firmware ignores rate switching
+    previous = link.baudrate
+    link.reset_input_buffer()
+    link.write(protocol.baudCommand(baudrate))
+    link.flush()
+    answer = bytearray(link.read(1))
+    if not answer:
+        return None
+    if answer[0] != protocol.BAUDRATES.index(baudrate):
+        return False
+    try:
+        link.baudrate = baudrate
+        link.reset_input_buffer()
+        link.write(protocol.CMD_DATA)
+        link.flush()
+        if len(link.read(protocol.FRAME_SIZE)) == protocol.FRAME_SIZE:
+            return True
+    except (ValueError, serial.SerialException):
+        # the adapter doesn't support the rate
+        pass
+    # the device goes back to the previous rate on its own
+    link.baudrate = previous
+    time.sleep(protocol.BAUD_CONFIRM_TIMEOUT)
+    link.reset_input_buffer()
+    return False
+
+def negotiateBaudrate(link, maximum=None):
+    # switch to the fastest rate up to maximum both the device and the host
+    # support, returns the rate in use, replayed sessions stay as they are
+    if not hasattr(link, 'baudrate'):
+        return protocol.DEFAULT_BAUDRATE
+    for baudrate in protocol.negotiableBaudrates(maximum):
+        if baudrate <= link.baudrate:
+            break
+        switched = switchBaudrate(link, baudrate)
+        if switched or switched is None:
+            break
+    return link.baudrate
+
+def enableFraming(link):
+    # ask for framed data responses and check them with a probe frame, the
+    # firmware without framing answers a raw frame which is thrown away
+    if not hasattr(link, 'baudrate'):
+        # replayed sessions frame the recorded frames themselves, a probe
+        # would only use up the first one
+        link.write(protocol.framingCommand(True))
+        return True
+    link.reset_input_buffer()
+    link.write(protocol.framingCommand(True) + protocol.CMD_DATA)
+    link.flush()
+    framed = isFramed(link.read(protocol.FRAMED_SIZE))
+    link.reset_input_buffer()
+    return framed
+
+def probeInfrared(link, framed=False):
+    # whether the firmware answers IR requests (see protocol.CMD_IR), older
+    # firmware ignores them, replayed sessions have no IR responses
+    if not hasattr(link, 'baudrate'):
+        return False
+    timeout = link.timeout
+    link.timeout = 0.2
+    try:
+        link.reset_input_buffer()
+        link.write(protocol.CMD_IR)
+        link.flush()
+        answer = link.read(protocol.FRAMED_IR_SIZE if framed else protocol.IR_SENSORS)
+    finally:
+        link.timeout = timeout
+    link.reset_input_buffer()
+    if framed:
+        return answer[:len(protocol.FRAME_SYNC)] == protocol.FRAME_SYNC and bytearray(answer)[3] == protocol.IR_SENSORS
+    return len(answer) == protocol.IR_SENSORS
+
+class Acquisition(threading.Thread):
+    def __init__(self, link, pause=None, depth=PIPELINE_DEPTH, frameBuffer=None, onDisconnect=None, framed=False,
+            compression=None, latencies=None, cameraRate=None, irRate=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.link = link
+        # pause between frames in ms when the device streams, None to poll
+        self.pause = pause
+        # number of requests kept in flight when polling
+        self.depth = max(1, depth)
+        # data requests per second when polling, None for as many as the link
+        # allows, and IR requests per second, None for none (the firmware has
+        # to answer them, see probeInfrared)
+        self.requests = RequestScheduler(cameraRate, irRate)
+        # newest frames for consumers, they pick them up at their own pace
+        self.frameBuffer = frameBuffer if frameBuffer is not None else FrameBuffer()
+        # commands waiting to be sent, they go out as soon as they are queued
+        # from a writer thread, most urgent first
+        self.scheduler = CommandScheduler()
+        # session recorder, None when not recording
+        self.recorder = None
+        # called from the acquisition thread with every frame
+        self.onFrame = None
+        # prisme.calibration.CalibrationPipeline correcting the camera of
+        # every frame in place once it is recorded, None for none
+        self.calibration = None
+        # prisme.control.Controller given every frame before anything else
+        # but the calibration, its commands go out at once, None for none
+        self.controller = None
+        # called from the acquisition thread once the link is closed, with
+        # None, DISCONNECT_TIMEOUT or DISCONNECT_ERROR
+        self.onDisconnect = onDisconnect
+        self.sequence = 0
+        self._frames = FramePool(FRAME_POOL_SIZE)
+        # parser of framed data responses (see enableFraming) with the counts
+        # of corrupted and lost frames, None for raw responses
+        self.parser = FrameParser(self._frames) if framed else None
+        # keyframe interval of compressed data responses, None to get every
+        # frame whole, only framed responses are compressed
+        self.compression = compression if framed else None
+        self.timeouts = 0
+        # time between the stages of every frame and of every command, the
+        # consumers add the time frames are drawn at
+        self.latencies = latencies if latencies is not None else Latencies()
+        self._stopping = False
+        # commands and data requests are written from two threads
+        self._writing = threading.Lock()
+        # (time, command) of the requests in flight, oldest first, the frames
+        # answer them in order
+        self._requests = collections.deque(maxlen=256)
+        # camera pixels of the last raw data response, for the IR responses
+        self._camera = bytearray(protocol.CAMERA_PIXELS)
+        # times of the reads with the first and last bytes of the next frame
+        self._firstByte = self._lastRead = 0.0
+
+    def queueCommand(self, data, timestamp=None):
+        # can be called from any thread, timestamp is the clock() time the
+        # command was given at when it isn't now
+        self.scheduler.put(data, timestamp)
+
+    def stop(self):
+        # ask for the communication end, the device is reset and the link
+        # closed by the acquisition thread
+        self._stopping = True
+
+    def send(self, data):
+        with self._writing:
+            self.link.write(data)
+            self.link.flush()
+
+    def request(self, count=1, command=protocol.CMD_DATA):
+        # requests, timed for the frames answering them
+        self.send(command * count)
+        self._requests.extend([(clock(), command)] * count)
+
+    def requestDue(self):
+        # keep depth requests in flight among those due
+        while len(self._requests) < self.depth:
+            command = self.requests.take(clock())
+            if command is None:
+                return
+            self.request(1, command)
+
+    def disconnect(self):
+        try:
+            if self.pause is not None:
+                self.send(protocol.CMD_STREAM_STOP)
+            self.send(protocol.CMD_RESET)
+        except (OSError, serial.SerialException):
+            # the device is already gone
+            pass
+        self.link.close()
+
+    def run(self):
+        reason = None
+        writer = threading.Thread(target=self.writeCommands)
+        writer.daemon = True
+        writer.start()
+        if self.calibration is not None:
+            self.calibration.reset()
+        if self.controller is not None:
+            self.controller.reset()
+        try:
+            reason = self.acquire()
+        except (OSError, serial.SerialException):
+            # the device was disconnected without telling the application
+            reason = DISCONNECT_ERROR
+        self.scheduler.close()
+        writer.join()
+        self.disconnect()
+        if self.onDisconnect is not None:
+            self.onDisconnect(reason)
+
+    def acquire(self):
+        if self.compression:
+            self.send(protocol.compressionCommand(self.compression))
+        if self.pause is not None:
+            # the device pushes frames on its own from now on
+            self.send(protocol.streamCommand(self.pause))
+
+        while not self._stopping:
+            # ask for data, the link would sit idle while the device integrates
+            # if only one request was sent at a time, the others are kept in
+            # flight
+            if self.pause is None:
+                self.requestDue()
+                if not self._requests:
+                    # nothing due before a while
+                    time.sleep(max(0, min(IDLE_WAIT, self.requests.due - clock())))
+                    continue
+
+            if self.parser is not None:
+                frame = self.readFramed()
+                if frame is None:
+                    if self.pause is None and not self._requests:
+                        # the requests in flight were lost, none was due since
+                        continue
+                    self.timeouts += 1
+                    if self.timeouts >= MAX_TIMEOUTS:
+                        return DISCONNECT_TIMEOUT
+                    # the requests in flight are lost, refill the pipeline
+                    self._requests.clear()
+                    continue
+                self.timeouts = 0
+            else:
+                frame = self.readRaw()
+                if frame is None:
+                    return DISCONNECT_TIMEOUT
+            frame.stages[STAGE_REQUESTED] = self._requests.popleft()[0] if self._requests else 0.0
+            frame.timestamp = clock()
+            # the device numbers framed responses, gaps show lost frames
+            frame.sequence = self.sequence if self.parser is None else self.parser.sequence
+            self.sequence += 1
+
+            # the recorder copies the frame and writes it from its own thread,
+            # sessions are kept as received and can be calibrated afterwards
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.recordFrame(frame)
+
+            calibration = self.calibration
+            if calibration is not None:
+                calibration.process(frame)
+
+            # the writer thread sends the controller's command while the frame
+            # is passed on
+            controller = self.controller
+            if controller is not None:
+                command = controller.update(frame)
+                if command is not None:
+                    self.queueCommand(command, frame.timestamp)
+
+            if self.onFrame is not None:
+                self.onFrame(frame)
+
+            # hand the frame over to the consumers, replacing any frame they
+            # didn't get to yet
+            frame.stages[STAGE_POSTED] = clock()
+            frame.stages[STAGE_DRAWN] = 0.0
+            self.latencies.recordFrame(frame)
+            self.frameBuffer.put(frame)
+        return None
+
+    def readRaw(self):
+        # read linear camera and IR sensor data straight into a preallocated
+        # frame, no parsing is needed, IR responses only bring the IR values
+        # and the camera pixels are those of the last data response, None
+        # when the data didn't come whole (considered as a faulty connection)
+        frame = self._frames.acquire()
+        view = memoryview(frame.data)
+        frame.irOnly = bool(self._requests) and self._requests[0][1] == protocol.CMD_IR
+        if frame.irOnly:
+            frame.data[:protocol.CAMERA_PIXELS] = self._camera
+            view = view[protocol.CAMERA_PIXELS:]
+        if readInto(self.link, view[:1]) < 1:
+            return None
+        frame.stages[STAGE_FIRST_BYTE] = clock()
+        if readInto(self.link, view[1:]) < len(view) - 1:
+            return None
+        frame.stages[STAGE_COMPLETE] = frame.stages[STAGE_DECODED] = clock()
+        if not frame.irOnly:
+            self._camera[:] = frame.camera
+        return frame
+
+    def writeCommands(self):
+        # writer thread, commands don't wait for the next frame
+        while True:
+            entry = self.scheduler.takeEntry()
+            if entry is None:
+                # closed, the acquisition ended
+                return
+            queued, command = entry
+            try:
+                self.send(command)
+            except (OSError, serial.SerialException):
+                # the acquisition thread finds out as well
+                return
+            self.latencies.record(COMMAND_WRITTEN, clock() - queued)
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.recordCommand(command)
+
+    def readFramed(self):
+        # next valid frame, None when nothing valid came within the timeout
+        parser = self.parser
+        deadline = clock() + (self.link.timeout or 0)
+        while True:
+            frame = parser.next()
+            # before the requests so that the next frame is a keyframe
+            if parser.takeKeyframeRequest():
+                self.send(protocol.compressionCommand(self.compression))
+            # every missing frame took a request with it
+            missing = parser.takeMissing()
+            for i in range(min(missing, len(self._requests))):
+                self._requests.popleft()
+            if missing and self.pause is None:
+                self.requestDue()
+            if frame is not None:
+                frame.stages[STAGE_FIRST_BYTE] = self._firstByte
+                frame.stages[STAGE_COMPLETE] = self._lastRead
+                frame.stages[STAGE_DECODED] = clock()
+                # what is left belongs to the next frame
+                self._firstByte = self._lastRead if len(parser) else 0.0
+                return frame
+            if clock() >= deadline or (self.pause is None and not self._requests and not len(parser)):
+                return None
+            data = self.link.read(max(1, self.link.in_waiting))
+            if not data:
+                return None
+            self._lastRead = clock()
+            if not len(parser) or not self._firstByte:
+                self._firstByte = self._lastRead
+            parser.feed(data)
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+# acquisition benchmarks run against the PRisme emulator, no robot required
+#
+#   python -m prisme.bench                 run the acquisition thread
+#   python -m prisme.bench --raw           measure the bare link for reference
+#   python -m prisme.bench --baud 115200 --duration 20 --drop 0.001
+#   python -m prisme.bench --depth 2       keep two data requests in flight
+#   python -m prisme.bench --stream 0      have the device stream frames
+#   python -m prisme.bench --devices 16    sixteen devices from one thread
+#   python -m prisme.bench --sweep         frames/s at every supported rate
+#   python -m prisme.bench --compress 32   compressed frames, keyframe every 32
+#   python -m prisme.bench --compare       compression gain on typical frames
+#   python -m prisme.bench --track 50      light tracking in a simulated world
+#   python -m prisme.bench --camera-rate 5 --ir-rate 50
+#   python -m prisme.bench --calibration   per frame cost of the pixel correction
+import sys, time, math, bisect, argparse, threading
+from timeit import default_timer as clock
+
+import serial
+
+from prisme import protocol
+from prisme.acquisition import negotiateBaudrate, enableFraming
+from prisme.emulator import PrismeEmulator, lightSource
+from prisme.latency import Latencies, STAGE_POSTED, STAGE_DRAWN
+
+def percentile(values, p):
+    # nearest rank percentile of an unsorted list
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+class Result(object):
+    def __init__(self, name, duration):
+        self.name = name
+        self.duration = duration
+        # device acquisition start to frame available latencies, in seconds
+        self.latencies = []
+        # command queued to command received by the device latencies
+        self.commandLatencies = []
+        self.frames = 0
+        self.errors = 0
+        # frames the consumer didn't get
+        self.dropped = 0
+        # frames missing from the sequence of framed data responses
+        self.lost = 0
+        # share of a core used by the acquisition thread, when measured
+        self.load = None
+        # rate negotiated with the emulator, 0 for an unlimited link
+        self.baudrate = None
+        # frame bytes per payload byte received with compressed frames
+        self.compression = None
+        # commands the scheduler replaced by newer ones or dropped, and the
+        # most it held at once
+        self.coalesced = 0
+        self.queueDepth = None
+        # per stage latencies measured by the host, None for the raw link
+        self.stages = None
+        # IR responses received and their IR reading to available latencies
+        self.irFrames = 0
+        self.irLatencies = []
+
+    def report(self, out=sys.stdout):
+        out.write('%s\n' % self.name)
+        out.write('  frames          %d in %.2f s, %.2f frames/s\n' % (self.frames, self.duration, self.frames / self.duration if self.duration else 0))
+        if self.errors:
+            out.write('  errors          %d\n' % self.errors)
+        if self.dropped:
+            out.write('  dropped         %d\n' % self.dropped)
+        if self.lost:
+            out.write('  lost            %d\n' % self.lost)
+        if self.load is not None:
+            out.write('  load            %.1f%% of a core\n' % (self.load * 100))
+        if self.compression is not None:
+            out.write('  compression     %.2f:1\n' % self.compression)
+        if self.queueDepth is not None:
+            out.write('  command queue   %d at most, %d coalesced\n' % (self.queueDepth, self.coalesced))
+        if self.irFrames:
+            out.write('  IR responses    %d, %.2f/s\n' % (self.irFrames, self.irFrames / self.duration if self.duration else 0))
+        for label, values in (('frame latency', self.latencies), ('IR latency', self.irLatencies),
+                ('command latency', self.commandLatencies)):
+            if not values:
+                continue
+            out.write('  %-15s p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms (%d samples)\n' % (label,
+                percentile(values, 50) * 1e3, percentile(values, 90) * 1e3, percentile(values, 99) * 1e3,
+                max(values) * 1e3, len(values)))
+
+def matchFrames(emulator, received, skip=0):
+    # received holds (sequence number, time) pairs, frame n of the host is
+    # frame skip + n acquired by the emulator whether it was requested or
+    # streamed: the host counts frames from 0, framed responses carry the
+    # emulator's count since framing was enabled so lost frames are skipped
+    return [r - emulator.frameTimes[skip + n] for n, r in received if skip + n < len(emulator.frameTimes)]
+
+def speedCommand(sent):
+    # speed commands differ from one to the next so that they can be told
+    # apart on reception, the scheduler may drop some
+    return protocol.speedCommand(20 + len(sent) % 80, 20)
+
+def matchCommands(emulator, sent, command):
+    # pair the (time, command) queued by the host with their reception by the
+    # emulator, by content, to compute the command to acknowledge latency
+    queued = {}
+    for t, data in sent:
+        queued.setdefault(data, []).append(t)
+    latencies = []
+    for t, data in emulator.commands:
+        if data[:1] != command or data not in queued:
+            continue
+        # the last one queued before it arrived
+        index = bisect.bisect_right(queued[data], t)
+        if index:
+            latencies.append(t - queued[data][index - 1])
+    return latencies
+
+def describe(name, baudrate, pause, depth):
+    if pause is not None:
+        mode = 'streaming, %d ms pause' % pause
+    elif depth > 1:
+        mode = '%d requests in flight' % depth
+    else:
+        mode = 'stop-and-wait'
+    if not baudrate:
+        return '%s (%s), unlimited link' % (name, mode)
+    return '%s (%s) @ %d baud' % (name, mode, baudrate)
+
+def connect(emulator, baudrate=None, framing=False):
+    # open the link at the default rate and negotiate up to baudrate like the
+    # application does, an unlimited emulator has no rate to negotiate
+    link = serial.Serial(port=emulator.port, baudrate=protocol.DEFAULT_BAUDRATE, timeout=1, writeTimeout=1)
+    if emulator.baudrate:
+        negotiateBaudrate(link, baudrate)
+    return link, framing and enableFraming(link)
+
+def benchRaw(emulator, duration, commandInterval, pause=None, depth=1, baudrate=None, framing=False, compression=None):
+    # plain acquisition loop without any application overhead, this is the
+    # best Acquisition can do on the given link, data responses aren't framed
+    link, framed = connect(emulator, baudrate)
+    skip = len(emulator.frameTimes)
+    result = Result(describe('raw link', emulator.baudrate, pause, depth), duration)
+    result.baudrate = emulator.baudrate
+    received = []
+    sent = []
+    if pause is None:
+        for i in range(depth - 1):
+            link.write(protocol.CMD_DATA)
+    else:
+        link.write(protocol.streamCommand(pause))
+    nextCommand = clock()
+    clockStart = clock()
+    while clock() - clockStart < duration:
+        if clock() >= nextCommand:
+            command = speedCommand(sent)
+            sent.append((clock(), command))
+            link.write(command)
+            nextCommand += commandInterval
+        if pause is None:
+            link.write(protocol.CMD_DATA)
+        if len(link.read(protocol.FRAME_SIZE)) < protocol.FRAME_SIZE:
+            result.errors += 1
+            continue
+        received.append((len(received), clock()))
+    result.duration = clock() - clockStart
+    link.write(protocol.CMD_RESET)
+    link.close()
+    result.frames = len(received)
+    result.latencies = matchFrames(emulator, received, skip)
+    result.commandLatencies = matchCommands(emulator, sent, protocol.CMD_SPEED)
+    return result
+
+def benchAcquisition(emulator, duration, commandInterval, pause=None, depth=1, baudrate=None, framing=False,
+        compression=None, cameraRate=None, irRate=None):
+    # drive the application's acquisition thread, the user interface is
+    # replaced by a thread taking every frame as it comes, with IR requests
+    # frames are matched to the emulator's in order and IR responses as well
+    from prisme.acquisition import Acquisition
+    from prisme.framebuffer import FrameBuffer
+
+    link, framed = connect(emulator, baudrate, framing)
+    # the framing probe frame is the emulator's first framed one, frames
+    # matched in order start after it
+    skip = len(emulator.frameTimes) - (1 if framed and not irRate else 0)
+    name = 'Acquisition' + (', framed' if framed else '') + (', compressed' if framed and compression else '')
+    result = Result(describe(name, emulator.baudrate, pause, depth), duration)
+    result.baudrate = emulator.baudrate
+    updates = []
+    irUpdates = []
+    sent = []
+
+    def consume():
+        while acquisition.is_alive() or len(acquisition.frameBuffer):
+            frame = acquisition.frameBuffer.get(0.1)
+            if frame is not None:
+                if frame.irOnly:
+                    irUpdates.append((len(irUpdates), clock()))
+                else:
+                    updates.append((len(updates) if irRate else frame.sequence, clock()))
+                frame.stages[STAGE_DRAWN] = clock()
+                acquisition.latencies.recordFrame(frame, STAGE_POSTED, STAGE_DRAWN)
+
+    # large enough for the consumer never to miss a frame
+    acquisition = Acquisition(link, pause, depth, FrameBuffer(1024), framed=framed, compression=compression,
+        cameraRate=cameraRate, irRate=irRate)
+    consumer = threading.Thread(target=consume)
+    clockStart = clock()
+    acquisition.start()
+    consumer.start()
+    nextCommand = clockStart + commandInterval
+    while clock() - clockStart < duration and acquisition.is_alive():
+        time.sleep(max(0, min(nextCommand, clockStart + duration) - clock()))
+        if clock() >= nextCommand:
+            command = speedCommand(sent)
+            sent.append((clock(), command))
+            acquisition.queueCommand(command)
+            nextCommand += commandInterval
+    acquisition.stop()
+    acquisition.join()
+    consumer.join()
+    result.duration = clock() - clockStart
+
+    result.frames = len(updates)
+    result.dropped = acquisition.frameBuffer.dropped
+    result.stages = acquisition.latencies
+    result.coalesced = acquisition.scheduler.coalesced
+    result.queueDepth = acquisition.scheduler.maxDepth
+    if acquisition.parser is not None:
+        result.errors = acquisition.parser.corrupted
+        result.lost = acquisition.parser.lost
+        if compression:
+            result.compression = acquisition.parser.compressionRatio
+    result.latencies = matchFrames(emulator, updates, skip)
+    result.commandLatencies = matchCommands(emulator, sent, protocol.CMD_SPEED)
+    result.irFrames = len(irUpdates)
+    result.irLatencies = [r - emulator.irTimes[n] for n, r in irUpdates if n < len(emulator.irTimes)]
+    return result
+
+def benchDevices(emulators, duration, commandInterval, pause=None, depth=1, baudrate=None, framing=False, compression=None):
+    # every emulator handled by a single DeviceLoop thread, frame rates and
+    # latencies are for all the devices together
+    from prisme.devices import Device, DeviceLoop
+
+    loop = DeviceLoop()
+    devices = []
+    updates = {}
+    sent = {}
+    for emulator in emulators:
+        device = loop.add(Device(emulator.port, baudrate if emulator.baudrate else protocol.DEFAULT_BAUDRATE, pause, depth,
+            framing=framing, compression=compression))
+        updates[device] = []
+        sent[device] = []
+        device.onFrame = lambda frame, received=updates[device]: received.append((frame.sequence, clock()))
+        devices.append(device)
+    clockStart = clock()
+    loop.start()
+    nextCommand = clockStart + commandInterval
+    while clock() - clockStart < duration:
+        time.sleep(max(0, min(nextCommand, clockStart + duration) - clock()))
+        if clock() >= nextCommand:
+            for device in devices:
+                command = speedCommand(sent[device])
+                sent[device].append((clock(), command))
+                device.queueCommand(command)
+            nextCommand += commandInterval
+    load = loop.load
+    loop.stop()
+    loop.join()
+    baudrate = devices[0].baudrate if emulators[0].baudrate else 0
+    result = Result(describe('DeviceLoop, %d devices' % len(emulators), baudrate, pause, depth), clock() - clockStart)
+    result.baudrate = baudrate
+    result.load = load
+
+    frameBytes = payloadBytes = 0
+    result.queueDepth = 0
+    result.stages = Latencies()
+    for emulator, device in zip(emulators, devices):
+        result.frames += device.frames
+        for name, histogram in device.latencies.histograms.items():
+            result.stages[name].add(histogram)
+        result.coalesced += device.scheduler.coalesced
+        result.queueDepth = max(result.queueDepth, device.scheduler.maxDepth)
+        if device.parser is not None:
+            result.errors += device.parser.corrupted
+            result.lost += device.parser.lost
+            frameBytes += device.parser.frames * protocol.FRAME_SIZE
+            payloadBytes += device.parser.payloadBytes
+        skip = device.probes - (1 if device.parser is not None else 0)
+        result.latencies += matchFrames(emulator, updates[device], skip)
+        result.commandLatencies += matchCommands(emulator, sent[device], protocol.CMD_SPEED)
+    if compression and payloadBytes:
+        result.compression = float(frameBytes) / payloadBytes
+    return result
+
+def benchTracking(emulator, world, speed, duration, pause=None, depth=1, baudrate=None, framing=False, compression=None):
+    # the acquisition runs the light tracker in a simulated world until the
+    # robot reaches the light, the command latencies go from the host having
+    # the frame to the device having the command
+    from prisme.acquisition import Acquisition
+    from prisme.control import LightTracker
+
+    link, framed = connect(emulator, baudrate, framing)
+    result = Result(describe('LightTracker', emulator.baudrate, pause, depth), duration)
+    result.baudrate = emulator.baudrate
+    sent = []
+    tracker = LightTracker(speed)
+    update = tracker.update
+
+    def track(frame):
+        command = update(frame)
+        if command is not None:
+            sent.append((frame.timestamp, command))
+        return command
+    tracker.update = track
+
+    acquisition = Acquisition(link, pause, depth, framed=framed, compression=compression)
+    acquisition.controller = tracker
+    clockStart = clock()
+    acquisition.start()
+    while clock() - clockStart < duration and acquisition.is_alive() and world.reachedAt is None:
+        time.sleep(0.05)
+    acquisition.stop()
+    acquisition.join()
+    result.duration = clock() - clockStart
+
+    result.frames = acquisition.sequence
+    result.stages = acquisition.latencies
+    if acquisition.parser is not None:
+        result.errors = acquisition.parser.corrupted
+        result.lost = acquisition.parser.lost
+    result.commandLatencies = matchCommands(emulator, sent, protocol.CMD_SPEED)
+    return result
+
+def reportWorld(world, clockStart, out=sys.stdout):
+    if world.reachedAt is not None:
+        out.write('  light           reached in %.2f s\n' % (world.reachedAt - clockStart))
+    else:
+        out.write('  light           %.2f m away, %.0f° off\n' % (world.distance, math.degrees(world.lightBearing)))
+    out.write('  driven          %.2f m, %d collisions\n' % (world.travelled, world.collisions))
+
+# camera content the compression is compared on, from a still scene to one
+# noisy enough for every frame to be a keyframe
+SEQUENCES = [
+    ('still', dict(drift=0.0, noise=1)),
+    ('drifting', dict(drift=0.5, noise=3)),
+    ('moving', dict(drift=5.0, noise=3)),
+    ('noisy', dict(drift=0.5, noise=12)),
+]
+
+def benchCalibration(count=1000, seed=0, out=sys.stdout):
+    # per frame cost of the correction and filters, one frame at a time as
+    # from the acquisition thread and over a whole session at once, on a camera
+    # with made up pixel offsets and gains
+    import random, numpy
+    from prisme.calibration import Calibration, CalibrationPipeline, EmaFilter, MedianFilter, clip
+    from prisme.frame import Frame
+    rand = random.Random(seed)
+    offsets = numpy.array([rand.uniform(0, 15) for i in range(protocol.CAMERA_PIXELS)], numpy.float32)
+    gains = numpy.array([rand.uniform(0.8, 1.2) for i in range(protocol.CAMERA_PIXELS)], numpy.float32)
+
+    class Camera(object):
+        intTime = 100
+
+    def sense(scene):
+        return clip(numpy.asarray(scene, numpy.float32) * gains + offsets).astype(numpy.uint8)
+    # below saturation, clipped pixels can't be corrected
+    source = lightSource(peak=180, drift=0.5, seed=seed)
+    scenes = numpy.array([bytearray(source(Camera)) for i in range(count)], numpy.uint8)
+    cameras = sense(scenes)
+    calibration = Calibration(offsets, sense(numpy.full(protocol.CAMERA_PIXELS, 180)))
+    # the correction brings every pixel to the mean gain
+    expected = scenes * gains.mean()
+    out.write('fixed pattern error %.2f before, %.2f after correction (mean, in pixel values)\n' % (
+        numpy.abs(cameras - offsets.mean() - expected).mean(), numpy.abs(calibration.applyBatch(cameras) - expected).mean()))
+    for name, filter in (('correction', None), ('+ average', EmaFilter()), ('+ median', MedianFilter())):
+        pipeline = CalibrationPipeline(calibration, filter)
+        frames = [Frame(bytes(camera) + bytes(protocol.IR_SENSORS)) for camera in cameras]
+        clockStart = clock()
+        for frame in frames:
+            pipeline.process(frame)
+        single = (clock() - clockStart) / count
+        clockStart = clock()
+        pipeline.processBatch(cameras)
+        batch = (clock() - clockStart) / count
+        out.write('%-12s %8.2f μs/frame, %8.2f μs/frame in a batch\n' % (name, single * 1e6, batch * 1e6))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark PRisme acquisition against the emulator')
+    parser.add_argument('--baud', type=int, default=protocol.DEFAULT_BAUDRATE, help='rate negotiated with the emulator, 0 for an unlimited link')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per benchmark')
+    parser.add_argument('--int-time', type=int, default=100, help='camera integration time [μs]')
+    parser.add_argument('--command-interval', type=float, default=0.25, help='seconds between speed commands')
+    parser.add_argument('--link-latency', type=float, default=0.004, help='emulated USB adapter round trip latency [s]')
+    parser.add_argument('--drift', type=float, default=0.5, help='light source drift in pixels per frame')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of dropping an outgoing byte')
+    parser.add_argument('--noise', type=float, default=0.0, help='probability of inserting a random byte')
+    parser.add_argument('--truncate', type=float, default=0.0, help='probability of truncating a frame')
+    parser.add_argument('--depth', type=int, default=1, help='data requests kept in flight when polling')
+    parser.add_argument('--stream', type=int, metavar='FPS', help='have the device stream at this frame rate, 0 for maximum')
+    parser.add_argument('--raw', action='store_true', help='only measure the bare link')
+    parser.add_argument('--devices', type=int, metavar='N', help='run N emulated devices from a single thread')
+    parser.add_argument('--sweep', action='store_true', help='measure the acquisition at every supported rate')
+    parser.add_argument('--unframed', action='store_true', help="don't ask for framed data responses")
+    parser.add_argument('--compress', type=int, metavar='N', help='compress framed data responses, a keyframe every N frames')
+    parser.add_argument('--compare', action='store_true', help='frames/s with and without compression on typical camera content')
+    parser.add_argument('--stages', action='store_true', help='print the latency of every pipeline stage')
+    parser.add_argument('--camera-rate', type=float, metavar='HZ', help='frames per second when polling')
+    parser.add_argument('--ir-rate', type=float, metavar='HZ', help='also poll the IR sensors alone at this rate')
+    parser.add_argument('--track', type=int, nargs='?', const=50, metavar='SPEED',
+        help='drive towards a light around an obstacle in a simulated world at this speed [%%]')
+    parser.add_argument('--calibration', action='store_true', help='measure the per pixel correction alone, without emulator')
+    args = parser.parse_args(argv)
+
+    if args.calibration:
+        benchCalibration()
+        return
+
+    pause = None
+    if args.stream is not None:
+        pause = protocol.streamPause(args.stream, args.baud or 1e9, args.int_time)
+
+    def emulate(seed, camera=None, ir=None):
+        # like the firmware the emulator starts at the default rate
+        camera = camera or lightSource(drift=args.drift, seed=seed)
+        emulator = PrismeEmulator(baudrate=protocol.DEFAULT_BAUDRATE if args.baud else 0, camera=camera, ir=ir,
+            intTime=args.int_time, seed=seed)
+        emulator.linkLatency = args.link_latency
+        emulator.dropRate = args.drop
+        emulator.noiseRate = args.noise
+        emulator.truncateRate = args.truncate
+        return emulator
+
+    if args.devices:
+        emulators = [emulate(seed).start() for seed in range(args.devices)]
+        try:
+            result = benchDevices(emulators, args.duration, args.command_interval, pause, max(1, args.depth), args.baud,
+                not args.unframed, args.compress)
+        finally:
+            for emulator in emulators:
+                emulator.stop()
+        result.report()
+        if args.stages:
+            result.stages.report(sys.stdout)
+        return
+
+    if args.track is not None:
+        # the light starts out of sight, an obstacle stands on the way
+        from prisme.world import World
+        world = World(light=(1.2, 0.9), obstacles=[(0.6, 0.45, 0.08)])
+        with emulate(0, world.camera, world.ir) as emulator:
+            clockStart = clock()
+            result = benchTracking(emulator, world, args.track, args.duration, pause, max(1, args.depth), args.baud,
+                not args.unframed, args.compress)
+        result.report()
+        reportWorld(world, clockStart)
+        if args.stages:
+            result.stages.report(sys.stdout)
+        return
+
+    if args.sweep:
+        # one line per rate, the link limit is the frame rate the transmission
+        # alone allows
+        sys.stdout.write('%8s %10s %10s %10s\n' % ('baud', 'frames/s', 'link limit', 'p50 [ms]'))
+        for baudrate in protocol.BAUDRATES:
+            if args.stream is not None:
+                pause = protocol.streamPause(args.stream, baudrate, args.int_time)
+            with emulate(0) as emulator:
+                result = benchAcquisition(emulator, args.duration, args.command_interval, pause, max(1, args.depth), baudrate,
+                    not args.unframed, args.compress)
+            sys.stdout.write('%8d %10.2f %10.2f %10.2f\n' % (result.baudrate, result.frames / result.duration,
+                result.baudrate / (10.0 * protocol.FRAME_SIZE), percentile(result.latencies, 50) * 1e3))
+            sys.stdout.flush()
+        return
+
+    if args.compare:
+        # one line per camera sequence, the gain is in frames/s over the same
+        # sequence sent whole
+        keyframeInterval = args.compress or protocol.KEYFRAME_INTERVAL
+        sys.stdout.write('%-10s %10s %10s %10s %8s\n' % ('sequence', 'whole', 'compressed', 'ratio', 'gain'))
+        for name, options in SEQUENCES:
+            rates = []
+            for compression in (None, keyframeInterval):
+                with emulate(0, lightSource(seed=0, **options)) as emulator:
+                    result = benchAcquisition(emulator, args.duration, args.command_interval, pause, max(1, args.depth),
+                        args.baud, True, compression)
+                rates.append(result.frames / result.duration)
+            sys.stdout.write('%-10s %10.2f %10.2f %9.2f:1 %7.0f%%\n' % (name, rates[0], rates[1], result.compression or 1.0,
+                (rates[1] / rates[0] - 1) * 100 if rates[0] else 0))
+            sys.stdout.flush()
+        return
+
+    if args.camera_rate or args.ir_rate:
+        # only the acquisition thread polls at set rates
+        with emulate(0) as emulator:
+            result = benchAcquisition(emulator, args.duration, args.command_interval, pause, max(1, args.depth), args.baud,
+                not args.unframed, args.compress, args.camera_rate, args.ir_rate)
+        result.report()
+        if args.stages:
+            result.stages.report(sys.stdout)
+        return
+
+    benchmarks = [benchRaw] if args.raw else [benchRaw, benchAcquisition]
+    for benchmark in benchmarks:
+        with emulate(0) as emulator:
+            result = benchmark(emulator, args.duration, args.command_interval, pause, max(1, args.depth), args.baud,
+                not args.unframed, args.compress)
+        result.report()
+        if args.stages and result.stages is not None:
+            result.stages.report(sys.stdout)
+
+if __name__ == '__main__':
+    main()
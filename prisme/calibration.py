@@ -0,0 +1,254 @@
+# per pixel correction of the linear camera: a dark frame (lens covered)
+# gives every pixel's offset and a flat frame (evenly lit) its gain, so that
+# fixed pattern noise and gain differences don't move the peak, then an
+# optional temporal filter; every step is a few numpy operations on buffers
+# allocated once, a frame takes microseconds
+#
+#   calibration = Calibration.capture(darkFrames, flatFrames)
+#   calibration.save(calibrationPath(port))
+#   pipeline = CalibrationPipeline(Calibration.load(calibrationPath(port)), EmaFilter(0.2))
+#   acquisition.calibration = pipeline           every frame, corrected in place
+#   pipeline.processBatch(session.frameArray(cameraOnly=True)[:, :102])  whole sessions
+import os
+
+import numpy
+
+from prisme import protocol, stats
+
+# where the calibration of every device is kept
+CALIBRATION_DIRECTORY = os.path.join(os.path.expanduser('~'), '.prisme', 'calibration')
+# flat - dark below this (dead or saturated pixels) keeps a gain of 1
+MIN_RESPONSE = 4.0
+# rows of a batch the moving average is computed over at once, (1 - alpha)
+# to the power of minus their number stays below EMA_BLOCK_RANGE so that its
+# closed form keeps its precision
+EMA_BLOCK_ROWS = 1024
+EMA_BLOCK_RANGE = 1e6
+
+def clip(values, out=None):
+    # values brought back to 0 to 255, in place by default: numpy.clip costs
+    # several times more on a single frame
+    if out is None:
+        out = values
+    numpy.maximum(values, 0, out=out)
+    return numpy.minimum(out, 255, out=out)
+
+def deviceKey(port):
+    # name the calibration of the device on port is kept under: the USB serial
+    # number where the adapter has one, the port name otherwise
+    try:
+        from serial.tools.list_ports import comports
+        for info in comports():
+            if info.device == port and info.serial_number:
+                return info.serial_number
+    except ImportError:
+        pass
+    return os.path.splitext(os.path.basename(port))[0]
+
+def calibrationPath(port):
+    return os.path.join(CALIBRATION_DIRECTORY, deviceKey(port) + '.npz')
+
+def averageFrames(frames):
+    # mean camera of frames, an array of one per row (whole frames or their
+    # cameras) or a sequence of frames (copied first, pool frames are reused)
+    if isinstance(frames, numpy.ndarray):
+        cameras = frames
+    else:
+        cameras = numpy.array([stats.cameraArray(frame) for frame in frames], dtype=numpy.uint8)
+    return cameras[:, :protocol.CAMERA_PIXELS].mean(axis=0, dtype=numpy.float32)
+
+class Calibration(object):
+    def __init__(self, dark=None, flat=None):
+        pixels = protocol.CAMERA_PIXELS
+        # mean dark and flat frames, no offset and a gain of 1 without them
+        self.dark = numpy.zeros(pixels, numpy.float32) if dark is None else numpy.asarray(dark, numpy.float32)
+        self.flat = None if flat is None else numpy.asarray(flat, numpy.float32)
+        self.gain = numpy.ones(pixels, numpy.float32)
+        if self.flat is not None:
+            # every pixel brought to the mean response
+            response = self.flat - self.dark
+            valid = response >= MIN_RESPONSE
+            if valid.any():
+                self.gain[valid] = response[valid].mean() / response[valid]
+        self._buffer = numpy.empty(pixels, numpy.float32)
+
+    @classmethod
+    def capture(cls, darkFrames, flatFrames=None):
+        return cls(averageFrames(darkFrames), None if flatFrames is None else averageFrames(flatFrames))
+
+    @classmethod
+    def load(cls, path):
+        # None when the device was never calibrated
+        if not os.path.exists(path):
+            return None
+        with numpy.load(path) as data:
+            return cls(data['dark'], data['flat'] if 'flat' in data else None)
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        arrays = {'dark': self.dark}
+        if self.flat is not None:
+            arrays['flat'] = self.flat
+        # numpy adds the extension to names without it
+        with open(path, 'wb') as out:
+            numpy.savez(out, **arrays)
+
+    def applyFloat(self, camera):
+        # corrected pixels as floats, in a buffer reused by the next call
+        buffer = self._buffer
+        numpy.subtract(camera, self.dark, out=buffer)
+        numpy.multiply(buffer, self.gain, out=buffer)
+        return buffer
+
+    def apply(self, camera, out=None):
+        # corrected pixels as bytes, into out (it may be camera itself)
+        buffer = clip(self.applyFloat(camera))
+        if out is None:
+            return buffer.astype(numpy.uint8)
+        out[...] = buffer
+        return out
+
+    def applyBatchFloat(self, cameras):
+        # one frame per row, a new array of floats
+        return (numpy.asarray(cameras, numpy.float32) - self.dark) * self.gain
+
+    def applyBatch(self, cameras):
+        # one frame per row, a new array of bytes
+        return numpy.clip(self.applyBatchFloat(cameras), 0, 255).astype(numpy.uint8)
+
+class EmaFilter(object):
+    # exponential moving average of every pixel, alpha is the weight of the
+    # new frame: less noise for a slower response to changes
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._state = numpy.empty(protocol.CAMERA_PIXELS, numpy.float32)
+        self._started = False
+
+    def reset(self):
+        self._started = False
+
+    def apply(self, values):
+        # filtered values, in a buffer reused by the next call
+        if not self._started:
+            self._state[:] = values
+            self._started = True
+        else:
+            self._state += self.alpha * (values - self._state)
+        return self._state
+
+    def applyBatch(self, cameras):
+        # every row filtered after the previous ones, from a fresh state, the
+        # state of the last row is kept for apply(); the recursion in closed
+        # form over blocks of rows, with b = 1 - alpha and s the state before
+        # the block: y[j] = b^j * (s + alpha * sum(b^-k * x[k] for k <= j))
+        cameras = numpy.asarray(cameras, numpy.float64)
+        out = numpy.empty(cameras.shape, numpy.float32)
+        self.reset()
+        if not len(cameras):
+            return out
+        decay = 1.0 - self.alpha
+        if decay <= 0 or decay >= 1:
+            # no memory at all, or nothing but the first row
+            out[:] = cameras if decay <= 0 else cameras[0]
+        else:
+            rows = int(max(1, min(EMA_BLOCK_ROWS, numpy.log(EMA_BLOCK_RANGE) / -numpy.log(decay))))
+            powers = decay ** numpy.arange(1, rows + 1)
+            weights = (self.alpha / powers)[:, None]
+            powers = powers[:, None]
+            state = cameras[0]
+            out[0] = state
+            for start in range(1, len(cameras), rows):
+                block = cameras[start:start + rows]
+                count = len(block)
+                sums = numpy.cumsum(block * weights[:count], axis=0)
+                sums += state
+                sums *= powers[:count]
+                out[start:start + count] = sums
+                state = sums[-1]
+        self._state[:] = out[-1]
+        self._started = True
+        return out
+
+class MedianFilter(object):
+    # median of every pixel over the last length frames, removes single frame
+    # glitches without blurring steps
+    def __init__(self, length=5):
+        self.length = length
+        self._frames = numpy.empty((length, protocol.CAMERA_PIXELS), numpy.float32)
+        # sorted in place, a few times faster than numpy.median on so few rows
+        self._sorted = numpy.empty_like(self._frames)
+        self._out = numpy.empty(protocol.CAMERA_PIXELS, numpy.float32)
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+    def apply(self, values):
+        # filtered values, in a buffer reused by the next call
+        self._frames[self.count % self.length] = values
+        self.count += 1
+        count = min(self.count, self.length)
+        window = self._sorted[:count]
+        window[...] = self._frames[:count]
+        window.sort(axis=0)
+        if count % 2:
+            self._out[:] = window[count // 2]
+        else:
+            numpy.add(window[count // 2 - 1], window[count // 2], out=self._out)
+            self._out *= 0.5
+        return self._out
+
+    def applyBatch(self, cameras):
+        # median of every row with the length - 1 before it, in one pass
+        cameras = numpy.asarray(cameras, numpy.float32)
+        out = numpy.empty_like(cameras)
+        # the first rows have fewer frames before them
+        self.reset()
+        for i in range(min(self.length - 1, len(cameras))):
+            out[i] = self.apply(cameras[i])
+        if len(cameras) >= self.length:
+            count = len(cameras) - self.length + 1
+            # every window along the last axis, sorted like in apply()
+            windows = numpy.stack([cameras[i:i + count] for i in range(self.length)], axis=-1)
+            windows.sort(axis=-1)
+            middle = self.length // 2
+            if self.length % 2:
+                out[self.length - 1:] = windows[..., middle]
+            else:
+                out[self.length - 1:] = (windows[..., middle - 1] + windows[..., middle]) * numpy.float32(0.5)
+        return out
+
+class CalibrationPipeline(object):
+    # correction then filter of the camera of every frame, in place, from the
+    # acquisition thread (see Acquisition.calibration)
+    def __init__(self, calibration=None, filter=None):
+        self.calibration = calibration if calibration is not None else Calibration()
+        self.filter = filter
+        # pixels of the last frame, for the IR responses which carry the
+        # camera of the last data response as received
+        self._last = numpy.zeros(protocol.CAMERA_PIXELS, numpy.uint8)
+        self._values = numpy.empty(protocol.CAMERA_PIXELS, numpy.float32)
+
+    def reset(self):
+        if self.filter is not None:
+            self.filter.reset()
+
+    def process(self, frame):
+        camera = stats.cameraArray(frame)
+        if not frame.irOnly:
+            values = self.calibration.applyFloat(camera)
+            if self.filter is not None:
+                values = self.filter.apply(values)
+            # the filter keeps its own values
+            self._last[:] = clip(values, self._values)
+        camera[:] = self._last
+
+    def processBatch(self, cameras):
+        # a new array of corrected and filtered frames, one per row, without
+        # IR responses (see SessionReader.frameArray) as process() skips them
+        values = self.calibration.applyBatchFloat(cameras)
+        if self.filter is not None:
+            values = self.filter.applyBatch(values)
+        return numpy.clip(values, 0, 255).astype(numpy.uint8)
@@ -0,0 +1,514 @@
+# headless PRisme Control Center: records, streams or prints statistics from
+# a device (or a replayed session) without any GUI toolkit
+#
+#   python prisme_control_center.py record /dev/ttyUSB0 session.prs --duration 60
+#   python prisme_control_center.py stream /dev/ttyUSB0 --fps 20
+#   python prisme_control_center.py stats session.prs --speed 0
+#   python prisme_control_center.py monitor /dev/ttyUSB0 /dev/ttyUSB1 /dev/ttyUSB2
+#   python prisme_control_center.py analyze session.prs
+#   python prisme_control_center.py ports --watch
+#   python prisme_control_center.py serve /dev/ttyUSB0 --listen /tmp/prisme.sock
+#   python prisme_control_center.py calibrate /dev/ttyUSB0
+#   python prisme_control_center.py stats /dev/ttyUSB0 --calibrate --filter ema:0.2
+import os, sys, time, socket, argparse, threading
+from timeit import default_timer as clock
+
+import serial
+
+from prisme import protocol
+from prisme.acquisition import Acquisition, openLink, handshake, negotiateBaudrate, enableFraming, probeInfrared, PIPELINE_DEPTH, FRAME_POOL_SIZE, DISCONNECT_ERROR
+from prisme.framebuffer import FrameBuffer
+from prisme.latency import STAGE_POSTED, STAGE_DRAWN
+
+def startAcquisition(args, recorder=None):
+    # the calibration is read before anything is opened, nothing is left to
+    # clean up when it is missing; the recorder gets every frame and command
+    # from the start
+    calibration = None
+    if getattr(args, 'calibrate', None) is not None or getattr(args, 'filter', None) is not None:
+        calibration = loadCalibration(args, args.port)
+        if calibration is None:
+            return None
+    try:
+        link = openLink(args.port, protocol.DEFAULT_BAUDRATE, args.speed)
+    except (serial.SerialException, IOError, ValueError) as e:
+        sys.stderr.write('Could not connect to %s: %s\n' % (args.port, e))
+        return None
+    intTime = handshake(link)
+    if intTime is None:
+        sys.stderr.write('%s does not answer, check connection please\n' % args.port)
+        link.close()
+        return None
+    baudrate = negotiateBaudrate(link, args.baud)
+    framed = not args.unframed and enableFraming(link)
+    sys.stderr.write('Connected to %s at %d baud%s\n' % (args.port, baudrate, ', framed' if framed else ''))
+
+    pause = None
+    if args.fps is not None:
+        pause = protocol.streamPause(args.fps, baudrate, intTime)
+    # IR values at a rate of their own when polling
+    irRate = args.ir_rate if pause is None else None
+    if irRate and not probeInfrared(link, framed):
+        sys.stderr.write('%s does not answer IR requests, IR values only come with the frames\n' % args.port)
+        irRate = None
+    # smaller than the frame pool so that queued frames are never reused
+    # under the consumer, a consumer lagging behind loses the oldest ones
+    acquisition = Acquisition(link, pause, args.depth, FrameBuffer(FRAME_POOL_SIZE - 2), framed=framed,
+        compression=args.compress, cameraRate=args.camera_rate, irRate=irRate)
+    acquisition.ended = threading.Event()
+    acquisition.reason = None
+    acquisition.sharedFrames = None
+    if args.shared is not None:
+        from prisme.sharedframes import SharedFrameWriter
+        try:
+            acquisition.sharedFrames = SharedFrameWriter(args.shared, replace=args.replace_shared)
+        except (OSError, ValueError) as e:
+            sys.stderr.write('Could not share frames as %s: %s\n' % (args.shared, e))
+            link.close()
+            return None
+        addFrameHandler(acquisition, acquisition.sharedFrames.publish)
+    if args.track is not None:
+        from prisme.control import LightTracker
+        acquisition.controller = LightTracker(args.track)
+    acquisition.calibration = calibration
+    acquisition.recorder = recorder
+
+    def onDisconnect(reason):
+        acquisition.reason = reason
+        acquisition.ended.set()
+    acquisition.onDisconnect = onDisconnect
+    acquisition.start()
+    return acquisition
+
+def parseFilter(value):
+    # ema:ALPHA or median:LENGTH, see prisme.calibration
+    kind, _, parameter = value.partition(':')
+    try:
+        if kind == 'ema':
+            alpha = float(parameter or 0.2)
+            if 0 < alpha <= 1:
+                return kind, alpha
+        elif kind == 'median':
+            length = int(parameter or 5)
+            if length > 0:
+                return kind, length
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError('expected ema:ALPHA (0 to 1) or median:LENGTH, not %s' % value)
+
+def loadCalibration(args, source):
+    # calibration pipeline asked for by --calibrate and --filter, the stored
+    # calibration of the device on source by default, None when it is missing
+    from prisme.calibration import Calibration, CalibrationPipeline, EmaFilter, MedianFilter, calibrationPath
+    calibration = None
+    if args.calibrate is not None:
+        path = args.calibrate or calibrationPath(source)
+        try:
+            calibration = Calibration.load(path)
+        except (IOError, OSError, KeyError, ValueError) as e:
+            sys.stderr.write('Could not read the calibration %s: %s\n' % (path, e))
+            return None
+        if calibration is None:
+            sys.stderr.write('No calibration in %s, run the calibrate command first\n' % path)
+            return None
+    filter = None
+    if args.filter is not None:
+        kind, parameter = args.filter
+        filter = EmaFilter(parameter) if kind == 'ema' else MedianFilter(parameter)
+    return CalibrationPipeline(calibration, filter)
+
+def addFrameHandler(acquisition, handler):
+    # called with every frame from the acquisition thread, after the others
+    previous = acquisition.onFrame
+    if previous is None:
+        acquisition.onFrame = handler
+        return
+
+    def both(frame):
+        previous(frame)
+        handler(frame)
+    acquisition.onFrame = both
+
+def consume(acquisition, args, handler=None):
+    # hand every frame to handler until the duration or number of frames is
+    # reached, the acquisition ends or the user interrupts
+    clockStart = clock()
+    frames = 0
+    try:
+        while not acquisition.ended.is_set():
+            if args.duration is not None and clock() - clockStart >= args.duration:
+                break
+            if args.frames is not None and frames >= args.frames:
+                break
+            frame = acquisition.frameBuffer.get(0.1)
+            if frame is None:
+                continue
+            frames += 1
+            if handler is not None:
+                handler(frame)
+            # handled frames count as drawn
+            frame.stages[STAGE_DRAWN] = clock()
+            acquisition.latencies.recordFrame(frame, STAGE_POSTED, STAGE_DRAWN)
+    except KeyboardInterrupt:
+        pass
+    acquisition.stop()
+    acquisition.join()
+    if acquisition.sharedFrames is not None:
+        acquisition.sharedFrames.close()
+    reportLatencies(args, [acquisition])
+    parser = acquisition.parser
+    if parser is not None and (parser.corrupted or parser.lost):
+        sys.stderr.write('%d corrupted frames, %d lost\n' % (parser.corrupted, parser.lost))
+    if parser is not None and acquisition.compression:
+        sys.stderr.write('compression %.2f:1, %d of %d frames as differences\n' % (parser.compressionRatio, parser.deltas,
+            parser.frames))
+    if acquisition.reason == DISCONNECT_ERROR:
+        sys.stderr.write('Connection error\n')
+        return 1
+    return 0
+
+def reportLatencies(args, sources):
+    # per stage latencies of every acquisition or device, as asked for
+    for source in sources:
+        if args.latency:
+            if len(sources) > 1:
+                sys.stderr.write('%s\n' % source.name)
+            source.latencies.report(sys.stderr)
+        if args.latency_file:
+            path = args.latency_file
+            if len(sources) > 1:
+                # one file per device
+                path = '%s.%d' % (path, sources.index(source))
+            with open(path, 'w') as out:
+                source.latencies.export(out)
+
+def record(args):
+    from prisme.recorder import SessionRecorder, indexPath
+    try:
+        recorder = SessionRecorder(args.file)
+    except IOError as e:
+        sys.stderr.write('Could not create %s: %s\n' % (args.file, e))
+        return 1
+    acquisition = startAcquisition(args, recorder)
+    if acquisition is None:
+        # nothing was recorded
+        recorder.close()
+        os.remove(args.file)
+        os.remove(indexPath(args.file))
+        return 1
+    clockStart = clock()
+    status = consume(acquisition, args)
+    recorder.close()
+    duration = clock() - clockStart
+    frames = recorder.frames - recorder.irFrames
+    sys.stdout.write('%d frames in %.1f s (%.2f frames/s), %d IR responses, %d dropped by the recorder\n' % (frames,
+        duration, frames / duration if duration else 0, recorder.irFrames, recorder.dropped))
+    return status
+
+def serve(args):
+    # frames to every client of a local socket, their commands to the device
+    from prisme.server import FrameServer
+    acquisition = startAcquisition(args)
+    if acquisition is None:
+        return 1
+    try:
+        server = FrameServer(acquisition, args.listen)
+    except (socket.error, OSError) as e:
+        sys.stderr.write('Could not listen on %s: %s\n' % (args.listen, e))
+        acquisition.stop()
+        acquisition.join()
+        return 1
+    addFrameHandler(acquisition, server.publish)
+    server.start()
+    sys.stderr.write('Serving frames on %s\n' % args.listen)
+    status = consume(acquisition, args)
+    server.stop()
+    server.join()
+    sys.stdout.write('%d frames published to %d clients, %d dropped for slow clients\n' % (server.published,
+        server.served, server.dropped))
+    return status
+
+def stream(args):
+    # one line per frame: sequence, timestamp, camera pixels then IR values
+    acquisition = startAcquisition(args)
+    if acquisition is None:
+        return 1
+    out = sys.stdout
+
+    def printFrame(frame):
+        out.write('%d,%.6f,%s\n' % (frame.sequence, frame.timestamp, ','.join(map(str, frame.data))))
+        out.flush()
+    return consume(acquisition, args, printFrame)
+
+def statistics(args):
+    from prisme.stats import cameraStats, RunningCameraStats
+    acquisition = startAcquisition(args)
+    if acquisition is None:
+        return 1
+    running = RunningCameraStats(args.window)
+    state = {'report': clock() + args.interval, 'frames': 0, 'clock': clock()}
+
+    def update(frame):
+        if frame.irOnly:
+            # the camera didn't change
+            return
+        running.update(cameraStats(frame))
+        state['frames'] += 1
+        now = clock()
+        if now < state['report']:
+            return
+        buffer = acquisition.frameBuffer
+        parser = acquisition.parser
+        peak = running['subpixelPeak']
+        sys.stdout.write('%6.1f frames/s, %d dropped, %d lost, peak %5.1f (mean %5.1f, min %5.1f, max %5.1f), max %3d, min %3d, avg %5.1f\n' % (
+            state['frames'] / (now - state['clock']), buffer.dropped + buffer.skipped, parser.lost if parser is not None else 0, peak.ema, peak.mean, peak.minimum,
+            peak.maximum, running['maximum'].ema, running['minimum'].ema, running['average'].ema))
+        sys.stdout.flush()
+        state['report'] = now + args.interval
+        state['frames'] = 0
+        state['clock'] = now
+    return consume(acquisition, args, update)
+
+def captureFrames(acquisition, count):
+    # camera pixels of the next count frames, as a (count, pixels) array, None
+    # if the acquisition ended first
+    import numpy
+    cameras = numpy.empty((count, protocol.CAMERA_PIXELS), numpy.uint8)
+    # frames queued before the scene was set up
+    acquisition.frameBuffer.latest()
+    captured = 0
+    while captured < count:
+        if acquisition.ended.is_set():
+            return None
+        frame = acquisition.frameBuffer.get(0.1)
+        if frame is None or frame.irOnly:
+            continue
+        cameras[captured] = bytearray(frame.camera)
+        captured += 1
+    return cameras
+
+def calibrate(args):
+    # mean dark frame (offsets) and flat frame (gains) of the device, stored
+    # for --calibrate
+    from prisme.calibration import Calibration, calibrationPath
+    path = args.output or calibrationPath(args.port)
+    acquisition = startAcquisition(args)
+    if acquisition is None:
+        return 1
+    prompts = ['Cover the camera']
+    if not args.dark_only:
+        prompts.append('Light the camera evenly, just below saturation')
+    references = []
+    try:
+        for prompt in prompts:
+            sys.stderr.write('%s then press Enter\n' % prompt)
+            sys.stdin.readline()
+            cameras = captureFrames(acquisition, args.count)
+            if cameras is None:
+                break
+            references.append(cameras)
+    except KeyboardInterrupt:
+        pass
+    acquisition.stop()
+    acquisition.join()
+    if len(references) < len(prompts):
+        sys.stderr.write('Calibration aborted\n')
+        return 1
+    calibration = Calibration.capture(*references)
+    try:
+        calibration.save(path)
+    except (IOError, OSError) as e:
+        sys.stderr.write('Could not write %s: %s\n' % (path, e))
+        return 1
+    sys.stdout.write('dark %.1f (min %.1f, max %.1f), gain min %.2f, max %.2f, written to %s\n' % (calibration.dark.mean(),
+        calibration.dark.min(), calibration.dark.max(), calibration.gain.min(), calibration.gain.max(), path))
+    return 0
+
+def describeParser(parser, compression):
+    if parser is None:
+        return 'unframed'
+    if compression:
+        return '%d corrupted, %d lost, compression %.2f:1' % (parser.corrupted, parser.lost, parser.compressionRatio)
+    return '%d corrupted, %d lost' % (parser.corrupted, parser.lost)
+
+def monitor(args):
+    # every device is handled by a single thread, one line per device and
+    # interval with its frame rate and counters
+    from prisme.devices import Device, DeviceLoop
+    loop = DeviceLoop()
+    loop.start()
+    ended = []
+    devices = []
+    for port in args.ports:
+        pause = None
+        if args.fps is not None:
+            # the integration time and rate aren't known yet, the firmware
+            # default and the highest rate are close enough for the pause
+            pause = protocol.streamPause(args.fps, args.baud or protocol.BAUDRATES[-1], 100)
+        device = Device(port, args.baud, pause, args.depth, framing=not args.unframed, compression=args.compress)
+        device.onDisconnect = lambda reason, device=device: ended.append((device, reason))
+        devices.append(loop.add(device))
+
+    clockStart = clock()
+    frames = dict((device, 0) for device in devices)
+    try:
+        while len(ended) < len(devices):
+            if args.duration is not None and clock() - clockStart >= args.duration:
+                break
+            clockReport = clock()
+            time.sleep(args.interval)
+            elapsed = clock() - clockReport
+            for device in devices:
+                # frames are only counted here, nobody consumes them
+                device.frameBuffer.latest()
+                parser = device.parser
+                scheduler = device.scheduler
+                sys.stdout.write('%-20s %-11s %7d baud %6.1f frames/s, %d frames, %d commands (%d queued, %d coalesced, '
+                    '%.1f ms), %d bytes, %s\n' % (device.name, device.state, device.baudrate, (device.frames - frames[device]) / elapsed,
+                    device.frames, device.commandsSent, len(scheduler), scheduler.coalesced, scheduler.latency * 1e3,
+                    device.bytesReceived, describeParser(parser, device.compression)))
+                frames[device] = device.frames
+            sys.stdout.write('loop load %.1f%%\n' % (loop.load * 100))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    loop.stop()
+    loop.join()
+    reportLatencies(args, devices)
+    failed = [device for device, reason in ended if reason is not None]
+    for device in failed:
+        sys.stderr.write('%s: connection lost\n' % device.name)
+    return 1 if failed else 0
+
+def analyze(args):
+    # statistics of a whole recorded session in one vectorized pass
+    import numpy
+    from prisme.recorder import SessionReader
+    from prisme.stats import batchStats
+    with SessionReader(args.file) as session:
+        if not len(session):
+            sys.stderr.write('%s contains no frames\n' % args.file)
+            return 1
+        calibration = None
+        if args.calibrate is not None or args.filter is not None:
+            calibration = loadCalibration(args, args.file)
+            if calibration is None:
+                return 1
+        # IR responses repeat the camera of the frame before them, they would
+        # weigh the statistics and filters by the IR rate
+        irOnly = session.irOnlyMask()
+        if irOnly.all():
+            sys.stderr.write('%s contains no camera frames\n' % args.file)
+            return 1
+        clockStart = clock()
+        frames = session.frameArray(cameraOnly=True)
+        cameras = frames[:, :protocol.CAMERA_PIXELS]
+        if calibration is not None:
+            # sessions are recorded as received
+            cameras = calibration.processBatch(cameras)
+        values = batchStats(cameras)
+        elapsed = clock() - clockStart
+        times = session.frameTimes()[~irOnly]
+        duration = times[-1] - times[0]
+        sys.stdout.write('%d frames over %.1f s (%.2f frames/s), %d IR responses, %d commands\n' % (len(times), duration,
+            (len(times) - 1) / duration if duration else 0, irOnly.sum(), session.recordCount - len(session)))
+        for field in ('subpixelPeak', 'maximum', 'minimum', 'delta', 'average'):
+            column = numpy.asarray(getattr(values, field), dtype=numpy.float64)
+            sys.stdout.write('%-13s mean %6.1f, std %6.1f, min %6.1f, max %6.1f\n' % (field, column.mean(),
+                column.std(), column.min(), column.max()))
+        sys.stdout.write('analyzed in %.3f s\n' % elapsed)
+        del frames, cameras, values
+    return 0
+
+def ports(args):
+    # serial ports PRismes answer on, once or as they are plugged and unplugged
+    from prisme.discovery import DeviceDiscovery
+    discovery = DeviceDiscovery(ports=args.ports)
+    if not args.watch:
+        devices = discovery.scan()
+        for port in devices:
+            sys.stdout.write('%s\n' % port)
+        return 0 if devices else 1
+    discovery.onChange = lambda devices: (sys.stdout.write('%s\n' % ' '.join(devices) if devices else '-\n'), sys.stdout.flush())
+    discovery.start()
+    try:
+        while discovery.is_alive():
+            discovery.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    discovery.stop()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='prisme_control_center.py', description='PRisme Control Center, headless mode')
+    commands = parser.add_subparsers(dest='command')
+
+    linkOptions = argparse.ArgumentParser(add_help=False)
+    linkOptions.add_argument('--baud', type=int, help='highest baud rate negotiated with the device, the fastest by default')
+    linkOptions.add_argument('--fps', type=int, help='have the device stream at this frame rate, 0 for maximum')
+    linkOptions.add_argument('--depth', type=int, default=PIPELINE_DEPTH, help='data requests kept in flight when polling')
+    linkOptions.add_argument('--duration', type=float, help='stop after this many seconds')
+    linkOptions.add_argument('--unframed', action='store_true', help='keep raw data responses even if the firmware can frame them')
+    linkOptions.add_argument('--latency', action='store_true', help='print the latency of every pipeline stage at the end')
+    linkOptions.add_argument('--latency-file', metavar='FILE', help='write the latency distributions of every stage to a CSV file')
+    linkOptions.add_argument('--compress', type=int, nargs='?', const=protocol.KEYFRAME_INTERVAL, metavar='N',
+        help='have framed data responses sent as differences to the previous frame, with a keyframe every N (%d)' %
+        protocol.KEYFRAME_INTERVAL)
+
+    acquisitionOptions = argparse.ArgumentParser(add_help=False, parents=[linkOptions])
+    acquisitionOptions.add_argument('port', help='serial device, or session file (.prs) to replay')
+    acquisitionOptions.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 for as fast as possible')
+    acquisitionOptions.add_argument('--frames', type=int, help='stop after this many frames')
+    acquisitionOptions.add_argument('--shared', metavar='NAME', help='publish the frames to other processes in shared memory '
+        'under this name (see prisme.sharedframes)')
+    acquisitionOptions.add_argument('--replace-shared', action='store_true',
+        help="take the name over from another writer, one that didn't end cleanly for example")
+    acquisitionOptions.add_argument('--camera-rate', type=float, metavar='HZ',
+        help='frames per second when polling, as many as the link allows by default')
+    acquisitionOptions.add_argument('--ir-rate', type=float, metavar='HZ',
+        help='also poll the IR sensors alone at this rate, independently of the camera')
+    acquisitionOptions.add_argument('--track', type=int, nargs='?', const=30, metavar='SPEED',
+        help='drive towards the light and away from obstacles at this speed [%%] (see prisme.control)')
+
+    calibrationOptions = argparse.ArgumentParser(add_help=False)
+    calibrationOptions.add_argument('--calibrate', nargs='?', const='', metavar='FILE',
+        help='correct every pixel with the calibration of the device (see the calibrate command) or the one in FILE')
+    calibrationOptions.add_argument('--filter', type=parseFilter, metavar='ema:ALPHA|median:N',
+        help='also filter every pixel over time, with a moving average or the median of the last N frames')
+
+    command = commands.add_parser('record', parents=[acquisitionOptions, calibrationOptions], help='record a session file')
+    command.add_argument('file', help='session file to write')
+    command.set_defaults(function=record)
+    command = commands.add_parser('serve', parents=[acquisitionOptions, calibrationOptions], help='publish frames to local clients')
+    command.add_argument('--listen', default='127.0.0.1:5757', metavar='ADDRESS',
+        help='host:port or Unix socket path to listen on (%(default)s)')
+    command.set_defaults(function=serve)
+    command = commands.add_parser('stream', parents=[acquisitionOptions, calibrationOptions], help='print every frame as a CSV line')
+    command.set_defaults(function=stream)
+    command = commands.add_parser('stats', parents=[acquisitionOptions, calibrationOptions], help='print running camera statistics')
+    command.add_argument('--interval', type=float, default=1.0, help='seconds between reports')
+    command.add_argument('--window', type=int, default=100, help='frames in the rolling window')
+    command.set_defaults(function=statistics)
+    command = commands.add_parser('monitor', parents=[linkOptions], help='acquire from several devices at once')
+    command.add_argument('ports', nargs='+', help='serial devices')
+    command.add_argument('--interval', type=float, default=1.0, help='seconds between reports')
+    command.set_defaults(function=monitor)
+    command = commands.add_parser('calibrate', parents=[acquisitionOptions], help='measure and store the dark and flat frames of a device')
+    command.add_argument('--count', type=int, default=50, help='frames averaged for each reference (%(default)s)')
+    command.add_argument('--dark-only', action='store_true', help='only correct the offsets, every gain stays 1')
+    command.add_argument('--output', metavar='FILE', help='file to write, kept per device under %s by default' %
+        '~/.prisme/calibration')
+    command.set_defaults(function=calibrate)
+    command = commands.add_parser('analyze', parents=[calibrationOptions], help='print the statistics of a recorded session')
+    command.add_argument('file', help='session file to analyze')
+    command.set_defaults(function=analyze)
+    command = commands.add_parser('ports', help='list the serial ports PRismes answer on')
+    command.add_argument('ports', nargs='*', help='ports to probe besides those found')
+    command.add_argument('--watch', action='store_true', help='print them again whenever they change')
+    command.set_defaults(function=ports)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'function', None) is None:
+        parser.print_help()
+        return 2
+    return args.function(args)
@@ -0,0 +1,100 @@
+# controllers run by the acquisition on every frame as soon as it is decoded,
+# their commands go out through the scheduler before the next frame is read:
+# the robot reacts one frame after it saw something instead of after a round
+# trip through the user interface
+#
+#   acquisition.controller = LightTracker(speed=30)
+from prisme import protocol, stats
+
+class Controller(object):
+    # update() is called from the acquisition thread with every frame, which
+    # is reused afterwards, and returns a command or None
+    def update(self, frame):
+        return None
+
+    def reset(self):
+        # forget the state, a new acquisition starts
+        pass
+
+class LightTracker(Controller):
+    # drives towards the light spot seen by the camera and away from the
+    # obstacles seen by the IR sensors, turning in place to find the light
+    # when there is none
+    #
+    # Camera pixels are taken to go from left to right and the IR sensors to be
+    # spread from the left (first) to the right (last), higher IR values
+    # meaning closer obstacles. The peak is the one the user interface shows.
+
+    def __init__(self, speed=30, steering=1.0, minContrast=40, searchSpeed=20, irThreshold=60, avoidance=1.5, memory=10):
+        # forward speed in % of the maximum
+        self.speed = speed
+        # turn speed per unit of peak offset (-1 at the leftmost pixel, 1 at
+        # the rightmost), relative to the forward speed
+        self.steering = steering
+        # smallest maximum - minimum taken as a light spot
+        self.minContrast = minContrast
+        self.searchSpeed = searchSpeed
+        # IR values below this are no obstacle, and the weight of the
+        # obstacles above it against the light
+        self.irThreshold = irThreshold
+        self.avoidance = avoidance
+        # frames an obstacle is remembered for once out of sight, the robot
+        # keeps going past it instead of turning back to look for the light
+        self.memory = memory
+        # how much each IR sensor pushes to the right (left when negative),
+        # and slows down the robot (the ones looking ahead the most)
+        sensors = protocol.IR_SENSORS
+        self.irWeights = [2.0 * i / (sensors - 1) - 1 for i in range(sensors)]
+        self.irBrakes = [1 - abs(weight) for weight in self.irWeights]
+        self.reset()
+
+    def reset(self):
+        # speeds of the last command, only changes are sent
+        self.last = None
+        # whether the light was seen in the last frame, and the side it was
+        # last seen on to search for it there first
+        self.tracking = False
+        self.side = 1
+        # side obstacles are passed on, kept until they are forgotten so that
+        # one straight ahead doesn't make the robot dither, and the frames
+        # since one was last seen
+        self.passing = None
+        self.cleared = 0
+
+    def update(self, frame):
+        values = stats.cameraStats(frame)
+        center = (protocol.CAMERA_PIXELS - 1) / 2.0
+        # obstacles from 0 (none) to 1 (touching)
+        obstacles = [max(0, value - self.irThreshold) / float(255 - self.irThreshold) for value in frame.ir.tolist()]
+        if max(obstacles):
+            self.cleared = 0
+            if self.passing is None:
+                self.passing = self.side
+        elif self.passing is not None:
+            self.cleared += 1
+            if self.cleared > self.memory:
+                self.passing = None
+        # each obstacle pushes to the other side, those straight ahead away
+        # from the passing side, and the ones ahead slow down
+        ahead = -(self.passing or self.side)
+        push = sum((weight or ahead) * obstacle for weight, obstacle in zip(self.irWeights, obstacles))
+        brake = max(brake * obstacle for brake, obstacle in zip(self.irBrakes, obstacles))
+        forward = self.speed * (1 - brake)
+        turn = -self.speed * self.avoidance * push
+        self.tracking = int(values.delta) >= self.minContrast
+        if self.tracking:
+            offset = (float(values.subpixelPeak) - center) / center
+            if offset:
+                self.side = 1 if offset > 0 else -1
+            turn += self.speed * self.steering * offset
+        elif self.passing is None:
+            # turn in place towards where the light was last seen
+            forward = 0
+            turn = self.side * self.searchSpeed
+        # a positive turn goes right, the left wheel is faster
+        left = int(round(max(-100, min(100, forward + turn))))
+        right = int(round(max(-100, min(100, forward - turn))))
+        if (left, right) == self.last:
+            return None
+        self.last = (left, right)
+        return protocol.speedCommand(left, right)
@@ -0,0 +1,79 @@
+# differences between consecutive frames for compressed data responses (see
+# protocol.DELTA_FLAG): consecutive camera frames differ by little more than
+# the pixel noise, so most differences fit in a nibble or are none at all
+from prisme import protocol
+
+def _small(difference):
+    # whether a difference modulo 256 fits in a signed nibble
+    return difference < 8 or difference >= 248
+
+def encodeDelta(previous, current):
+    # encoded differences from previous to current, None when they aren't
+    # shorter than a keyframe, the firmware encodes them the same way
+    previous = bytearray(previous)
+    current = bytearray(current)
+    size = len(current)
+    differences = [(c - p) & 0xff for p, c in zip(previous, current)]
+
+    def unchangedRun(i):
+        # a single unchanged byte costs less in a run of nibbles
+        return differences[i] == 0 and (i + 1 == size or differences[i + 1] == 0)
+
+    out = bytearray()
+    i = 0
+    while i < size:
+        start = i
+        if unchangedRun(i):
+            while i < size and i - start < protocol.DELTA_RUN_MAX and differences[i] == 0:
+                i += 1
+            out.append(protocol.DELTA_ZEROS | (i - start - 1))
+        elif _small(differences[i]):
+            while i < size and i - start < protocol.DELTA_RUN_MAX and _small(differences[i]) and not unchangedRun(i):
+                i += 1
+            out.append(protocol.DELTA_NIBBLES | (i - start - 1))
+            for j in range(start, i, 2):
+                low = differences[j + 1] & 0x0f if j + 1 < i else 0
+                out.append(((differences[j] & 0x0f) << 4) | low)
+        else:
+            while i < size and i - start < protocol.DELTA_RUN_MAX and not _small(differences[i]):
+                i += 1
+            out.append(protocol.DELTA_LITERALS | (i - start - 1))
+            out += current[start:i]
+        if len(out) >= size:
+            return None
+    return bytes(out)
+
+def decodeDelta(reference, payload, out):
+    # apply encoded differences to reference, writing the frame to out (it
+    # may be reference itself), returns False when the payload is invalid
+    payload = bytearray(payload)
+    size = len(out)
+    i = position = 0
+    while position < len(payload):
+        token = payload[position]
+        kind = token & protocol.DELTA_KIND_MASK
+        count = (token & ~protocol.DELTA_KIND_MASK) + 1
+        position += 1
+        if i + count > size:
+            return False
+        if kind == protocol.DELTA_ZEROS:
+            if out is not reference:
+                out[i:i + count] = reference[i:i + count]
+        elif kind == protocol.DELTA_NIBBLES:
+            length = (count + 1) // 2
+            if position + length > len(payload):
+                return False
+            for k in range(count):
+                byte = payload[position + (k >> 1)]
+                nibble = byte & 0x0f if k & 1 else byte >> 4
+                out[i + k] = (reference[i + k] + nibble - (16 if nibble & 0x08 else 0)) & 0xff
+            position += length
+        elif kind == protocol.DELTA_LITERALS:
+            if position + count > len(payload):
+                return False
+            out[i:i + count] = payload[position:position + count]
+            position += count
+        else:
+            return False
+        i += count
+    return i == size
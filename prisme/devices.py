@@ -0,0 +1,550 @@
+# many PRisme devices handled by a single thread: every serial link is
+# non-blocking and watched by one selector, a device is only a few objects
+# and buffers so one core keeps up with dozens of robots where a thread (or
+# a process) per robot wouldn't
+#
+#   loop = DeviceLoop()
+#   loop.start()
+#   robots = [loop.add(Device(port)) for port in ports]
+#   robots[0].queueCommand(protocol.speedCommand(20, 20))
+#   frame = robots[0].frameBuffer.get(1)
+import os, errno, threading, collections, selectors
+from timeit import default_timer as clock
+
+import serial
+
+from prisme import protocol
+from prisme.frame import FramePool
+from prisme.framebuffer import FrameBuffer
+from prisme.framing import FrameParser, isFramed
+from prisme.scheduler import CommandScheduler
+from prisme.latency import Latencies, COMMAND_WRITTEN, STAGE_REQUESTED, STAGE_FIRST_BYTE, STAGE_COMPLETE, STAGE_DECODED, STAGE_POSTED, STAGE_DRAWN
+from prisme.acquisition import PIPELINE_DEPTH, FRAME_POOL_SIZE, MAX_TIMEOUTS, DISCONNECT_TIMEOUT, DISCONNECT_ERROR
+
+# device states
+STATE_IDLE = 'idle'
+# waiting for the integration time, the answer to the first command
+STATE_HANDSHAKE = 'handshake'
+# waiting for the device to acknowledge a baud rate switch, then for the
+# probe frame at the new rate
+STATE_NEGOTIATING = 'negotiating'
+STATE_PROBING = 'probing'
+# the switch failed, waiting for the device to go back to the previous rate
+STATE_REVERTING = 'reverting'
+# waiting for a framed probe frame, a raw one means the firmware can't frame
+STATE_FRAMING = 'framing'
+STATE_ACQUIRING = 'acquiring'
+STATE_CLOSED = 'closed'
+
+class Device(object):
+    # one PRisme on a serial port, with its own frame buffer, command queue and
+    # statistics, the same attributes as Acquisition for the consumers
+    def __init__(self, port, maxBaudrate=None, pause=None, depth=PIPELINE_DEPTH,
+            frameBuffer=None, name=None, timeout=1.0, framing=True, compression=None, latencies=None):
+        self.port = port
+        self.name = name or port
+        # highest baud rate negotiated, None for the fastest one, the link is
+        # opened at the default rate
+        self.maxBaudrate = maxBaudrate
+        self.baudrate = protocol.DEFAULT_BAUDRATE
+        # pause between frames in ms when the device streams, None to poll
+        self.pause = pause
+        # number of data requests kept in flight when polling
+        self.depth = max(1, depth)
+        # seconds without data before the device is considered gone
+        self.timeout = timeout
+        # ask for framed data responses, raw ones are used when the firmware
+        # can't frame them
+        self.framing = framing
+        # keyframe interval of compressed data responses, None to get every
+        # frame whole, only framed responses are compressed
+        self.compression = compression
+        self.frameBuffer = frameBuffer if frameBuffer is not None else FrameBuffer()
+        # commands waiting to be sent, most urgent first, they are sent as soon
+        # as the loop sees them
+        self.scheduler = CommandScheduler()
+        # session recorder, None when not recording
+        self.recorder = None
+        # called from the loop thread with every frame, must not block
+        self.onFrame = None
+        # prisme.calibration.CalibrationPipeline correcting the camera of
+        # every frame in place once it is recorded, None for none
+        self.calibration = None
+        # prisme.control.Controller given every frame before anything else
+        # but the calibration, must not block either, None for none
+        self.controller = None
+        # called from the loop thread once the link is closed, with None,
+        # DISCONNECT_TIMEOUT or DISCONNECT_ERROR
+        self.onDisconnect = None
+        self.state = STATE_IDLE
+        self.intTime = None
+        self.sequence = 0
+        self.link = None
+        self.loop = None
+
+        # statistics
+        self.frames = 0
+        self.bytesReceived = 0
+        self.commandsSent = 0
+        self.timeouts = 0
+        # frames requested while connecting, not handed to the consumers
+        self.probes = 0
+        self.connectedAt = None
+        # time between the stages of every frame and of every command, the
+        # consumers add the time frames are drawn at
+        self.latencies = latencies if latencies is not None else Latencies()
+
+        self._frames = FramePool(FRAME_POOL_SIZE)
+        # parser of framed data responses with the counts of corrupted and
+        # lost frames, None for raw responses
+        self.parser = None
+        self._probe = bytearray(protocol.FRAMED_SIZE)
+        self._frame = None
+        # bytes expected in the current state and how many arrived
+        self._view = None
+        self._received = 0
+        self._answer = bytearray(2)
+        self._output = bytearray()
+        self._deadline = None
+        # rates left to try, the one being tried and the one to go back to
+        self._baudrates = []
+        self._switchingTo = None
+        self._previousBaudrate = None
+        # times of the data requests in flight, oldest first, and of the reads
+        # with the first and last bytes of the next framed response
+        self._requests = collections.deque(maxlen=256)
+        self._firstByte = self._lastRead = 0.0
+
+    @property
+    def frameRate(self):
+        # average frames per second since the handshake
+        if self.connectedAt is None:
+            return 0.0
+        elapsed = clock() - self.connectedAt
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def queueCommand(self, data, timestamp=None):
+        # can be called from any thread, timestamp is the clock() time the
+        # command was given at when it isn't now
+        self.scheduler.put(data, timestamp)
+        loop = self.loop
+        if loop is not None:
+            loop.wakeup(self)
+
+    def stop(self):
+        loop = self.loop
+        if loop is not None:
+            loop.remove(self)
+
+    # everything below runs in the loop thread
+
+    def open(self):
+        self.link = serial.Serial(port=self.port, baudrate=protocol.DEFAULT_BAUDRATE, timeout=0)
+        self.fd = self.link.fileno()
+        os.set_blocking(self.fd, False)
+        self._baudrates = protocol.negotiableBaudrates(self.maxBaudrate)
+        self.expect(STATE_HANDSHAKE, memoryview(self._answer))
+        self.send(protocol.CMD_CONFIG)
+
+    def expect(self, state, view, timeout=None):
+        self.state = state
+        self._view = view
+        self._received = 0
+        self._deadline = clock() + (self.timeout if timeout is None else timeout)
+
+    def send(self, data):
+        self._output += data
+        self.flush()
+
+    def flush(self):
+        # write as much as the link takes, the loop watches for writability
+        # while something is left
+        if not self._output:
+            return True
+        try:
+            written = os.write(self.fd, self._output)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            written = 0
+        del self._output[:written]
+        return not self._output
+
+    def request(self, count=1):
+        # data requests, timed for the frames answering them
+        self.send(protocol.CMD_DATA * count)
+        self._requests.extend([clock()] * count)
+
+    def sendCommands(self):
+        while True:
+            entry = self.scheduler.takeEntry(0)
+            if entry is None:
+                return
+            queued, command = entry
+            self.send(command)
+            self.latencies.record(COMMAND_WRITTEN, clock() - queued)
+            self.commandsSent += 1
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.recordCommand(command)
+
+    def read(self):
+        if self.state == STATE_REVERTING or self.parser is not None:
+            data = os.read(self.fd, 4096)
+            if not data:
+                raise OSError('device reports readiness to read but returned no data')
+            # anything sent at the other rate is garbage
+            if self.state == STATE_ACQUIRING:
+                self.bytesReceived += len(data)
+                self._lastRead = clock()
+                if not len(self.parser) or not self._firstByte:
+                    self._firstByte = self._lastRead
+                self._deadline = self._lastRead + self.timeout
+                self.parse(data)
+            return
+        view = self._view
+        if not self._received and self.state == STATE_ACQUIRING:
+            self._frame.stages[STAGE_FIRST_BYTE] = clock()
+        count = os.readv(self.fd, [view[self._received:]])
+        if count == 0:
+            # the device disappeared (USB unplugged)
+            raise OSError('device reports readiness to read but returned no data')
+        self.bytesReceived += count
+        self._received += count
+        self._deadline = clock() + self.timeout
+        if self._received < len(view):
+            return
+        self._received = 0
+        if self.state == STATE_HANDSHAKE:
+            self.intTime = protocol.decodeIntTime(self._answer)
+            self.negotiate()
+        elif self.state == STATE_NEGOTIATING:
+            if self._answer[0] == protocol.BAUDRATES.index(self._switchingTo):
+                self.switch()
+            else:
+                # refused, try a slower one
+                self.negotiate()
+        elif self.state == STATE_PROBING:
+            self.setupFraming()
+        elif self.state == STATE_FRAMING:
+            self.framingProbed()
+        else:
+            self._frame.stages[STAGE_COMPLETE] = self._frame.stages[STAGE_DECODED] = clock()
+            self.frameReceived(self._frame)
+            self.nextFrame()
+
+    def parse(self, data):
+        parser = self.parser
+        parser.feed(data)
+        while True:
+            frame = parser.next()
+            # before the requests so that the next frame is a keyframe
+            if parser.takeKeyframeRequest():
+                self.send(protocol.compressionCommand(self.compression))
+            # every missing frame took a request with it
+            missing = parser.takeMissing()
+            for i in range(min(missing, len(self._requests))):
+                self._requests.popleft()
+            if missing and self.pause is None:
+                self.request(missing)
+            if frame is None:
+                return
+            frame.stages[STAGE_FIRST_BYTE] = self._firstByte
+            frame.stages[STAGE_COMPLETE] = self._lastRead
+            frame.stages[STAGE_DECODED] = clock()
+            # what is left belongs to the next frame
+            self._firstByte = self._lastRead if len(parser) else 0.0
+            self.timeouts = 0
+            self.frameReceived(frame)
+
+    def negotiate(self):
+        # ask for the next rate, fastest first, or go on at the current one
+        if not self._baudrates:
+            self.setupFraming()
+            return
+        self._switchingTo = self._baudrates.pop(0)
+        self.expect(STATE_NEGOTIATING, memoryview(self._answer)[:1])
+        self.send(protocol.baudCommand(self._switchingTo))
+
+    def switch(self):
+        # the device switched, follow it and confirm with a probe frame
+        self._previousBaudrate = self.link.baudrate
+        try:
+            self.link.baudrate = self._switchingTo
+        except (ValueError, serial.SerialException):
+            # the adapter doesn't support the rate
+            self.revert()
+            return
+        self.nextFrame()
+        self.expect(STATE_PROBING, self._view)
+        self.send(protocol.CMD_DATA)
+        self.probes += 1
+
+    def framingProbed(self):
+        if isFramed(self._probe[:self._received or len(self._probe)]):
+            self.parser = FrameParser(self._frames)
+        self.link.reset_input_buffer()
+        self.start()
+
+    def setupFraming(self):
+        if not self.framing:
+            self.start()
+            return
+        self.expect(STATE_FRAMING, memoryview(self._probe))
+        self.send(protocol.framingCommand(True) + protocol.CMD_DATA)
+        self.probes += 1
+
+    def revert(self):
+        self.link.baudrate = self._previousBaudrate
+        self.state = STATE_REVERTING
+        self._deadline = clock() + protocol.BAUD_CONFIRM_TIMEOUT
+
+    def timedOut(self):
+        # called when the deadline passed, returns whether the device is gone
+        if self.state == STATE_NEGOTIATING:
+            # firmware without rate switching, it ignores the command
+            self._baudrates = []
+            self.setupFraming()
+        elif self.state == STATE_PROBING:
+            self.revert()
+        elif self.state == STATE_REVERTING:
+            # the device went back to the previous rate
+            self.link.reset_input_buffer()
+            self.negotiate()
+        elif self.state == STATE_FRAMING:
+            # firmware without framing (the raw probe frame is shorter) or a
+            # damaged probe frame
+            self.framingProbed()
+        elif self.state == STATE_ACQUIRING and self.parser is not None and self.timeouts + 1 < MAX_TIMEOUTS:
+            # the requests in flight are lost, refill the pipeline
+            self.timeouts += 1
+            self._deadline = clock() + self.timeout
+            self._requests.clear()
+            if self.pause is None:
+                self.request(self.depth)
+        else:
+            return True
+        return False
+
+    def start(self):
+        self.state = STATE_ACQUIRING
+        self.baudrate = self.link.baudrate
+        self.connectedAt = clock()
+        self._deadline = clock() + self.timeout
+        if self.calibration is not None:
+            self.calibration.reset()
+        if self.controller is not None:
+            self.controller.reset()
+        self.nextFrame()
+        if self.parser is not None and self.compression:
+            self.send(protocol.compressionCommand(self.compression))
+        self._requests.clear()
+        if self.pause is None:
+            # keep the link busy while the device integrates
+            self.request(self.depth)
+        else:
+            self.send(protocol.streamCommand(self.pause))
+        # commands queued during the handshake
+        self.sendCommands()
+
+    def nextFrame(self):
+        # frames are read straight into preallocated ones
+        self._frame = self._frames.acquire()
+        self._view = memoryview(self._frame.data)
+        self._received = 0
+
+    def frameReceived(self, frame):
+        frame.stages[STAGE_REQUESTED] = self._requests.popleft() if self._requests else 0.0
+        frame.timestamp = clock()
+        # the device numbers framed responses, gaps show lost frames
+        frame.sequence = self.sequence if self.parser is None else self.parser.sequence
+        self.sequence += 1
+        self.frames += 1
+        # sessions are recorded as received and can be calibrated afterwards
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.recordFrame(frame)
+        calibration = self.calibration
+        if calibration is not None:
+            calibration.process(frame)
+        # the controller's command is written before the next request
+        controller = self.controller
+        if controller is not None:
+            command = controller.update(frame)
+            if command is not None:
+                self.scheduler.put(command, frame.timestamp)
+                self.sendCommands()
+        if self.pause is None:
+            self.request()
+
+        if self.onFrame is not None:
+            self.onFrame(frame)
+        frame.stages[STAGE_POSTED] = clock()
+        frame.stages[STAGE_DRAWN] = 0.0
+        self.latencies.recordFrame(frame)
+        self.frameBuffer.put(frame)
+
+    def close(self, reason=None):
+        try:
+            # best effort, the device may already be gone
+            if self.state == STATE_ACQUIRING and self.pause is not None:
+                os.write(self.fd, protocol.CMD_STREAM_STOP)
+            os.write(self.fd, protocol.CMD_RESET)
+        except OSError:
+            pass
+        self.link.close()
+        self.state = STATE_CLOSED
+        self.loop = None
+        if self.onDisconnect is not None:
+            self.onDisconnect(reason)
+
+class DeviceLoop(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.devices = []
+        self.selector = selectors.DefaultSelector()
+        # loop thread statistics: time spent handling events and iterations,
+        # load is the share of one core used
+        self.busy = 0.0
+        self.iterations = 0
+        self.clockStart = None
+        self._stopping = False
+        # (action, device) asked for by other threads
+        self._requests = collections.deque()
+        # devices with commands to send
+        self._commands = collections.deque()
+        # other threads wake the loop up by writing to this pipe
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        os.set_blocking(self._wakeupRead, False)
+        os.set_blocking(self._wakeupWrite, False)
+        self.selector.register(self._wakeupRead, selectors.EVENT_READ, None)
+
+    @property
+    def load(self):
+        if self.clockStart is None:
+            return 0.0
+        elapsed = clock() - self.clockStart
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def add(self, device):
+        device.loop = self
+        self._requests.append((self.open, device))
+        self.wakeup()
+        return device
+
+    def remove(self, device):
+        self._requests.append((self.close, device))
+        self.wakeup()
+
+    def stop(self):
+        self._stopping = True
+        self.wakeup()
+
+    def wakeup(self, device=None):
+        if device is not None:
+            self._commands.append(device)
+        try:
+            os.write(self._wakeupWrite, b'\0')
+        except OSError:
+            # the pipe is full, the loop will wake up anyway
+            pass
+
+    def open(self, device):
+        if device.state != STATE_IDLE:
+            return
+        try:
+            device.open()
+        except (OSError, serial.SerialException):
+            device.state = STATE_CLOSED
+            device.loop = None
+            if device.onDisconnect is not None:
+                device.onDisconnect(DISCONNECT_ERROR)
+            return
+        self.devices.append(device)
+        self.watch(device)
+
+    def close(self, device, reason=None):
+        if device not in self.devices:
+            return
+        self.devices.remove(device)
+        self.selector.unregister(device.fd)
+        device.close(reason)
+
+    def watch(self, device):
+        # readable always, writable only while output is pending
+        events = selectors.EVENT_READ
+        if device._output:
+            events |= selectors.EVENT_WRITE
+        try:
+            if self.selector.get_key(device.fd).events != events:
+                self.selector.modify(device.fd, events, device)
+        except KeyError:
+            self.selector.register(device.fd, events, device)
+
+    def run(self):
+        self.clockStart = clock()
+        while not self._stopping:
+            # the nearest timeout, a linear scan is cheaper than a heap for the
+            # number of devices a process handles
+            timeout = None
+            now = clock()
+            for device in self.devices:
+                if device._deadline is not None and (timeout is None or device._deadline - now < timeout):
+                    timeout = max(0, device._deadline - now)
+            events = self.selector.select(timeout)
+
+            clockStart = clock()
+            for key, mask in events:
+                device = key.data
+                if device is None:
+                    self.drainWakeup()
+                    continue
+                if device.state == STATE_CLOSED:
+                    continue
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        device.flush()
+                    if mask & selectors.EVENT_READ:
+                        device.read()
+                    self.watch(device)
+                except (OSError, serial.SerialException):
+                    self.close(device, DISCONNECT_ERROR)
+
+            while self._requests:
+                action, device = self._requests.popleft()
+                action(device)
+            while self._commands:
+                device = self._commands.popleft()
+                if device.state == STATE_ACQUIRING:
+                    try:
+                        device.sendCommands()
+                        self.watch(device)
+                    except OSError:
+                        self.close(device, DISCONNECT_ERROR)
+
+            now = clock()
+            for device in list(self.devices):
+                if device._deadline is not None and device._deadline <= now:
+                    try:
+                        if device.timedOut():
+                            self.close(device, DISCONNECT_TIMEOUT)
+                        else:
+                            self.watch(device)
+                    except (OSError, serial.SerialException):
+                        self.close(device, DISCONNECT_ERROR)
+            self.busy += clock() - clockStart
+            self.iterations += 1
+
+        for device in list(self.devices):
+            self.close(device)
+        self.selector.close()
+        os.close(self._wakeupRead)
+        os.close(self._wakeupWrite)
+
+    def drainWakeup(self):
+        try:
+            while os.read(self._wakeupRead, 4096):
+                pass
+        except OSError:
+            pass
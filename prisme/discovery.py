@@ -0,0 +1,196 @@
+# serial port discovery from a thread of its own: ports are listed without a
+# shell, watched for hotplug (inotify on /dev where available, polling
+# otherwise) and probed in parallel with the handshake, only ports a PRisme
+# answers on are reported and a port is probed again only when it changed
+#
+#   discovery = DeviceDiscovery(onChange=lambda ports: sys.stdout.write(' '.join(ports)))
+#   discovery.start()
+#   discovery.refresh()     probes again the ports no PRisme answered on
+import os, sys, glob, select, threading, ctypes, ctypes.util
+
+import serial
+
+from prisme import protocol
+from prisme.acquisition import handshake
+
+# device names PRismes show up as: USB serial adapters and Bluetooth on
+# Linux, serial devices on macOS, other systems are asked to pyserial
+PORT_PATTERNS = ['/dev/ttyUSB*', '/dev/ttyACM*', '/dev/rfcomm*', '/dev/tty.*']
+DEVICE_DIRECTORY = '/dev'
+
+# seconds between scans without hotplug notifications
+POLL_INTERVAL = 2.0
+# seconds a probed port has to answer in, boards reset when opened
+PROBE_TIMEOUT = 2.0
+# seconds to let the system finish setting up a new device node (permissions)
+SETTLE_DELAY = 0.5
+
+# inotify events of the entries of a watched directory
+IN_ATTRIB = 0x004
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+def candidatePorts():
+    # serial ports a PRisme may be on, sorted
+    ports = set()
+    for pattern in PORT_PATTERNS:
+        ports.update(glob.glob(pattern))
+    if not ports:
+        try:
+            from serial.tools.list_ports import comports
+            ports.update(port.device for port in comports())
+        except ImportError:
+            pass
+    return sorted(ports)
+
+def portIdentity(port):
+    # changes when the device node is replaced (unplugged and plugged back),
+    # None where ports aren't files
+    try:
+        status = os.stat(port)
+    except OSError:
+        return None
+    return status.st_rdev, status.st_ctime
+
+def probe(port, timeout=PROBE_TIMEOUT):
+    # whether a PRisme answers the handshake on port
+    try:
+        link = serial.Serial(port=port, baudrate=protocol.DEFAULT_BAUDRATE, timeout=timeout, writeTimeout=timeout)
+    except (serial.SerialException, OSError, ValueError):
+        return False
+    try:
+        return handshake(link) is not None
+    except (serial.SerialException, OSError):
+        return False
+    finally:
+        link.close()
+
+def watchDirectory(path):
+    # inotify file descriptor readable when entries of path are created,
+    # deleted or changed, None where inotify isn't available
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def drain(fd):
+    # throw away the pending notifications, their details don't matter
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError:
+        pass
+
+class DeviceDiscovery(threading.Thread):
+    def __init__(self, onChange=None, ports=(), interval=POLL_INTERVAL, probeTimeout=PROBE_TIMEOUT):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        # called from the discovery thread with the sorted ports PRismes
+        # answered on whenever they change
+        self.onChange = onChange
+        # ports to probe besides those found
+        self.ports = list(ports)
+        self.interval = interval
+        self.probeTimeout = probeTimeout
+        # ports in use, not to be probed (opening a port resets the board),
+        # they keep their last result
+        self.busy = set()
+        self.scans = 0
+        self.probes = 0
+        self._lock = threading.Lock()
+        # port: (identity, whether a PRisme answered), see portIdentity()
+        self._cache = {}
+        self._devices = []
+        self._reprobe = False
+        self._stopping = False
+        # wakes the thread up for a refresh or to stop
+        self._wakeup = threading.Event()
+        self._watch = watchDirectory(DEVICE_DIRECTORY)
+
+    @property
+    def devices(self):
+        # ports PRismes answered on at the last scan, without waiting for the
+        # scan in progress
+        with self._lock:
+            return list(self._devices)
+
+    def refresh(self):
+        # scan now and probe again the ports that didn't answer, returns at once
+        self._reprobe = True
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def run(self):
+        try:
+            while not self._stopping:
+                self.scan(self._reprobe)
+                self.wait()
+        finally:
+            if self._watch is not None:
+                os.close(self._watch)
+
+    def wait(self):
+        # until a refresh, a hotplug notification or the poll interval
+        if self._watch is None:
+            self._wakeup.wait(self.interval)
+        else:
+            # the event can't be selected on, check it a few times a second
+            deadline = self.interval
+            while deadline > 0 and not self._wakeup.is_set():
+                if select.select([self._watch], [], [], min(deadline, 0.25))[0]:
+                    # more notifications come with the same device
+                    self._wakeup.wait(SETTLE_DELAY)
+                    drain(self._watch)
+                    break
+                deadline -= 0.25
+        self._wakeup.clear()
+
+    def scan(self, reprobe=False):
+        # probe the new and changed ports in parallel, returns the PRisme ports
+        self._reprobe = False
+        ports = sorted(set(candidatePorts()) | set(self.ports))
+        identities = dict((port, portIdentity(port)) for port in ports)
+        with self._lock:
+            cache = dict((port, self._cache[port]) for port in ports if port in self._cache)
+        results = {}
+        threads = []
+        for port in ports:
+            cached = cache.get(port)
+            if port in self.busy:
+                # connected to, so a PRisme answered
+                cache[port] = (identities[port], True)
+                continue
+            if cached is not None and cached[0] == identities[port] and (cached[1] or not reprobe):
+                continue
+            thread = threading.Thread(target=lambda port=port: results.__setitem__(port, probe(port, self.probeTimeout)))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # the handshake may look for the device at every rate
+            thread.join()
+        self.probes += len(threads)
+        for port, answered in results.items():
+            cache[port] = (identities[port], answered)
+        devices = sorted(port for port, (identity, answered) in cache.items() if answered)
+        with self._lock:
+            self._cache = cache
+            changed = devices != self._devices
+            self._devices = devices
+        self.scans += 1
+        onChange = self.onChange
+        if changed and onChange is not None:
+            onChange(devices)
+        return devices
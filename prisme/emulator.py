@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# software stand-in for the PRisme firmware (PRismeControlCenter.ino), it sits
+# on a pseudo-terminal so the host application can open it like a real device
+import os, pty, tty, math, time, random, select, termios, threading, collections
+from timeit import default_timer as clock
+
+from prisme import protocol
+from prisme.delta import encodeDelta
+
+def staticCamera(data):
+    # always return the same camera content
+    data = bytes(bytearray(data))
+    if len(data) != protocol.CAMERA_PIXELS:
+        raise ValueError('Camera data must be %d bytes long' % protocol.CAMERA_PIXELS)
+    return lambda emulator: data
+
+def lightSource(position=51.0, width=6.0, peak=220, floor=20, drift=0.0, noise=3, seed=0):
+    # gaussian light spot on a dark background, optionally drifting a number of
+    # pixels every frame and with some random pixel noise, the intensity is
+    # proportional to the integration time (100 μs being the nominal value)
+    rand = random.Random(seed)
+    state = {'position': position}
+
+    def camera(emulator):
+        gain = emulator.intTime / 100.0
+        center = state['position']
+        state['position'] = (center + drift) % protocol.CAMERA_PIXELS
+        data = bytearray(protocol.CAMERA_PIXELS)
+        for i in range(protocol.CAMERA_PIXELS):
+            value = floor + (peak - floor) * math.exp(-((i - center) / width) ** 2 / 2)
+            if noise:
+                value += rand.uniform(-noise, noise)
+            data[i] = max(0, min(255, int(value * gain)))
+        return bytes(data)
+    return camera
+
+class PrismeEmulator(object):
+    def __init__(self, baudrate=protocol.DEFAULT_BAUDRATE, camera=None, ir=None, intTime=100, seed=0):
+        # same default as the firmware
+        self.intTime = intTime
+        # 0 is an unlimited link, which can't be switched to another rate
+        self.baudrate = baudrate
+        self.initialBaudrate = baudrate
+        # rates accepted by CMD_BAUD, and those at which the link then fails as
+        # with an adapter or cable that can't keep up
+        self.supportedBaudrates = list(protocol.BAUDRATES)
+        self.failingBaudrates = []
+        # (previous rate, time) while a rate switch waits for its confirmation
+        self._baudFallback = None
+        self.camera = camera or lightSource()
+        # IR values can be a fixed 5 byte sequence or a callable like the camera
+        self.ir = ir or bytes(bytearray(protocol.IR_SENSORS))
+        self.readoutTime = protocol.READOUT_TIME
+        # round trip latency added by the USB to serial adapter, applied to
+        # incoming data, the pseudo-terminal itself has next to none
+        self.linkLatency = 0.0
+        self.leftSpeed = 0
+        self.rightSpeed = 0
+        # pause between streamed frames in milliseconds, None when not streaming
+        self.streamPause = None
+        # framed data responses and their sequence number
+        self.framing = False
+        self.sequence = 0
+        # keyframe interval of compressed data responses, 0 when disabled, the
+        # frames left until the next keyframe and the previous frame sent
+        self.keyframeInterval = 0
+        self._keyframeWait = 0
+        self._previous = None
+        self._nextFrame = 0
+
+        # injected faults, all probabilities are between 0 and 1
+        # drop single outgoing bytes
+        self.dropRate = 0.0
+        # insert random bytes in the outgoing stream
+        self.noiseRate = 0.0
+        # cut data responses short
+        self.truncateRate = 0.0
+        # lose incoming commands entirely
+        self.ignoreRate = 0.0
+        # stop responding for stallTime seconds before a response
+        self.stallRate = 0.0
+        self.stallTime = 1.0
+        # vanish after this many data responses, as if the USB cable was pulled
+        self.disconnectAfter = None
+        self._random = random.Random(seed)
+
+        # (time, command) of every command received, times are taken with the
+        # same clock as the benchmarks so latencies can be computed directly
+        self.commands = []
+        # time every frame acquisition was started at, and every IR reading
+        # requested alone
+        self.frameTimes = []
+        self.irTimes = []
+        # whether IR readings can be requested alone, older firmware ignores
+        # CMD_IR
+        self.infrared = True
+
+        self._handlers = {
+            protocol.CMD_DATA: self.sendData,
+            protocol.CMD_IR: self.sendInfrared,
+            protocol.CMD_INTTIME: self.setIntTime,
+            protocol.CMD_CONFIG: self.sendConfig,
+            protocol.CMD_SPEED: self.setSpeed,
+            protocol.CMD_BAUD: self.setBaudrate,
+            protocol.CMD_FRAMING: self.setFraming,
+            protocol.CMD_COMPRESSION: self.setCompression,
+            protocol.CMD_RESET: self.reset,
+            protocol.CMD_STREAM: self.startStream,
+            protocol.CMD_STREAM_STOP: self.stopStream,
+        }
+        self._pending = b''
+        # (due time, data) received but not yet through the emulated adapter
+        self._incoming = collections.deque()
+        self._running = False
+        self._thread = None
+
+        self._master, self._slave = pty.openpty()
+        # no echo nor line processing, the link is binary
+        tty.setraw(self._slave)
+        # serial device path to hand over to the host application
+        self.port = os.ttyname(self._slave)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._master = self._slave = -1
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def run(self):
+        while self._running and self._master >= 0:
+            timeout = 0.05
+            if self.streamPause is not None:
+                timeout = min(timeout, self._nextFrame - clock())
+            if self._incoming:
+                timeout = min(timeout, self._incoming[0][0] - clock())
+            if self._baudFallback is not None:
+                timeout = min(timeout, self._baudFallback[1] - clock())
+            try:
+                ready = select.select([self._master], [], [], max(0, timeout))[0]
+                data = os.read(self._master, 256) if ready else b''
+            except (OSError, ValueError, select.error):
+                break
+            if data and not self.rateMatches():
+                # the UART only sees framing errors and garbage
+                data = bytes(bytearray(self._random.randint(0, 255) for b in bytearray(data)))
+            if data and self._random.random() >= self.ignoreRate:
+                self._incoming.append((clock() + self.linkLatency, data))
+            while self._incoming and self._incoming[0][0] <= clock():
+                self._pending += self._incoming.popleft()[1]
+                self.process()
+            if self._baudFallback is not None and clock() >= self._baudFallback[1]:
+                # no confirmation came, back to the previous rate
+                self.baudrate = self._baudFallback[0]
+                self._baudFallback = None
+            # like the firmware main loop, push a frame once the pause is over
+            if self.streamPause is not None and clock() >= self._nextFrame:
+                self.sendData(b'')
+                self._nextFrame = clock() + self.streamPause / 1000.0
+
+    def rateMatches(self):
+        # whether the host configured its side of the link for the rate the
+        # emulated firmware uses, rates without a termios constant can only be
+        # told apart from the standard ones
+        if not self.baudrate:
+            return True
+        try:
+            speed = termios.tcgetattr(self._slave)[4]
+        except termios.error:
+            return True
+        # Linux reports custom rates as BOTHER, which Python calls CBAUDEX
+        other = getattr(termios, 'BOTHER', getattr(termios, 'CBAUDEX', speed))
+        return speed == getattr(termios, 'B%d' % self.baudrate, other)
+
+    def process(self):
+        # handle every complete command, arguments may arrive in separate reads
+        while self._pending:
+            command = self._pending[:1]
+            if self._baudFallback is not None:
+                # the first byte after a rate switch must be a data request
+                # received correctly at the new rate, it is consumed otherwise
+                if command != protocol.CMD_DATA or self.baudrate in self.failingBaudrates:
+                    self.baudrate = self._baudFallback[0]
+                    self._pending = self._pending[1:]
+                self._baudFallback = None
+                continue
+            if command not in self._handlers:
+                # the firmware silently ignores unknown commands
+                self._pending = self._pending[1:]
+                continue
+            size = 1 + protocol.COMMAND_ARGUMENTS[command]
+            if len(self._pending) < size:
+                break
+            data = self._pending[:size]
+            self._pending = self._pending[size:]
+            self.commands.append((clock(), data))
+            self._handlers[command](data[1:])
+
+    def write(self, data):
+        # pace the output as the UART would, 10 bits per byte
+        data = bytearray(data)
+        if not self.rateMatches():
+            data = bytearray(self._random.randint(0, 255) for b in data)
+        if self.dropRate or self.noiseRate:
+            faulty = bytearray()
+            for b in data:
+                if self._random.random() >= self.dropRate:
+                    faulty.append(b)
+                if self._random.random() < self.noiseRate:
+                    faulty.append(self._random.randint(0, 255))
+            data = faulty
+        # the pseudo-terminal is much faster than the real link so each chunk
+        # is held back until the time it would have left the UART, deadlines
+        # accumulate to keep the average rate exact despite sleep granularity
+        deadline = clock()
+        for i in range(0, len(data), 16):
+            chunk = bytes(data[i:i + 16])
+            if self.baudrate:
+                deadline += len(chunk) * 10.0 / self.baudrate
+                delay = deadline - clock()
+                if delay > 0:
+                    time.sleep(delay)
+            os.write(self._master, chunk)
+
+    def stall(self):
+        if self._random.random() < self.stallRate:
+            time.sleep(self.stallTime)
+
+    def sendData(self, args):
+        if self.disconnectAfter is not None and len(self.frameTimes) >= self.disconnectAfter:
+            self._running = False
+            self.close()
+            return
+        self.stall()
+        self.frameTimes.append(clock())
+        # integrate then read the camera and IR sensors
+        time.sleep(self.intTime * 1e-6 + self.readoutTime)
+        camera = self.camera(self)
+        ir = self.ir(self) if callable(self.ir) else self.ir
+        data = bytes(bytearray(camera)) + bytes(bytearray(ir))
+        if self.framing:
+            delta = None
+            if self.keyframeInterval:
+                if self._keyframeWait == 0:
+                    self._keyframeWait = self.keyframeInterval - 1
+                else:
+                    self._keyframeWait -= 1
+                    delta = encodeDelta(self._previous, data)
+                self._previous = data
+            data = protocol.encodeFrame(self.sequence, data if delta is None else delta, delta is not None)
+            self.sequence = (self.sequence + 1) & 0xff
+        if self._random.random() < self.truncateRate:
+            data = data[:self._random.randint(0, len(data) - 1)]
+        self.write(data)
+
+    def sendInfrared(self, args):
+        if not self.infrared:
+            return
+        self.stall()
+        self.irTimes.append(clock())
+        time.sleep(protocol.IR_READOUT_TIME)
+        data = bytes(bytearray(self.ir(self) if callable(self.ir) else self.ir))
+        if self.framing:
+            # shares the sequence numbers, never compressed
+            data = protocol.encodeFrame(self.sequence, data)
+            self.sequence = (self.sequence + 1) & 0xff
+        self.write(data)
+
+    def setIntTime(self, args):
+        self.intTime = protocol.decodeIntTime(args)
+
+    def sendConfig(self, args):
+        self.stall()
+        self.write(bytearray([self.intTime >> 8, self.intTime & 0xff]))
+
+    def setSpeed(self, args):
+        self.leftSpeed, self.rightSpeed = protocol.decodeSpeed(args)
+
+    def reset(self, args):
+        self.leftSpeed = self.rightSpeed = 0
+        self.streamPause = None
+        self.baudrate = self.initialBaudrate
+        self.framing = False
+        self.keyframeInterval = 0
+
+    def setFraming(self, args):
+        self.framing = bool(bytearray(args)[0])
+        self.sequence = 0
+        self._keyframeWait = 0
+
+    def setCompression(self, args):
+        self.keyframeInterval = bytearray(args)[0]
+        self._keyframeWait = 0
+
+    def setBaudrate(self, args):
+        index = bytearray(args)[0]
+        if not self.baudrate or index >= len(protocol.BAUDRATES) or protocol.BAUDRATES[index] not in self.supportedBaudrates:
+            self.write(bytearray([protocol.BAUD_NAK]))
+            return
+        # acknowledged at the current rate, the switch waits for confirmation
+        self.write(bytearray([index]))
+        self._baudFallback = (self.baudrate, clock() + protocol.BAUD_CONFIRM_TIMEOUT)
+        self.baudrate = protocol.BAUDRATES[index]
+
+    def startStream(self, args):
+        self.streamPause = protocol.decodeWord(args)
+        self._nextFrame = clock()
+
+    def stopStream(self, args):
+        self.streamPause = None
@@ -0,0 +1,71 @@
+# compact representation of a data response: the bytes received are kept as
+# they are and the camera and IR values are views into them, nothing is parsed
+import os, select
+from timeit import default_timer as clock
+
+from prisme import protocol
+from prisme.latency import STAGES
+
+class Frame(object):
+    __slots__ = ('data', 'camera', 'ir', 'timestamp', 'sequence', 'stages', 'irOnly')
+
+    def __init__(self, data=None):
+        self.data = bytearray(protocol.FRAME_SIZE)
+        if data is not None:
+            self.data[:] = data
+        view = memoryview(self.data)
+        # unsigned byte views, use tolist() to get plain integers
+        self.camera = view[:protocol.CAMERA_PIXELS]
+        # in the order sent by the firmware
+        self.ir = view[protocol.CAMERA_PIXELS:]
+        # clock() time the frame was completely received at
+        self.timestamp = 0.0
+        self.sequence = 0
+        # clock() time of every stage the frame went through, see prisme.latency
+        self.stages = [0.0] * len(STAGES)
+        # answer to an IR request (see protocol.CMD_IR): only the IR values
+        # are new, the camera pixels are those of the last data response
+        self.irOnly = False
+
+    def copy(self):
+        frame = Frame(self.data)
+        frame.timestamp = self.timestamp
+        frame.sequence = self.sequence
+        frame.stages[:] = self.stages
+        frame.irOnly = self.irOnly
+        return frame
+
+class FramePool(object):
+    # preallocated frames handed out in turn so that steady state acquisition
+    # allocates nothing, a frame is reused after size newer frames: consumers
+    # keeping frames for longer have to copy them
+    def __init__(self, size=8):
+        self._frames = [Frame() for i in range(size)]
+        self._index = 0
+
+    def acquire(self):
+        frame = self._frames[self._index]
+        self._index = (self._index + 1) % len(self._frames)
+        return frame
+
+def readInto(link, buffer):
+    # fill buffer from the serial link and return the number of bytes read, less
+    # than requested when the link timeout expired, reading straight from the
+    # file descriptor avoids the intermediate copy made by pyserial
+    fd = getattr(link, 'fd', None)
+    if fd is None or not hasattr(os, 'readv'):
+        return link.readinto(buffer)
+    view = memoryview(buffer)
+    size = len(view)
+    count = 0
+    deadline = None if link.timeout is None else clock() + link.timeout
+    while count < size:
+        timeout = None if deadline is None else max(0, deadline - clock())
+        if not select.select([fd], [], [], timeout)[0]:
+            break
+        read = os.readv(fd, [view[count:]])
+        if read == 0:
+            # the device disappeared (USB unplugged)
+            raise OSError('device reports readiness to read but returned no data')
+        count += read
+    return count
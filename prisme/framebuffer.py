@@ -0,0 +1,53 @@
+# frame exchange between the acquisition thread and its consumers, the
+# producer never waits: when the buffer is full the oldest frame is dropped
+import threading, collections
+
+class FrameBuffer(object):
+    def __init__(self, size=1):
+        # a size of 1 makes this a latest-frame slot
+        self._frames = collections.deque(maxlen=size)
+        self._condition = threading.Condition()
+        self.produced = 0
+        self.consumed = 0
+        # frames overwritten before anyone took them
+        self.dropped = 0
+        # frames passed over by consumers only interested in the newest one
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        with self._condition:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(frame)
+            self.produced += 1
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        # oldest frame, waiting up to timeout seconds for one, None if none came
+        with self._condition:
+            if not self._frames:
+                self._condition.wait(timeout)
+                if not self._frames:
+                    return None
+            self.consumed += 1
+            return self._frames.popleft()
+
+    def latest(self):
+        # newest frame without waiting, older ones are discarded, None when
+        # nothing arrived since the last call
+        with self._condition:
+            if not self._frames:
+                return None
+            frame = self._frames.pop()
+            self.skipped += len(self._frames)
+            self._frames.clear()
+            self.consumed += 1
+            return frame
+
+    def clear(self):
+        with self._condition:
+            self._frames.clear()
+            self.produced = self.consumed = self.dropped = self.skipped = 0
@@ -0,0 +1,187 @@
+# incremental parser of framed data responses (see protocol.FRAME_SYNC):
+# bytes are fed as they arrive in any amount, complete and valid frames come
+# out, anything else is skipped up to the next sync marker so a lost or extra
+# byte costs one frame instead of the connection, compressed frames (see
+# protocol.DELTA_FLAG) are decoded against the previous one
+from prisme import protocol
+from prisme.frame import FramePool
+from prisme.delta import decodeDelta
+
+def isFramed(data):
+    # whether the response to a data request is a framed one, even a damaged
+    # one: a raw frame is very unlikely to contain a marker and the length
+    data = bytearray(data)
+    start = data.find(protocol.FRAME_SYNC)
+    while 0 <= start < len(data) - 3:
+        if data[start + 3] == protocol.FRAME_SIZE:
+            return True
+        start = data.find(protocol.FRAME_SYNC, start + 1)
+    return False
+
+class FrameParser(object):
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else FramePool()
+        self._buffer = bytearray()
+        # next sequence number expected from the device
+        self._sequence = None
+        # sequence number of the last frame, unwrapped: it keeps counting past
+        # 255 so gaps show in the frames handed over
+        self.sequence = None
+        # frames known to be missing, see takeMissing()
+        self._missing = 0
+        self._corruptedSinceFrame = 0
+        # last frame handed over, compressed frames are differences to it
+        # unless it was lost
+        self._reference = bytearray(protocol.FRAME_SIZE)
+        self._referenceValid = False
+        # a keyframe was asked for and hasn't come yet, see takeKeyframeRequest()
+        self._keyframeRequested = False
+        self._keyframeWanted = False
+        self.frames = 0
+        # frames rejected because of their length or CRC
+        self.corrupted = 0
+        # gaps in the sequence numbers, corrupted frames included
+        self.lost = 0
+        # bytes thrown away while looking for a sync marker
+        self.skipped = 0
+        # compressed frames among the frames, and the payload bytes of all of
+        # them as received
+        self.deltas = 0
+        self.payloadBytes = 0
+        # IR responses (see protocol.CMD_IR), not counted among the frames
+        self.irFrames = 0
+
+    @property
+    def compressionRatio(self):
+        # frame bytes decoded per payload byte received
+        if not self.payloadBytes:
+            return 1.0
+        return float(self.frames * protocol.FRAME_SIZE) / self.payloadBytes
+
+    def __len__(self):
+        # bytes waiting to be parsed
+        return len(self._buffer)
+
+    def feed(self, data):
+        self._buffer += data
+
+    def reset(self):
+        del self._buffer[:]
+        self._sequence = self.sequence = None
+        self._missing = self._corruptedSinceFrame = 0
+        self._referenceValid = self._keyframeRequested = self._keyframeWanted = False
+
+    def takeMissing(self):
+        # number of frames found missing since the last call, each of them
+        # consumed a data request when polling
+        missing = self._missing
+        self._missing = 0
+        return missing
+
+    def takeKeyframeRequest(self):
+        # whether a compressed frame couldn't be decoded since the last call,
+        # the device should then be asked for a keyframe (see
+        # protocol.CMD_COMPRESSION), once until it comes
+        wanted = self._keyframeWanted
+        self._keyframeWanted = False
+        if wanted:
+            self._keyframeRequested = True
+        return wanted
+
+    def next(self):
+        # next valid frame from the bytes fed so far, None until one is complete
+        buffer = self._buffer
+        while True:
+            start = buffer.find(protocol.FRAME_SYNC)
+            if start < 0:
+                # the last byte may be the beginning of a marker
+                keep = 1 if buffer[-1:] == protocol.FRAME_SYNC[:1] else 0
+                self.skipped += len(buffer) - keep
+                del buffer[:len(buffer) - keep]
+                return None
+            if start:
+                self.skipped += start
+                del buffer[:start]
+            if len(buffer) < protocol.FRAME_HEADER_SIZE:
+                return None
+            sequence = buffer[2]
+            length = buffer[3]
+            irOnly = length == protocol.IR_SENSORS
+            delta = length != protocol.FRAME_SIZE and not irOnly
+            if delta:
+                length &= ~protocol.DELTA_FLAG
+                if not buffer[3] & protocol.DELTA_FLAG or not 0 < length < protocol.FRAME_SIZE:
+                    # a marker in the middle of other data
+                    self.skipped += 1
+                    del buffer[:1]
+                    continue
+            end = protocol.FRAME_HEADER_SIZE + length + protocol.FRAME_CRC_SIZE
+            if len(buffer) < end:
+                return None
+            crc = (buffer[end - 2] << 8) | buffer[end - 1]
+            if protocol.crc16(bytes(buffer[2:end - 2])) != crc:
+                self.rejected()
+                continue
+
+            if self._sequence is None:
+                self.sequence = sequence
+            else:
+                gap = (sequence - self._sequence) & 0xff
+                if gap:
+                    # the frame a compressed one would be decoded against, or
+                    # the keyframe asked for, may be among the missing ones
+                    self._referenceValid = self._keyframeRequested = False
+                self.sequence += gap + 1
+                self.lost += gap
+                # missing frames not already counted as corrupted
+                self._missing += max(0, gap - self._corruptedSinceFrame)
+            self._corruptedSinceFrame = 0
+            self._sequence = (sequence + 1) & 0xff
+
+            payload = buffer[protocol.FRAME_HEADER_SIZE:end - 2]
+            del buffer[:end]
+            if delta and not self._referenceValid:
+                self.undecodable()
+                continue
+            frame = self.pool.acquire()
+            frame.irOnly = irOnly
+            if irOnly:
+                # the camera of the last frame with the new IR values, the
+                # frames compressed ones are relative to aren't changed
+                frame.data[:protocol.CAMERA_PIXELS] = self._reference[:protocol.CAMERA_PIXELS]
+                frame.data[protocol.CAMERA_PIXELS:] = payload
+                self.irFrames += 1
+                return frame
+            if not delta:
+                frame.data[:] = payload
+                self._keyframeRequested = False
+            elif decodeDelta(self._reference, payload, frame.data):
+                self.deltas += 1
+            else:
+                # a valid CRC but not a valid encoding
+                self.undecodable()
+                continue
+            self._reference[:] = frame.data
+            self._referenceValid = True
+            self.frames += 1
+            self.payloadBytes += length
+            return frame
+
+    def undecodable(self):
+        # a compressed frame without the frame it is relative to, it took a
+        # request and frames are as good as lost until a keyframe comes
+        self.lost += 1
+        self._missing += 1
+        self._referenceValid = False
+        if not self._keyframeRequested:
+            self._keyframeWanted = True
+
+    def rejected(self):
+        # the frame was damaged (or the marker false), look for the next
+        # marker from the following byte
+        self.corrupted += 1
+        self._missing += 1
+        self._corruptedSinceFrame += 1
+        self._keyframeRequested = False
+        self.skipped += 1
+        del self._buffer[:1]
@@ -0,0 +1,894 @@
+# -*- coding: utf-8 -*-
+# user interface of the PRisme Control Center, wx and the plot library are
+# only imported along with this module so that acquisition can run headless
+
+# threading required to update UI asynchronously
+import wx, serial, threading
+from timeit import default_timer as clock
+from prisme import protocol, stats
+from prisme.calibration import Calibration, CalibrationPipeline, EmaFilter, MedianFilter, averageFrames, calibrationPath
+from prisme.control import LightTracker
+from prisme.discovery import DeviceDiscovery
+from prisme.acquisition import Acquisition, openLink, handshake, negotiateBaudrate, enableFraming, probeInfrared, PIPELINE_DEPTH, DISCONNECT_ERROR
+from prisme.framebuffer import FrameBuffer
+from prisme.latency import Latencies, STAGE_POSTED, STAGE_DRAWN
+from prisme.history import FrameHistory
+from prisme.plot import CameraPlot, Waterfall
+from prisme.recorder import SessionRecorder
+from prisme.replay import ReplaySerial
+
+# user interface refresh rate in Hz, the most frames shown per second
+# whatever rate they are acquired at
+REFRESH_RATE = 30
+
+# frames shown by the waterfall
+HISTORY_ROWS = 2048
+
+# shared memory the frames are published in with Share checked
+SHARED_NAME = 'prisme'
+
+# replay speed choices, 0 is as fast as possible
+REPLAY_SPEEDS = [1, 2, 5, 10, 0]
+
+# last frames averaged into a dark or flat reference
+CALIBRATION_FRAMES = 50
+# temporal filter choices, see prisme.calibration
+FILTERS = ['No filter', 'Average', 'Median']
+EMA_ALPHA = 0.2
+MEDIAN_LENGTH = 5
+
+class Control(wx.Frame):
+    def __init__(self, parent, title):
+        super(Control, self).__init__(parent, title=title, size=(700, 600))
+        # default speed value
+        self.speed = 20
+        self.lastGo = 0
+        # session being replayed instead of a device
+        self.replay = None
+        # acquisition in progress, None when disconnected
+        self.acquisition = None
+        # the handshake and probes of a connection are under way
+        self.connecting = False
+        # newest frame read by the acquisition thread, the user interface
+        # picks it up at its own pace so a slow repaint never holds back the
+        # serial link
+        self.frameBuffer = FrameBuffer()
+        # session recorder, None when not recording
+        self.recorder = None
+        # dark and flat frames of the device or session connected, None when
+        # it was never calibrated, and the file they are kept in
+        self.calibration = None
+        self.calibrationPath = None
+        # ports PRismes answer on, found and probed from a thread of its own so
+        # that startup and refreshes never wait for them
+        self.discovery = DeviceDiscovery(onChange=lambda devices: wx.CallAfter(self.showDevices, devices))
+        # camera pixels of every frame acquired lately, written by the
+        # acquisition thread for the waterfall
+        self.history = FrameHistory(HISTORY_ROWS)
+        # frames shared with other processes, None when not sharing
+        self.sharedFrames = None
+        # latencies of the last connection, kept after it for export
+        self.latencies = None
+        # what the status widgets show, see show()
+        self._shown = {}
+        # create the window
+        self.InitUI()
+        self.Centre()
+        self.SetTitle('PRisme Control Center')
+        self.Show()
+    
+    def uiUpdate(self, event):
+        # nobody would see the frame
+        if self.IsIconized():
+            return
+        # only the newest frame is shown, older ones are skipped
+        frame = self.frameBuffer.latest()
+        if frame is None:
+            return
+        
+        if self.replay is not None:
+            self.show(self.sl_replay, self.replay.position)
+        
+        # update graph, the plot keeps a copy of the pixels as the frame will
+        # be reused by the acquisition thread
+        camera = stats.cameraArray(frame)
+        values = stats.cameraStats(camera)
+        peak = round(float(values.subpixelPeak), 1)
+        average = int(values.average)
+        self.canvas.setData(camera, peak, average)
+        self.waterfall.update()
+        
+        # update graph values, widgets whose value didn't change are left
+        # alone
+        self.show(self.st_peak, str(peak))
+        self.show(self.st_max, str(int(values.maximum)))
+        self.show(self.st_min, str(int(values.minimum)))
+        self.show(self.st_delta, str(int(values.delta)))
+        self.show(self.st_avg, str(average))
+        self.show(self.st_dropped, str(self.frameBuffer.dropped + self.frameBuffer.skipped))
+        parser = self.acquisition.parser if self.acquisition is not None else None
+        if parser is not None:
+            self.show(self.st_lost, "%d (%d corrupted)" % (parser.lost, parser.corrupted))
+        if self.acquisition is not None:
+            scheduler = self.acquisition.scheduler
+            self.show(self.st_commands, "%d queued, %.0f ms" % (len(scheduler), scheduler.latency * 1000))
+        
+        # update IR sensor values
+        for sensor, value in zip(self.irSensors, frame.ir.tolist()):
+            self.show(sensor, str(value), (255, value, value))
+        
+        if self.latencies is not None:
+            frame.stages[STAGE_DRAWN] = clock()
+            self.latencies.recordFrame(frame, STAGE_POSTED, STAGE_DRAWN)
+
+    def show(self, widget, value, colour=None):
+        # setting a widget repaints it even when its value is the same, only
+        # the ones that changed are set
+        if self._shown.get(id(widget)) == (value, colour):
+            return
+        self._shown[id(widget)] = (value, colour)
+        if isinstance(widget, wx.TextCtrl):
+            widget.ChangeValue(value)
+        elif isinstance(widget, wx.Slider):
+            widget.SetValue(value)
+        else:
+            widget.SetLabel(value)
+        if colour is not None:
+            widget.SetBackgroundColour(colour)
+
+    def uiReset(self, event):
+        # reset user interface
+        self.frameBuffer.clear()
+        self.canvas.clear()
+        
+        # reset go instruction
+        self.lastGo = 0
+        
+        # update graph values
+        self.tc_intTime.SetValue("0")
+        self.show(self.st_peak, "0")
+        self.show(self.st_max, "0")
+        self.show(self.st_min, "0")
+        self.show(self.st_delta, "0")
+        self.show(self.st_avg, "0")
+        
+        # update IR sensor values
+        for sensor in self.irSensors:
+            self.show(sensor, "0", 'white')
+    
+        # disable controls
+        self.b_setIntTime.Disable()
+        self.b_forwards.Disable()
+        self.b_back.Disable()
+        self.b_left.Disable()
+        self.b_right.Disable()
+        self.b_stop.Disable()
+        self.cb_track.SetValue(False)
+        self.cb_track.Disable()
+        self.b_dark.Disable()
+        self.b_flat.Disable()
+        
+        # acquisition mode and rate can only be changed when disconnected
+        self.cb_stream.Enable()
+        self.tc_frameRate.Enable()
+        self.cb_irRate.Enable()
+        self.tc_irRate.Enable()
+        self.ch_baudrate.Enable()
+        self.cb_compress.Enable()
+        self.cb_share.Enable()
+        self.st_baudrate.SetLabel("")
+        self.show(self.st_lost, "")
+        self.show(self.st_commands, "")
+        
+        # end of replay
+        self.replay = None
+        self.b_replay.SetLabel("Replay...")
+        self.ch_replaySpeed.Enable()
+        self.sl_replay.Disable()
+        
+        self.b_toggleConnect.SetLabel("Connect")
+        self.b_toggleConnect.Enable()
+        self.b_replay.Enable()
+
+    def toggleConnect(self, event):
+        if self.connecting:
+            return
+        if self.acquisition is None:
+            if self.deviceList.GetStringSelection() != '':
+                if not self.checkFrameRate():
+                    return
+                
+                # start serial
+                port = self.deviceList.GetStringSelection()
+                try:
+                    link = openLink(port)
+                except serial.SerialException:
+                    wx.MessageBox('Could not connect to device', 'Error', wx.OK|wx.ICON_ERROR)
+                    return
+                # not to be probed while connected
+                self.discovery.busy.add(port)
+                self.calibrationPath = calibrationPath(port)
+                self.connect(link)
+        else:
+            # ask for serial communication end, a paused replay has to go on
+            # for the acquisition thread to notice
+            self.acquisition.stop()
+            if self.replay is not None:
+                self.replay.resume()
+    
+    def checkFrameRate(self):
+        # verify user input value
+        if self.cb_stream.GetValue() and not self.tc_frameRate.GetValue().isdigit():
+            wx.MessageBox('Frame rate must be a positive numeric value, 0 for maximum', 'Error', wx.OK|wx.ICON_ERROR)
+            return False
+        if self.cb_irRate.GetValue() and (not self.tc_irRate.GetValue().isdigit() or not int(self.tc_irRate.GetValue())):
+            wx.MessageBox('IR rate must be a positive numeric value', 'Error', wx.OK|wx.ICON_ERROR)
+            return False
+        return True
+    
+    def connect(self, link):
+        # the handshake, rate negotiation and probes take up to seconds when
+        # the device doesn't answer at once, they run in a thread of their own
+        # and connected() carries on in this one, the window stays responsive
+        self.connecting = True
+        self.b_toggleConnect.SetLabel("Connecting...")
+        self.b_toggleConnect.Disable()
+        self.b_replay.Disable()
+        replay = self.replay is not None
+        choice = self.ch_baudrate.GetSelection()
+        maximum = protocol.BAUDRATES[choice - 1] if choice > 0 else None
+        # IR requests only go with polling
+        infrared = self.cb_irRate.GetValue() and not self.cb_stream.GetValue()
+
+        def run():
+            # load integration time value from device
+            intTime = handshake(link)
+            baudrate, framed, irAnswered = protocol.DEFAULT_BAUDRATE, False, False
+            if intTime is not None:
+                # switch to the fastest rate both sides support, up to the
+                # chosen one
+                if not replay:
+                    baudrate = negotiateBaudrate(link, maximum)
+                # frame data responses if the firmware can, a lost or extra
+                # byte then costs a frame instead of the connection
+                framed = enableFraming(link)
+                irAnswered = infrared and probeInfrared(link, framed)
+            wx.CallAfter(self.connected, link, intTime, baudrate, framed, irAnswered)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def connected(self, link, intTime, baudrate, framed, irAnswered):
+        # the window may have been closed in the meantime
+        if not self:
+            link.close()
+            return
+        self.connecting = False
+        if intTime is None:
+            wx.MessageBox('Check connection please', 'Error', wx.OK|wx.ICON_ERROR)
+            link.close()
+            self.discovery.busy.clear()
+            self.uiReset(None)
+            return
+        
+        self.tc_intTime.SetValue(str(intTime))
+        self.st_baudrate.SetLabel("%d baud" % baudrate)
+        self.show(self.st_lost, "0" if framed else "-")
+    
+        # relabel button
+        self.b_toggleConnect.SetLabel("Disconnect")
+        self.b_toggleConnect.Enable()
+        self.b_replay.Enable()
+        
+        self.lastGo = 0
+        # enable controls
+        self.b_setIntTime.Enable()
+        self.b_forwards.Enable()
+        self.b_back.Enable()
+        self.b_left.Enable()
+        self.b_right.Enable()
+        self.b_stop.Enable()
+        self.cb_track.Enable()
+        self.b_latencies.Enable()
+        self.cb_stream.Disable()
+        self.tc_frameRate.Disable()
+        self.cb_irRate.Disable()
+        self.tc_irRate.Disable()
+        self.ch_baudrate.Disable()
+        self.cb_compress.Disable()
+        self.cb_share.Disable()
+        
+        # either have the device stream frames (requires the firmware
+        # shipped with this application) or poll for them
+        pause = None
+        if self.cb_stream.GetValue():
+            pause = protocol.streamPause(int(self.tc_frameRate.GetValue()), baudrate, intTime)
+        
+        # when polling, the IR sensors alone in between frames if the
+        # firmware can
+        irRate = None
+        if pause is None and self.cb_irRate.GetValue():
+            if irAnswered:
+                irRate = int(self.tc_irRate.GetValue())
+            else:
+                self.cb_irRate.SetValue(False)
+        
+        # start acquisition thread, it reports back from its own thread
+        self.latencies = Latencies()
+        self.acquisition = Acquisition(link, pause, PIPELINE_DEPTH, self.frameBuffer,
+            onDisconnect=lambda reason: wx.CallAfter(self.onDisconnected, reason), framed=framed,
+            compression=protocol.KEYFRAME_INTERVAL if self.cb_compress.GetValue() else None, latencies=self.latencies,
+            irRate=irRate)
+        self.acquisition.recorder = self.recorder
+        try:
+            self.calibration = Calibration.load(self.calibrationPath)
+        except (IOError, OSError, KeyError, ValueError):
+            self.calibration = None
+        self.updateCalibration(None)
+        self.history.clear()
+        self.acquisition.onFrame = self.history.append
+        if self.cb_share.GetValue():
+            self.shareFrames()
+        self.acquisition.start()
+    
+    def shareFrames(self):
+        # every frame to other processes on this computer as well, see
+        # prisme.sharedframes
+        try:
+            from prisme.sharedframes import SharedFrameWriter
+            try:
+                self.sharedFrames = SharedFrameWriter(SHARED_NAME)
+            except FileExistsError:
+                # another writer, live or gone without cleaning up
+                if wx.MessageBox('Frames are already shared as %s, take the name over?' % SHARED_NAME, 'Share',
+                        wx.YES_NO|wx.ICON_QUESTION) != wx.YES:
+                    return
+                self.sharedFrames = SharedFrameWriter(SHARED_NAME, replace=True)
+        except (ImportError, OSError, ValueError):
+            wx.MessageBox('Could not share frames', 'Error', wx.OK|wx.ICON_ERROR)
+            return
+        history, shared = self.history, self.sharedFrames
+
+        def onFrame(frame):
+            history.append(frame)
+            shared.publish(frame)
+        self.acquisition.onFrame = onFrame
+    
+    def onDisconnected(self, reason):
+        self.acquisition = None
+        if self.sharedFrames is not None:
+            self.sharedFrames.close()
+            self.sharedFrames = None
+        self.discovery.busy.clear()
+        if reason == DISCONNECT_ERROR:
+            # rescan devices list to remove disconnected device
+            self.scanDevices(None)
+            wx.MessageBox('Connection error', 'Error', wx.OK|wx.ICON_ERROR)
+        self.uiReset(None)
+    
+    def onClose(self, event):
+        # nothing may be called back once the window is gone
+        self.discovery.onChange = None
+        self.discovery.stop()
+        # stop the acquisition before the window goes away
+        if self.acquisition is not None:
+            self.acquisition.onDisconnect = None
+            self.acquisition.stop()
+            if self.replay is not None:
+                self.replay.resume()
+            self.acquisition.join()
+        if self.sharedFrames is not None:
+            self.sharedFrames.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        event.Skip()
+    
+    def toggleReplay(self, event):
+        if self.replay is not None:
+            # pause or resume the replay in progress
+            if self.replay.paused:
+                self.replay.resume()
+                self.b_replay.SetLabel("Pause")
+            else:
+                self.replay.pause()
+                self.b_replay.SetLabel("Resume")
+            return
+        
+        if self.acquisition is not None or self.connecting or not self.checkFrameRate():
+            return
+        dialog = wx.FileDialog(self, 'Replay session', wildcard='PRisme sessions (*.prs)|*.prs', style=wx.FD_OPEN)
+        if dialog.ShowModal() == wx.ID_OK:
+            # replay the session in place of a device
+            try:
+                self.replay = ReplaySerial(dialog.GetPath(), REPLAY_SPEEDS[self.ch_replaySpeed.GetSelection()])
+            except (IOError, ValueError):
+                wx.MessageBox('Could not open session file', 'Error', wx.OK|wx.ICON_ERROR)
+            else:
+                self.calibrationPath = calibrationPath(dialog.GetPath())
+                self.sl_replay.SetRange(0, len(self.replay) - 1)
+                self.show(self.sl_replay, 0)
+                self.sl_replay.Enable()
+                self.b_replay.SetLabel("Pause")
+                self.ch_replaySpeed.Disable()
+                self.connect(self.replay)
+        dialog.Destroy()
+    
+    def seekReplay(self, event):
+        if self.replay is not None:
+            self.replay.seek(self.sl_replay.GetValue())
+    
+    def toggleWaterfall(self, event):
+        # the history keeps filling while hidden
+        waterfall = self.cb_waterfall.GetValue()
+        self.canvas.Show(not waterfall)
+        self.waterfall.Show(waterfall)
+        self.canvas.GetParent().Layout()
+    
+    def scanDevices(self, event):
+        # rescan available devices, the list is updated when the probes are
+        # done
+        self.discovery.refresh()
+    
+    def showDevices(self, devices):
+        # keep the selected device selected
+        selected = self.deviceList.GetStringSelection()
+        self.deviceList.Set(devices)
+        if selected in devices:
+            self.deviceList.SetStringSelection(selected)
+    
+    def exportLatencies(self, event):
+        # the summary as text or every distribution as CSV, by file extension
+        if self.latencies is None:
+            return
+        dialog = wx.FileDialog(self, 'Export latencies to', wildcard='CSV files (*.csv)|*.csv|Text files (*.txt)|*.txt',
+            style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_OK:
+            path = dialog.GetPath()
+            try:
+                with open(path, 'w') as out:
+                    if path.endswith('.txt'):
+                        self.latencies.report(out)
+                    else:
+                        self.latencies.export(out)
+            except IOError:
+                wx.MessageBox('Could not write latencies file', 'Error', wx.OK|wx.ICON_ERROR)
+        dialog.Destroy()
+
+    def toggleRecord(self, event):
+        if self.recorder is None:
+            dialog = wx.FileDialog(self, 'Record session to', wildcard='PRisme sessions (*.prs)|*.prs', style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT)
+            if dialog.ShowModal() == wx.ID_OK:
+                try:
+                    self.recorder = SessionRecorder(dialog.GetPath())
+                except IOError:
+                    wx.MessageBox('Could not create session file', 'Error', wx.OK|wx.ICON_ERROR)
+                else:
+                    if self.acquisition is not None:
+                        self.acquisition.recorder = self.recorder
+                    self.b_record.SetLabel('Stop recording')
+            dialog.Destroy()
+        else:
+            # records the acquisition thread still hands over once the file
+            # is closed are ignored
+            if self.acquisition is not None:
+                self.acquisition.recorder = None
+            self.recorder.close()
+            self.recorder = None
+            self.b_record.SetLabel('Record')
+    
+    def setIntTime(self, event):
+        if self.acquisition is not None:
+        
+            if not self.tc_intTime.GetValue().isdigit():
+                wx.MessageBox('Integration time must be a positive numeric value', 'Error', wx.OK|wx.ICON_ERROR)
+                return
+            
+            value = int(self.tc_intTime.GetValue())
+            
+            if value < 0 or value > 65535:
+                wx.MessageBox('Integration time must be between 0 and 65535', 'Error', wx.OK|wx.ICON_ERROR)
+                return
+        
+            # send new integration time to device one byte at a time
+            self.acquisition.queueCommand(protocol.intTimeCommand(value))
+    
+    def onKey(self, event):
+        # command latencies are measured from the key press
+        pressed = clock()
+        k = event.GetKeyCode()
+        if k == 119 or k == wx.WXK_UP:
+            self.go('forwards', pressed)
+        elif k == 115 or k == wx.WXK_DOWN:
+            self.go('back', pressed)
+        elif k == 97 or k == wx.WXK_LEFT:
+            self.go('left', pressed)
+        elif k == 100 or k == wx.WXK_RIGHT:
+            self.go('right', pressed)
+        elif k == wx.WXK_SPACE:
+            self.go('stop', pressed)
+        else:
+            event.Skip()
+
+    def go(self, direction, timestamp=None):
+        # prevent sending commands when no connection is available or the last command was the same as the new
+        if self.acquisition is None or self.lastGo == direction:
+            return
+        
+        # manual commands take over from the light tracker
+        if self.cb_track.GetValue():
+            self.cb_track.SetValue(False)
+            self.acquisition.controller = None
+        
+        # verify user input value
+        if not self.tc_speed.GetValue().isdigit():
+            wx.MessageBox('Speed must be a positive numeric value', 'Error', wx.OK|wx.ICON_ERROR)
+            return
+            
+        speed = int(self.tc_speed.GetValue())
+        
+        if speed < 1 or speed > 100:
+            wx.MessageBox('Speed must be between 1 and 100', 'Error', wx.OK|wx.ICON_ERROR)
+            return
+        
+        if direction == 'forwards':
+            left = speed
+            right = speed
+        elif direction == 'back':
+            left = -speed
+            right = -speed
+        elif direction == 'left':
+            left = -speed
+            right = speed
+        elif direction == 'right':
+            left = speed
+            right = -speed
+        else:
+            left = 0
+            right = 0
+        
+        # send command to queue
+        self.acquisition.queueCommand(protocol.speedCommand(left, right), timestamp)
+        self.lastGo = direction
+    
+    def resetGo(self, event):
+        self.lastGo = 0
+    
+    def updateCalibration(self, event):
+        # the acquisition thread corrects every frame with the pipeline set,
+        # see prisme.calibration
+        if self.acquisition is None:
+            return
+        if self.cb_calibrate.GetValue() and self.calibration is None:
+            if event is not None:
+                wx.MessageBox('Capture a dark frame first, with the camera covered', 'Error', wx.OK|wx.ICON_ERROR)
+            self.cb_calibrate.SetValue(False)
+        calibration = self.calibration if self.cb_calibrate.GetValue() else None
+        choice = self.ch_filter.GetSelection()
+        filter = EmaFilter(EMA_ALPHA) if choice == 1 else MedianFilter(MEDIAN_LENGTH) if choice == 2 else None
+        pipeline = None
+        if calibration is not None or filter is not None:
+            pipeline = CalibrationPipeline(calibration, filter)
+        self.acquisition.calibration = pipeline
+        # references are taken from the frames as received
+        self.b_dark.Enable(pipeline is None)
+        self.b_flat.Enable(pipeline is None)
+
+    def captureReference(self, dark):
+        # average of the last frames shown as the dark or flat reference, kept
+        # for the next connections to the same device
+        frames = self.history.last(CALIBRATION_FRAMES)
+        if len(frames) < CALIBRATION_FRAMES:
+            wx.MessageBox('Wait for %d frames please' % CALIBRATION_FRAMES, 'Error', wx.OK|wx.ICON_ERROR)
+            return
+        reference = averageFrames(frames)
+        previous = self.calibration if self.calibration is not None else Calibration()
+        if dark:
+            self.calibration = Calibration(reference, previous.flat)
+        else:
+            self.calibration = Calibration(previous.dark, reference)
+        try:
+            self.calibration.save(self.calibrationPath)
+        except (IOError, OSError):
+            wx.MessageBox('Could not save the calibration', 'Error', wx.OK|wx.ICON_ERROR)
+
+    def toggleTrack(self, event):
+        # the light tracker drives the robot from the acquisition thread on
+        # every frame, see prisme.control
+        if self.acquisition is None:
+            return
+        if not self.cb_track.GetValue():
+            self.acquisition.controller = None
+            self.acquisition.queueCommand(protocol.speedCommand(0, 0))
+            self.lastGo = 0
+            return
+        if not self.tc_speed.GetValue().isdigit() or not 1 <= int(self.tc_speed.GetValue()) <= 100:
+            wx.MessageBox('Speed must be between 1 and 100', 'Error', wx.OK|wx.ICON_ERROR)
+            self.cb_track.SetValue(False)
+            return
+        self.acquisition.controller = LightTracker(int(self.tc_speed.GetValue()))
+        self.lastGo = 0
+        
+    def InitUI(self):
+        # asynchronous ui update, polls for new frames at the refresh rate
+        self.refreshTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.uiUpdate, self.refreshTimer)
+        self.refreshTimer.Start(1000 // REFRESH_RATE)
+        self.Bind(wx.EVT_CLOSE, self.onClose)
+        
+        # keyboard shortcuts
+        self.Bind(wx.EVT_CHAR_HOOK, self.onKey)
+        
+        # build the user interface
+        
+        # a vertical box sizer that lists items vertically
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        self.SetSizer(vbox)
+        self.SetMinSize((600,500));
+        
+        # main panel
+        lc_pnl = wx.Panel(self)
+        
+        # containter box with label
+        lc_sb = wx.StaticBox(lc_pnl, label='Linear Camera Output')
+        # horizontal box to align the graph and controls
+        lc_sbs = wx.StaticBoxSizer(lc_sb, orient=wx.HORIZONTAL)
+        # size the panel according to the box sizer
+        lc_pnl.SetSizer(lc_sbs)
+        
+        # create graph
+        self.canvas = CameraPlot(lc_pnl)
+        # add graph to horizontal static box sizer, with a proportion of 3 and fill the available space
+        lc_sbs.Add(self.canvas, 3, wx.EXPAND)
+        # the last frames instead of the graph, newest at the bottom
+        self.waterfall = Waterfall(lc_pnl, self.history)
+        self.waterfall.Hide()
+        lc_sbs.Add(self.waterfall, 3, wx.EXPAND)
+        
+        # linear camera control and values
+        lc_bs_ctrl = wx.BoxSizer(wx.VERTICAL)
+        lc_sbs.Add(lc_bs_ctrl, 1, wx.LEFT, 5)
+        
+        # intergration time label
+        lc_bs_ctrl.Add(wx.StaticText(lc_pnl, label="Integration time [μs]"))
+        
+        # control interface elements
+        self.tc_intTime = wx.TextCtrl(lc_pnl, style=wx.TE_PROCESS_ENTER)
+        self.tc_intTime.Bind(wx.EVT_TEXT_ENTER, self.setIntTime)
+        
+        # button to send intergration time value to robot
+        self.b_setIntTime = wx.Button(lc_pnl, label='Set')
+        self.b_setIntTime.Bind(wx.EVT_BUTTON, self.setIntTime)
+        
+        # stream frames from the device at the given rate instead of polling
+        self.cb_stream = wx.CheckBox(lc_pnl, label="Stream [fps]")
+        self.tc_frameRate = wx.TextCtrl(lc_pnl, value="0")
+        
+        # poll the IR sensors alone at the given rate besides the frames
+        self.cb_irRate = wx.CheckBox(lc_pnl, label="IR [Hz]")
+        self.tc_irRate = wx.TextCtrl(lc_pnl, value="50")
+        
+        # dark (camera covered) and flat (evenly lit) references from the last
+        # frames, then every frame corrected with them and filtered over time
+        self.b_dark = wx.Button(lc_pnl, label='Dark')
+        self.b_dark.Bind(wx.EVT_BUTTON, lambda event: self.captureReference(True))
+        self.b_dark.SetToolTip(wx.ToolTip("Capture the offsets with the camera covered"))
+        self.b_flat = wx.Button(lc_pnl, label='Flat')
+        self.b_flat.Bind(wx.EVT_BUTTON, lambda event: self.captureReference(False))
+        self.b_flat.SetToolTip(wx.ToolTip("Capture the gains with the camera evenly lit"))
+        self.cb_calibrate = wx.CheckBox(lc_pnl, label="Calibrate")
+        self.cb_calibrate.Bind(wx.EVT_CHECKBOX, self.updateCalibration)
+        self.ch_filter = wx.Choice(lc_pnl, choices=FILTERS)
+        self.ch_filter.SetSelection(0)
+        self.ch_filter.Bind(wx.EVT_CHOICE, self.updateCalibration)
+        
+        # show the waterfall of the last frames instead of the last one
+        self.cb_waterfall = wx.CheckBox(lc_pnl, label="Waterfall")
+        self.cb_waterfall.Bind(wx.EVT_CHECKBOX, self.toggleWaterfall)
+        
+        # graph values
+        self.st_peak = wx.StaticText(lc_pnl)
+        self.st_peak.SetForegroundColour((0,0,255))
+        self.st_max = wx.StaticText(lc_pnl)
+        self.st_max.SetForegroundColour((255,0,0))
+        self.st_min = wx.StaticText(lc_pnl)
+        self.st_min.SetForegroundColour((255,0,0))
+        self.st_delta = wx.StaticText(lc_pnl)
+        self.st_delta.SetForegroundColour((255,127,0))
+        self.st_avg = wx.StaticText(lc_pnl)
+        self.st_avg.SetForegroundColour((0,127,0))
+        self.st_dropped = wx.StaticText(lc_pnl)
+        self.st_lost = wx.StaticText(lc_pnl)
+        self.st_commands = wx.StaticText(lc_pnl)
+        
+        # 2 columns and as many rows as needed, horizontal spacing = 5
+        lc_gs = wx.GridSizer(0, 2, 0, 5)
+        lc_bs_ctrl.Add(lc_gs, flag=wx.EXPAND)
+        
+        # arguments: item, proportion, fill available space flag
+        lc_gs.AddMany([
+            (self.tc_intTime, 1, wx.EXPAND),
+            (self.b_setIntTime, 1, wx.EXPAND),
+            (self.cb_stream, 1, wx.EXPAND),
+            (self.tc_frameRate, 1, wx.EXPAND),
+            (self.cb_irRate, 1, wx.EXPAND),
+            (self.tc_irRate, 1, wx.EXPAND),
+            (self.b_dark, 1, wx.EXPAND),
+            (self.b_flat, 1, wx.EXPAND),
+            (self.cb_calibrate, 1, wx.EXPAND),
+            (self.ch_filter, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Peak"), 1, wx.EXPAND),
+            (self.st_peak, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Maximum"), 1, wx.EXPAND),
+            (self.st_max, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Minimum"), 1, wx.EXPAND),
+            (self.st_min, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Delta"), 1, wx.EXPAND),
+            (self.st_delta, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Average"), 1, wx.EXPAND),
+            (self.st_avg, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Dropped"), 1, wx.EXPAND),
+            (self.st_dropped, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Lost"), 1, wx.EXPAND),
+            (self.st_lost, 1, wx.EXPAND),
+            (wx.StaticText(lc_pnl, label="Commands"), 1, wx.EXPAND),
+            (self.st_commands, 1, wx.EXPAND),
+            (self.cb_waterfall, 1, wx.EXPAND)
+        ])
+        
+        # add the vertical box to the panel
+        vbox.Add(lc_pnl, proportion=1, flag=wx.ALL|wx.EXPAND, border=5)
+        
+        # sensor values panel
+        sv_pnl = wx.Panel(self)
+        vbox.Add(sv_pnl, flag=wx.ALL|wx.EXPAND, border=5)
+        sv_sb = wx.StaticBox(sv_pnl, label='IR Sensor Values')
+        sv_sbs = wx.StaticBoxSizer(sv_sb, orient=wx.HORIZONTAL)
+        sv_pnl.SetSizer(sv_sbs)
+        
+        # text fields for IR sensor values
+        self.ir_0 = wx.TextCtrl(sv_pnl, style=wx.TE_READONLY)
+        self.ir_1 = wx.TextCtrl(sv_pnl, style=wx.TE_READONLY)
+        self.ir_2 = wx.TextCtrl(sv_pnl, style=wx.TE_READONLY)
+        self.ir_3 = wx.TextCtrl(sv_pnl, style=wx.TE_READONLY)
+        self.ir_4 = wx.TextCtrl(sv_pnl, style=wx.TE_READONLY)
+        self.irSensors = [self.ir_0, self.ir_1, self.ir_2, self.ir_3, self.ir_4]
+        
+        # show on user interface
+        sv_sbs.Add(self.ir_0, 1, flag=wx.RIGHT, border=5)
+        sv_sbs.Add(self.ir_1, 1, flag=wx.RIGHT, border=5)
+        sv_sbs.Add(self.ir_2, 1, flag=wx.RIGHT, border=5)
+        sv_sbs.Add(self.ir_3, 1, flag=wx.RIGHT, border=5)
+        sv_sbs.Add(self.ir_4, 1)
+        
+        # align 2 panels horizontally
+        hbox = wx.BoxSizer(wx.HORIZONTAL)
+        vbox.Add(hbox, flag=wx.EXPAND)
+        
+        # connection interface panel
+        ci_pnl = wx.Panel(self)
+        hbox.Add(ci_pnl, proportion=1, flag=wx.ALL|wx.EXPAND, border=5)
+        ci_sb = wx.StaticBox(ci_pnl, label='Connect')
+        ci_sbs = wx.StaticBoxSizer(ci_sb, orient=wx.VERTICAL)
+        ci_pnl.SetSizer(ci_sbs)
+        
+        # the available USB connected devices, listed as they are found
+        self.deviceList = wx.ListBox(ci_pnl, choices=self.discovery.devices, style=wx.CB_READONLY)
+        self.discovery.start()
+        ci_sbs.Add(self.deviceList, 1, wx.EXPAND)
+        
+        # highest baud rate negotiated with the device and the one in use
+        br_bs = wx.BoxSizer(wx.HORIZONTAL)
+        ci_sbs.Add(br_bs, 0, wx.EXPAND)
+        br_bs.Add(wx.StaticText(ci_pnl, label="Baud rate"), 0, wx.TOP|wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, 5)
+        self.ch_baudrate = wx.Choice(ci_pnl, choices=['Auto'] + [str(rate) for rate in protocol.BAUDRATES])
+        self.ch_baudrate.SetSelection(0)
+        br_bs.Add(self.ch_baudrate, 0, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        # frames sent as differences to the previous one, for slow links
+        self.cb_compress = wx.CheckBox(ci_pnl, label="Compress")
+        br_bs.Add(self.cb_compress, 0, wx.TOP|wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, 5)
+        # frames published to other processes in shared memory
+        self.cb_share = wx.CheckBox(ci_pnl, label="Share")
+        br_bs.Add(self.cb_share, 0, wx.TOP|wx.RIGHT|wx.ALIGN_CENTER_VERTICAL, 5)
+        self.st_baudrate = wx.StaticText(ci_pnl)
+        br_bs.Add(self.st_baudrate, 1, wx.TOP|wx.ALIGN_CENTER_VERTICAL, 5)
+        
+        # connection interface buttons
+        cib_bs = wx.BoxSizer(wx.HORIZONTAL)
+        ci_sbs.Add(cib_bs, 0, wx.EXPAND)
+        
+        # toggle connection to serial device
+        self.b_toggleConnect = wx.Button(ci_pnl, label='Connect')
+        self.b_toggleConnect.Bind(wx.EVT_BUTTON, self.toggleConnect)
+        cib_bs.Add(self.b_toggleConnect, 1, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        
+        # refresh serial devices button
+        self.b_refresh = wx.Button(ci_pnl, label='Refresh list')
+        self.b_refresh.Bind(wx.EVT_BUTTON, self.scanDevices)
+        cib_bs.Add(self.b_refresh, 1, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        
+        # record frames and commands to a session file
+        self.b_record = wx.Button(ci_pnl, label='Record')
+        self.b_record.Bind(wx.EVT_BUTTON, self.toggleRecord)
+        cib_bs.Add(self.b_record, 1, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        
+        # per stage latencies of the current or last connection
+        self.b_latencies = wx.Button(ci_pnl, label='Latencies...')
+        self.b_latencies.Bind(wx.EVT_BUTTON, self.exportLatencies)
+        self.b_latencies.Disable()
+        cib_bs.Add(self.b_latencies, 1, wx.TOP|wx.EXPAND, 5)
+        
+        # replay a recorded session instead of connecting to a device
+        rp_bs = wx.BoxSizer(wx.HORIZONTAL)
+        ci_sbs.Add(rp_bs, 0, wx.EXPAND)
+        self.ch_replaySpeed = wx.Choice(ci_pnl, choices=[str(speed) + 'x' if speed else 'Max' for speed in REPLAY_SPEEDS])
+        self.ch_replaySpeed.SetSelection(0)
+        rp_bs.Add(self.ch_replaySpeed, 0, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        self.b_replay = wx.Button(ci_pnl, label='Replay...')
+        self.b_replay.Bind(wx.EVT_BUTTON, self.toggleReplay)
+        rp_bs.Add(self.b_replay, 0, wx.TOP|wx.RIGHT|wx.EXPAND, 5)
+        # replay position, drag to seek
+        self.sl_replay = wx.Slider(ci_pnl)
+        self.sl_replay.Bind(wx.EVT_SCROLL_CHANGED, self.seekReplay)
+        rp_bs.Add(self.sl_replay, 1, wx.TOP|wx.EXPAND, 5)
+        
+        # movement control elements panel
+        ce_pnl = wx.Panel(self)
+        hbox.Add(ce_pnl, proportion=1, flag=wx.ALL|wx.EXPAND, border=5)
+        ce_sb = wx.StaticBox(ce_pnl, label='Control')
+        ce_sbs = wx.StaticBoxSizer(ce_sb, orient=wx.VERTICAL)
+        ce_pnl.SetSizer(ce_sbs)
+        
+        # control button images
+        img_forwards = wx.Image("images/forwards.png", wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+        img_left = wx.Image("images/left.png", wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+        img_back = wx.Image("images/back.png", wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+        img_right = wx.Image("images/right.png", wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+        img_stop = wx.Image("images/stop.png", wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+        
+        # speed control box
+        sc_bs = wx.BoxSizer(wx.VERTICAL)
+        sc_bs.Add(wx.StaticText(ce_pnl, label="Speed [%]"))
+        self.tc_speed = wx.TextCtrl(ce_pnl, value=str(self.speed))
+        self.tc_speed.Bind(wx.EVT_TEXT, self.resetGo)
+        sc_bs.Add(self.tc_speed, 0, wx.EXPAND)
+        
+        # control buttons
+        self.b_forwards = wx.BitmapButton(ce_pnl, bitmap=img_forwards)
+        self.b_forwards.Bind(wx.EVT_BUTTON, lambda event: self.go('forwards'))
+        self.b_forwards.SetToolTip(wx.ToolTip("Forwards"))
+        self.b_left = wx.BitmapButton(ce_pnl, bitmap=img_left)
+        self.b_left.Bind(wx.EVT_BUTTON, lambda event: self.go('left'))
+        self.b_left.SetToolTip(wx.ToolTip("Left"))
+        self.b_back = wx.BitmapButton(ce_pnl, bitmap=img_back)
+        self.b_back.Bind(wx.EVT_BUTTON, lambda event: self.go('back'))
+        self.b_back.SetToolTip(wx.ToolTip("Back"))
+        self.b_right = wx.BitmapButton(ce_pnl, bitmap=img_right)
+        self.b_right.Bind(wx.EVT_BUTTON, lambda event: self.go('right'))
+        self.b_right.SetToolTip(wx.ToolTip("Right"))
+        self.b_stop = wx.BitmapButton(ce_pnl, bitmap=img_stop)
+        self.b_stop.Bind(wx.EVT_BUTTON, lambda event: self.go('stop'))
+        self.b_stop.SetToolTip(wx.ToolTip("Stop"))
+        self.cb_track = wx.CheckBox(ce_pnl, label="Track")
+        self.cb_track.Bind(wx.EVT_CHECKBOX, self.toggleTrack)
+        self.cb_track.SetToolTip(wx.ToolTip("Drive towards the light at this speed"))
+        
+        # add a grid with 2 rows and 3 colums with a vertical and horizontal spacing of 5
+        ce_gs = wx.GridSizer(3, 3, 5, 5)
+        ce_gs.AddMany([
+            (0,0),
+            (self.b_forwards, 1, wx.EXPAND),
+            (sc_bs, 1, wx.EXPAND),
+            (self.b_left, 1, wx.EXPAND),
+            (self.b_stop, 1, wx.EXPAND),
+            (self.b_right, 1, wx.EXPAND),
+            (0,0),
+            (self.b_back, 1, wx.EXPAND),
+            (self.cb_track, 0, wx.ALIGN_CENTER)
+        ])
+        ce_sbs.Add(ce_gs, flag=wx.EXPAND)
+        self.uiReset(0)
+
+def main():
+    app = wx.App()
+    Control(None, title='')
+    app.MainLoop()
@@ -0,0 +1,45 @@
+# camera pixels of the last frames in a ring allocated once, for waterfall
+# views: appending a frame is a row write, whatever the frame rate
+#
+#   history = FrameHistory(2048)
+#   acquisition.onFrame = history.append    every frame, from its thread
+#   history.last(100)                       (100, 102) view, oldest first
+import numpy
+
+from prisme import protocol, stats
+
+class FrameHistory(object):
+    def __init__(self, rows=2048, pixels=protocol.CAMERA_PIXELS):
+        self.rows = rows
+        self.pixels = pixels
+        # every row is written twice, rows apart, so the last frames are
+        # always one contiguous slice however far the ring went round
+        self._buffer = numpy.zeros((2 * rows, pixels), dtype=numpy.uint8)
+        # frames appended so far, the last one is in row (count - 1) % rows
+        self.count = 0
+
+    def __len__(self):
+        # frames kept
+        return min(self.count, self.rows)
+
+    def append(self, frame):
+        # a single producer, readers may see the row being written half
+        # updated, which only shows as one odd row, IR responses have no new
+        # row
+        if frame.irOnly:
+            return
+        camera = stats.cameraArray(frame)
+        row = self.count % self.rows
+        self._buffer[row] = camera
+        self._buffer[row + self.rows] = camera
+        self.count += 1
+
+    def last(self, count=None):
+        # view of the last count frames (all those kept by default), oldest
+        # first, it isn't a copy: later frames overwrite it
+        count = len(self) if count is None else min(count, len(self))
+        end = (self.count - 1) % self.rows + self.rows + 1
+        return self._buffer[end - count:end]
+
+    def clear(self):
+        self.count = 0
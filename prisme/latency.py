@@ -0,0 +1,145 @@
+# always-on latency instrumentation: every frame carries the time it went
+# through each stage of the pipeline and the time between stages goes into
+# fixed size histograms, cheap enough to leave on while acquiring
+#
+#   latencies = Latencies()
+#   latencies.record('command to written', 0.0042)
+#   latencies.report(sys.stderr)
+#   latencies.export(open('latencies.csv', 'w'))
+import math, collections
+
+# frame stages in pipeline order, indices into Frame.stages which holds their
+# clock() times, 0 when a stage didn't happen (no request when streaming)
+STAGE_REQUESTED = 0
+STAGE_FIRST_BYTE = 1
+STAGE_COMPLETE = 2
+STAGE_DECODED = 3
+STAGE_POSTED = 4
+# drawn by the user interface, or handled by a headless consumer
+STAGE_DRAWN = 5
+STAGES = ['request', 'first byte', 'complete', 'decoded', 'posted', 'drawn']
+
+COMMAND_WRITTEN = 'command to written'
+
+class Histogram(object):
+    # log-linear buckets like HdrHistogram: values are counted in microseconds,
+    # exactly below 2 ** (significantBits + 1) then with a relative precision of
+    # 2 ** -significantBits (3% by default) up to 2 ** maxBits (71 minutes),
+    # larger values fall in the last bucket; recording is O(1) and allocates
+    # nothing, a single thread must record in a given histogram
+    def __init__(self, significantBits=5, maxBits=32):
+        self.significantBits = significantBits
+        self.subBuckets = 1 << significantBits
+        self.counts = [0] * ((maxBits - significantBits + 1) * self.subBuckets)
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = 0
+
+    def index(self, value):
+        shift = max(0, value.bit_length() - self.significantBits - 1)
+        return min(len(self.counts) - 1, shift * self.subBuckets + (value >> shift))
+
+    def highestEquivalent(self, index):
+        # largest value counted in the bucket
+        shift = max(0, index // self.subBuckets - 1)
+        return ((index - shift * self.subBuckets + 1) << shift) - 1
+
+    def record(self, seconds):
+        # to the nearest microsecond, 3e-6 s is 2.99... microseconds as a float
+        value = max(0, int(round(seconds * 1e6)))
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, p):
+        # in seconds, the highest value equivalent to the one at percentile p
+        if not self.count:
+            return float('nan')
+        target = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highestEquivalent(index), self.maximum) * 1e-6
+        return self.maximum * 1e-6
+
+    @property
+    def mean(self):
+        return self.total * 1e-6 / self.count if self.count else float('nan')
+
+    def distribution(self):
+        # (value in seconds, percentile, count so far) for every bucket used
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                yield self.highestEquivalent(index) * 1e-6, 100.0 * seen / self.count, seen
+
+    def add(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        self.maximum = max(self.maximum, other.maximum)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = self.total = self.maximum = 0
+        self.minimum = None
+
+class Latencies(object):
+    # named histograms, in the order they were first recorded in
+    def __init__(self):
+        self.histograms = collections.OrderedDict()
+
+    def __getitem__(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def record(self, name, seconds):
+        self[name].record(seconds)
+
+    def recordFrame(self, frame, first=STAGE_REQUESTED, last=STAGE_POSTED):
+        # time between the consecutive stages from first to last the frame went
+        # through, once it is drawn from its request (or first byte) as well
+        stages = frame.stages
+        previous = first
+        for stage in range(first + 1, last + 1):
+            if not stages[stage]:
+                continue
+            if stages[previous]:
+                self.record('%s to %s' % (STAGES[previous], STAGES[stage]), stages[stage] - stages[previous])
+            previous = stage
+        if last == STAGE_DRAWN and stages[STAGE_DRAWN]:
+            origin = STAGE_REQUESTED if stages[STAGE_REQUESTED] else STAGE_FIRST_BYTE
+            if stages[origin]:
+                self.record('%s to drawn, overall' % STAGES[origin], stages[STAGE_DRAWN] - stages[origin])
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def report(self, out):
+        # one line per histogram, times in milliseconds
+        out.write('%-28s %8s %8s %8s %8s %8s %8s\n' % ('latency [ms]', 'count', 'p50', 'p90', 'p99', 'p99.9', 'max'))
+        for name, histogram in list(self.histograms.items()):
+            if not histogram.count:
+                continue
+            out.write('%-28s %8d %8.2f %8.2f %8.2f %8.2f %8.2f\n' % ((name, histogram.count) + tuple(histogram.percentile(p) * 1e3
+                for p in (50, 90, 99, 99.9)) + (histogram.maximum * 1e-3,)))
+
+    def export(self, out):
+        # CSV of every distribution, one row per bucket used
+        out.write('histogram,latency_ms,percentile,count\n')
+        for name, histogram in list(self.histograms.items()):
+            for value, percentile, count in histogram.distribution():
+                out.write('%s,%.3f,%.4f,%d\n' % (name, value * 1e3, percentile, count))
@@ -0,0 +1,188 @@
+# linear camera views drawn straight on a window, fast enough for a fast
+# stream: the plot of the last frame keeps its axes, grid and labels in a
+# bitmap and draws the trace from arrays allocated once (wx.lib.plot rebuilt
+# and rescaled everything for each frame), the waterfall of the last frames
+# only converts the rows that came since its last repaint
+import wx, numpy
+
+from prisme import protocol
+
+# room around the plot area for the labels, in pixels
+MARGIN_LEFT = 45
+MARGIN_RIGHT = 10
+MARGIN_TOP = 10
+MARGIN_BOTTOM = 25
+
+# grid spacing in pixels and intensity
+GRID_X = 10
+GRID_Y = 50
+
+class CameraPlot(wx.Window):
+    def __init__(self, parent, pixels=protocol.CAMERA_PIXELS, maximum=255):
+        wx.Window.__init__(self, parent)
+        # everything is painted in onPaint, erasing the background would flicker
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+        self.SetMinSize((200, 150))
+        self.pixels = pixels
+        self.maximum = maximum
+        # pixels shown, and the positions of the peak and average markers,
+        # None hides them
+        self.values = numpy.zeros(pixels, dtype=numpy.uint8)
+        self.peak = None
+        self.average = None
+        # trace in window coordinates, x only changes with the size
+        self._points = numpy.zeros((pixels, 2), dtype=numpy.int32)
+        self._scaled = numpy.zeros(pixels)
+        self._left = self._top = self._right = self._bottom = 0
+        self._xScale = self._yScale = 0.0
+        # axes drawn for the current size, and the bitmap repaints are drawn
+        # in before they go to the screen
+        self._background = None
+        self._buffer = None
+        self._tracePen = wx.Pen(wx.Colour(255, 0, 0), 1)
+        self._peakPen = wx.Pen(wx.Colour(0, 0, 255), 1)
+        self._averagePen = wx.Pen(wx.Colour(0, 127, 0), 1)
+        self._gridPen = wx.Pen(wx.Colour(220, 220, 220), 1)
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.Bind(wx.EVT_SIZE, self.onSize)
+
+    def setData(self, values, peak=None, average=None):
+        # values are copied, the frame they come from can be reused, the
+        # window is repainted at most once per event loop pass however often
+        # this is called
+        self.values[:] = values
+        self.peak = peak
+        self.average = average
+        self.Refresh(False)
+
+    def clear(self):
+        self.setData(0)
+
+    def onSize(self, event):
+        width, height = self.GetClientSize()
+        if width <= MARGIN_LEFT + MARGIN_RIGHT or height <= MARGIN_TOP + MARGIN_BOTTOM:
+            self._background = None
+            return
+        self._left = MARGIN_LEFT
+        self._top = MARGIN_TOP
+        self._right = width - MARGIN_RIGHT
+        self._bottom = height - MARGIN_BOTTOM
+        self._xScale = float(self._right - self._left) / self.pixels
+        self._yScale = float(self._bottom - self._top) / self.maximum
+        self._points[:, 0] = self._left + numpy.arange(self.pixels) * self._xScale
+        self._buffer = wx.Bitmap(width, height)
+        self._background = wx.Bitmap(width, height)
+        self.drawAxes(wx.MemoryDC(self._background))
+        self.Refresh(False)
+
+    def drawAxes(self, dc):
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+        dc.SetFont(self.GetFont())
+        dc.SetTextForeground(wx.BLACK)
+        for pixel in range(0, self.pixels + 1, GRID_X):
+            x = int(self._left + pixel * self._xScale)
+            dc.SetPen(self._gridPen)
+            dc.DrawLine(x, self._top, x, self._bottom)
+            label = str(pixel)
+            width, height = dc.GetTextExtent(label)
+            dc.DrawText(label, x - width // 2, self._bottom + 4)
+        for intensity in range(0, self.maximum + 1, GRID_Y):
+            y = int(self._bottom - intensity * self._yScale)
+            dc.SetPen(self._gridPen)
+            dc.DrawLine(self._left, y, self._right, y)
+            label = str(intensity)
+            width, height = dc.GetTextExtent(label)
+            dc.DrawText(label, self._left - width - 4, y - height // 2)
+        width, height = dc.GetTextExtent('Intensity')
+        dc.DrawRotatedText('Intensity', 0, (self._top + self._bottom + width) // 2, 90)
+        dc.SetPen(wx.BLACK_PEN)
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.DrawRectangle(self._left, self._top, self._right - self._left + 1, self._bottom - self._top + 1)
+        dc.SelectObject(wx.NullBitmap)
+
+    def onPaint(self, event):
+        if self._background is None:
+            # too small to show anything
+            wx.PaintDC(self)
+            return
+        dc = wx.BufferedPaintDC(self, self._buffer)
+        dc.DrawBitmap(self._background, 0, 0)
+        # only the trace and markers change from one frame to the next
+        numpy.multiply(self.values, self._yScale, out=self._scaled)
+        numpy.subtract(self._bottom, self._scaled, out=self._scaled)
+        self._points[:, 1] = self._scaled
+        dc.SetPen(self._tracePen)
+        dc.DrawLines(self._points)
+        if self.peak is not None:
+            x = int(self._left + self.peak * self._xScale)
+            dc.SetPen(self._peakPen)
+            dc.DrawLine(x, self._top, x, self._bottom)
+        if self.average:
+            y = int(self._bottom - self.average * self._yScale)
+            dc.SetPen(self._averagePen)
+            dc.DrawLine(self._left, y, self._right, y)
+
+def heatColours():
+    # black through red and yellow to white, small intensity changes stand out
+    # better than in grey levels
+    intensity = numpy.arange(256) * 3
+    return numpy.clip(numpy.column_stack((intensity, intensity - 255, intensity - 510)), 0, 255).astype(numpy.uint8)
+
+class Waterfall(wx.Window):
+    # the frames of a prisme.history.FrameHistory, one row each, the newest at
+    # the bottom, stretched to the window
+    def __init__(self, parent, history):
+        wx.Window.__init__(self, parent)
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+        self.SetMinSize((200, 150))
+        self.history = history
+        self._colours = heatColours()
+        rows, pixels = history.rows, history.pixels
+        # the rows in colour, written twice like the history so that they are
+        # a contiguous image, only the frames appended since the last repaint
+        # are converted
+        self._image = numpy.zeros((2 * rows, pixels, 3), dtype=numpy.uint8)
+        self._bitmap = wx.Bitmap(pixels, rows, 24)
+        self._buffer = None
+        # history.count at the last repaint
+        self._shown = 0
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.Bind(wx.EVT_SIZE, self.onSize)
+
+    def update(self):
+        # repaint if frames came since the last time
+        if self.history.count != self._shown and self.IsShown():
+            self.Refresh(False)
+
+    def onSize(self, event):
+        width, height = self.GetClientSize()
+        self._buffer = wx.Bitmap(width, height) if width > 0 and height > 0 else None
+        self.Refresh(False)
+
+    def onPaint(self, event):
+        if self._buffer is None:
+            wx.PaintDC(self)
+            return
+        history = self.history
+        rows = history.rows
+        count = history.count
+        if count < self._shown:
+            # the history was cleared
+            self._image[:] = 0
+            self._shown = 0
+        new = min(count - self._shown, rows)
+        if new:
+            colours = self._colours[history.last(new)]
+            positions = numpy.arange(count - new, count) % rows
+            self._image[positions] = colours
+            self._image[positions + rows] = colours
+        self._shown = count
+        end = (count - 1) % rows + rows + 1
+        self._bitmap.CopyFromBuffer(self._image[end - rows:end])
+
+        dc = wx.BufferedPaintDC(self, self._buffer)
+        width, height = self.GetClientSize()
+        source = wx.MemoryDC(self._bitmap)
+        dc.StretchBlit(0, 0, width, height, source, 0, 0, history.pixels, rows)
+        source.SelectObject(wx.NullBitmap)
@@ -0,0 +1,165 @@
+# PRisme serial protocol definitions, these must match the firmware found in
+# PRismeControlCenter/PRismeControlCenter.ino
+import binascii
+
+# linear camera pixels followed by the IR sensor values in a data response
+CAMERA_PIXELS = 102
+IR_SENSORS = 5
+FRAME_SIZE = CAMERA_PIXELS + IR_SENSORS
+
+# framed data responses, enabled with CMD_FRAMING: a sync marker, a sequence
+# number, the payload length, the payload then a CRC-16/CCITT (polynomial
+# 0x1021, initial value 0xffff) of the sequence number, length and payload,
+# high byte first, so that a receiver can resynchronize after lost or extra
+# bytes and tell corrupted frames apart
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_HEADER_SIZE = len(FRAME_SYNC) + 2
+FRAME_CRC_SIZE = 2
+FRAMED_SIZE = FRAME_HEADER_SIZE + FRAME_SIZE + FRAME_CRC_SIZE
+# framed IR responses (see CMD_IR) carry IR_SENSORS bytes in the same frames,
+# with the same sequence numbers, they are never compressed
+FRAMED_IR_SIZE = FRAME_HEADER_SIZE + IR_SENSORS + FRAME_CRC_SIZE
+
+# compressed data responses, enabled with CMD_COMPRESSION on top of framing:
+# a keyframe (a framed response as above) every KEYFRAME_INTERVAL frames and in
+# between the differences to the previous frame sent, with DELTA_FLAG set in
+# the length byte; the encoded differences are a sequence of runs, each one a
+# byte with the kind of run in the high 2 bits and the run length minus one in
+# the low 6, followed by its data:
+#   DELTA_ZEROS     unchanged bytes, no data
+#   DELTA_NIBBLES   differences from -8 to 7, two per byte, high nibble first
+#   DELTA_LITERALS  new values, one per byte
+# a frame whose differences don't encode in less than FRAME_SIZE bytes is sent
+# as a keyframe
+DELTA_FLAG = 0x80
+DELTA_ZEROS = 0x00
+DELTA_NIBBLES = 0x40
+DELTA_LITERALS = 0x80
+DELTA_KIND_MASK = 0xc0
+DELTA_RUN_MAX = 64
+KEYFRAME_INTERVAL = 32
+
+# the firmware serial link is configured for this speed on startup and goes
+# back to it on reset
+DEFAULT_BAUDRATE = 9600
+
+# rates the firmware can switch to, the index is sent with CMD_BAUD: with the
+# UART in double speed mode they are within 2.1% on a 16 MHz clock and exact
+# from 250000 baud up
+BAUDRATES = [9600, 19200, 38400, 57600, 115200, 250000, 500000, 1000000]
+# answered instead of the index when the rate isn't supported
+BAUD_NAK = 0xff
+# the firmware goes back to the previous rate unless a data request arrives
+# at the new rate within this many seconds
+BAUD_CONFIRM_TIMEOUT = 0.5
+
+# single byte commands understood by the firmware
+CMD_DATA = b'd'
+CMD_INTTIME = b't'
+CMD_CONFIG = b'c'
+CMD_SPEED = b's'
+CMD_RESET = b'r'
+# start and stop streaming, the firmware then pushes a data response on its
+# own after every pause of the requested number of milliseconds
+CMD_STREAM = b'a'
+CMD_STREAM_STOP = b'x'
+# switch to another baud rate, the firmware acknowledges with the rate index
+# at the current rate then switches and waits for a data request at the new
+# rate to confirm it
+CMD_BAUD = b'b'
+# enable (1) or disable (0) framed data responses, reset disables them
+CMD_FRAMING = b'f'
+# compress framed data responses with a keyframe every given number of frames
+# (0 disables compression), the next frame is a keyframe
+CMD_COMPRESSION = b'z'
+# IR sensor values alone, without integrating nor reading the camera, framed
+# like data responses when framing is enabled, older firmware ignores it
+CMD_IR = b'i'
+
+# number of argument bytes following each command
+COMMAND_ARGUMENTS = {
+    CMD_DATA: 0,
+    CMD_INTTIME: 2,
+    CMD_CONFIG: 0,
+    CMD_SPEED: 2,
+    CMD_RESET: 0,
+    CMD_STREAM: 2,
+    CMD_STREAM_STOP: 0,
+    CMD_BAUD: 1,
+    CMD_FRAMING: 1,
+    CMD_COMPRESSION: 1,
+    CMD_IR: 0,
+}
+
+# integration time limits in microseconds
+INTTIME_MIN = 0
+INTTIME_MAX = 65535
+
+# time the firmware spends reading the camera and IR sensors besides the
+# integration time: 107 ADC conversions at a 128 prescaler on a 16 MHz clock
+READOUT_TIME = FRAME_SIZE * 13 * 128 / 16e6
+IR_READOUT_TIME = IR_SENSORS * 13 * 128 / 16e6
+
+def frameTime(baudrate, intTime):
+    # seconds needed to acquire and transmit one frame, 10 bits per byte
+    return intTime * 1e-6 + READOUT_TIME + FRAME_SIZE * 10.0 / baudrate
+
+def irTime(baudrate, framed=False):
+    # seconds needed to read and transmit the IR sensor values alone
+    size = FRAMED_IR_SIZE if framed else IR_SENSORS
+    return IR_READOUT_TIME + size * 10.0 / baudrate
+
+def streamPause(frameRate, baudrate, intTime):
+    # pause between streamed frames to approach the requested frame rate, 0
+    # (as fast as possible) when the link can't keep up anyway
+    if not frameRate:
+        return 0
+    pause = 1.0 / frameRate - frameTime(baudrate, intTime)
+    return max(0, min(0xffff, int(round(pause * 1000))))
+
+def intTimeCommand(value):
+    # new integration time is sent one byte at a time, high byte first
+    return CMD_INTTIME + bytes(bytearray([value >> 8, value & 0xff]))
+
+def decodeWord(data):
+    # 16 bit arguments are sent high byte first
+    data = bytearray(data)
+    return (data[0] << 8) + data[1]
+
+def decodeIntTime(data):
+    return decodeWord(data)
+
+def streamCommand(pause):
+    # pause between frames in milliseconds, high byte first
+    return CMD_STREAM + bytes(bytearray([pause >> 8, pause & 0xff]))
+
+def speedCommand(left, right):
+    # speeds are signed bytes, sent in two's complement
+    return CMD_SPEED + bytes(bytearray([left & 0xff, right & 0xff]))
+
+def decodeSpeed(data):
+    data = bytearray(data)
+    return tuple(v - 256 if v > 127 else v for v in data[:2])
+
+def baudCommand(baudrate):
+    return CMD_BAUD + bytes(bytearray([BAUDRATES.index(baudrate)]))
+
+def negotiableBaudrates(maximum=None):
+    # rates worth trying above the default, fastest first
+    return [rate for rate in reversed(BAUDRATES) if rate > DEFAULT_BAUDRATE and (maximum is None or rate <= maximum)]
+
+def framingCommand(enabled):
+    return CMD_FRAMING + (b'\x01' if enabled else b'\x00')
+
+def compressionCommand(keyframeInterval):
+    return CMD_COMPRESSION + bytes(bytearray([keyframeInterval]))
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xffff)
+
+def encodeFrame(sequence, payload, delta=False):
+    # framed data response, see FRAME_SYNC, delta for encoded differences to
+    # the previous frame (see DELTA_FLAG)
+    body = bytearray([sequence & 0xff, len(payload) | (DELTA_FLAG if delta else 0)]) + bytearray(payload)
+    crc = crc16(bytes(body))
+    return FRAME_SYNC + bytes(body) + bytes(bytearray([crc >> 8, crc & 0xff]))
@@ -0,0 +1,308 @@
+# append-only binary session files: every frame read and every command sent
+# is stored as a fixed size record so any record can be found by its number,
+# a sidecar index of (timestamp, record number) for frames allows finding
+# frames by number or time through a memory map without reading the session
+import os, mmap, time, struct, threading
+from timeit import default_timer as clock
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from prisme import protocol
+from prisme.frame import Frame
+
+MAGIC = b'PRSM'
+VERSION = 1
+# magic, version, record size, wall clock time of the start of the session
+HEADER = struct.Struct('<4sHHd')
+HEADER_SIZE = 64
+# kind, payload length, flags, sequence number, seconds since the start
+RECORD_HEADER = struct.Struct('<BBHId')
+PAYLOAD_SIZE = 112
+RECORD_SIZE = RECORD_HEADER.size + PAYLOAD_SIZE
+# seconds since the start, record number
+INDEX_ENTRY = struct.Struct('<dI')
+
+RECORD_FRAME = 0
+RECORD_COMMAND = 1
+# frame records of IR responses (see protocol.CMD_IR): only the IR values are
+# new, the camera pixels are those of the last data response
+FLAG_IR_ONLY = 0x01
+# offset of the flags in a record, their low byte is all there is so far
+FLAGS_OFFSET = 2
+
+def indexPath(path):
+    return path + '.idx'
+
+def packHeader(startTime):
+    # startTime is the wall clock time of the start of the session
+    header = bytearray(HEADER_SIZE)
+    HEADER.pack_into(header, 0, MAGIC, VERSION, RECORD_SIZE, startTime)
+    return header
+
+def frameFlags(frame):
+    return FLAG_IR_ONLY if frame.irOnly else 0
+
+def packRecord(kind, sequence, seconds, payload, flags=0):
+    # seconds since the start of the session
+    record = bytearray(RECORD_SIZE)
+    RECORD_HEADER.pack_into(record, 0, kind, len(payload), flags, sequence & 0xffffffff, seconds)
+    record[RECORD_HEADER.size:RECORD_HEADER.size + len(payload)] = payload
+    return record
+
+class SessionRecorder(object):
+    # records are packed by the caller and handed to a writer thread which
+    # writes them in batches, a full queue drops records instead of blocking
+    def __init__(self, path, queueSize=4096, batchSize=256):
+        self.path = path
+        self.batchSize = batchSize
+        self.dropped = 0
+        self.records = 0
+        self.frames = 0
+        # frames which are IR responses, among the others
+        self.irFrames = 0
+        self._clockStart = clock()
+        self._sequence = 0
+        self._queue = queue.Queue(queueSize)
+        # set by close(), the threads holding on to the recorder may still
+        # hand over records which are then ignored
+        self._closed = False
+
+        self._data = open(path, 'wb')
+        self._index = open(indexPath(path), 'wb')
+        self._data.write(packHeader(time.time()))
+        # readers of the session in progress may open it before any record
+        self._data.flush()
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def recordFrame(self, frame):
+        # the frame data is copied, pool frames can be reused right away
+        self._put(RECORD_FRAME, frame.sequence, frame.timestamp or clock(), frame.data, frameFlags(frame))
+
+    def recordCommand(self, command, timestamp=None):
+        self._put(RECORD_COMMAND, self._sequence, timestamp or clock(), command)
+        self._sequence += 1
+
+    def _put(self, kind, sequence, timestamp, payload, flags=0):
+        if self._closed:
+            return
+        record = packRecord(kind, sequence, timestamp - self._clockStart, payload, flags)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None is queued by close(), records queued after it while close()
+            # was being called are ignored
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                running = False
+            data = bytearray()
+            index = bytearray()
+            for record in batch:
+                if record[0] == RECORD_FRAME:
+                    timestamp = RECORD_HEADER.unpack_from(record)[4]
+                    index += INDEX_ENTRY.pack(timestamp, self.records)
+                    self.frames += 1
+                    if record[FLAGS_OFFSET] & FLAG_IR_ONLY:
+                        self.irFrames += 1
+                data += record
+                self.records += 1
+            self._data.write(data)
+            self._index.write(index)
+            # make the records visible to readers of a session in progress
+            self._data.flush()
+            self._index.flush()
+
+    def close(self):
+        if self._thread is None:
+            return
+        # waits for the writer to catch up, unlike the record calls
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SessionReader(object):
+    def __init__(self, path):
+        self.path = path
+        self._data = open(path, 'rb')
+        self._index = open(indexPath(path), 'rb')
+        header = self._data.read(HEADER_SIZE)
+        magic, version, recordSize, self.startTime = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION or recordSize != RECORD_SIZE:
+            raise ValueError('%s is not a PRisme session file' % path)
+        self._dataMap = self._map(self._data)
+        self._indexMap = self._map(self._index)
+
+    def _map(self, f):
+        size = os.fstat(f.fileno()).st_size
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def refresh(self):
+        # remap to see records appended since the session was opened
+        self.close(files=False)
+        self._dataMap = self._map(self._data)
+        self._indexMap = self._map(self._index)
+
+    def close(self, files=True):
+        for m in (self._dataMap, self._indexMap):
+            if m is not None:
+                try:
+                    m.close()
+                except BufferError:
+                    # arrays from frameArray() still use it, the map goes
+                    # away with them
+                    pass
+        self._dataMap = self._indexMap = None
+        if files:
+            self._data.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def recordCount(self):
+        if self._dataMap is None:
+            return 0
+        return (len(self._dataMap) - HEADER_SIZE) // RECORD_SIZE
+
+    def __len__(self):
+        # number of frames, partially written index entries are ignored
+        if self._indexMap is None:
+            return 0
+        return min(len(self._indexMap) // INDEX_ENTRY.size, self.recordCount)
+
+    def record(self, number):
+        # (kind, sequence, seconds since the start, payload) of any record
+        if not 0 <= number < self.recordCount:
+            raise IndexError('record %d out of range' % number)
+        offset = HEADER_SIZE + number * RECORD_SIZE
+        kind, length, reserved, sequence, timestamp = RECORD_HEADER.unpack_from(self._dataMap, offset)
+        payload = offset + RECORD_HEADER.size
+        return kind, sequence, timestamp, self._dataMap[payload:payload + length]
+
+    def recordFlags(self, number):
+        if not 0 <= number < self.recordCount:
+            raise IndexError('record %d out of range' % number)
+        return RECORD_HEADER.unpack_from(self._dataMap, HEADER_SIZE + number * RECORD_SIZE)[2]
+
+    def frameRecord(self, n):
+        # record number of the n-th frame
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('frame %d out of range' % n)
+        return INDEX_ENTRY.unpack_from(self._indexMap, n * INDEX_ENTRY.size)[1]
+
+    def frameTime(self, n):
+        return INDEX_ENTRY.unpack_from(self._indexMap, n * INDEX_ENTRY.size)[0]
+
+    def isIrOnly(self, n):
+        # whether the n-th frame is an IR response
+        return bool(self.recordFlags(self.frameRecord(n)) & FLAG_IR_ONLY)
+
+    def frame(self, n):
+        number = self.frameRecord(n)
+        kind, sequence, timestamp, payload = self.record(number)
+        frame = Frame(payload)
+        frame.sequence = sequence
+        frame.timestamp = timestamp
+        frame.irOnly = bool(self.recordFlags(number) & FLAG_IR_ONLY)
+        return frame
+
+    def __getitem__(self, n):
+        return self.frame(n)
+
+    def findFrame(self, timestamp):
+        # number of the first frame at or after timestamp (seconds since the
+        # start), binary search in the memory mapped index
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.frameTime(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def framesBetween(self, start, end):
+        # frames with start <= timestamp < end
+        for n in range(self.findFrame(start), self.findFrame(end)):
+            yield self.frame(n)
+
+    def records(self, start=0, end=None):
+        # every record in order, with the commands interleaved with the frames
+        end = self.recordCount if end is None else end
+        for number in range(start, end):
+            yield self.record(number)
+
+    def commands(self):
+        for kind, sequence, timestamp, payload in self.records():
+            if kind == RECORD_COMMAND:
+                yield timestamp, payload
+
+    def _arrays(self):
+        # every record and the index as numpy arrays over the memory maps
+        import numpy
+        records = numpy.ndarray((self.recordCount, RECORD_SIZE), dtype=numpy.uint8,
+            buffer=self._dataMap, offset=HEADER_SIZE)
+        index = numpy.ndarray((len(self),), dtype=[('timestamp', '<f8'), ('record', '<u4')], buffer=self._indexMap)
+        return records, index
+
+    def frameTimes(self):
+        # seconds since the start of every frame, as a numpy array
+        import numpy
+        if not len(self):
+            return numpy.zeros(0)
+        return self._arrays()[1]['timestamp']
+
+    def irOnlyMask(self):
+        # whether every frame is an IR response, as a numpy array
+        import numpy
+        if not len(self):
+            return numpy.zeros(0, dtype=bool)
+        records, index = self._arrays()
+        return (records[index['record'], FLAGS_OFFSET] & FLAG_IR_ONLY) != 0
+
+    def frameArray(self, cameraOnly=False):
+        # every frame as one (frames, 107) numpy array without parsing, camera
+        # pixels are [:, :CAMERA_PIXELS], handy for batch statistics; with
+        # cameraOnly the IR responses, which repeat the camera of the frame
+        # before them, are left out
+        import numpy
+        if not len(self):
+            return numpy.zeros((0, protocol.FRAME_SIZE), dtype=numpy.uint8)
+        records, index = self._arrays()
+        # only copies when there are commands between the frames
+        frames = records[:, RECORD_HEADER.size:RECORD_HEADER.size + protocol.FRAME_SIZE]
+        if len(self) != self.recordCount:
+            frames = frames[index['record']]
+        if cameraOnly:
+            frames = frames[~self.irOnlyMask()]
+        return frames
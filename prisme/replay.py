@@ -0,0 +1,206 @@
+# replays a recorded session (see prisme.recorder) in place of the serial
+# port: it answers the firmware protocol with the recorded frames so the
+# application and any analysis run unchanged against old data, recorded IR
+# responses are replayed as IR responses
+import threading
+from timeit import default_timer as clock
+
+from prisme import protocol
+from prisme.recorder import SessionReader
+
+class ReplaySerial(object):
+    # speed is a multiple of the recorded pace, 0 replays as fast as possible
+    def __init__(self, path, speed=1.0, loop=False, timeout=1):
+        self.port = path
+        self.timeout = timeout
+        self.speed = speed
+        self.loop = loop
+        self.session = SessionReader(path)
+        if not len(self.session):
+            raise ValueError('%s contains no frames' % path)
+        self.intTime = self._initialIntTime()
+        self.is_open = True
+
+        self._condition = threading.Condition()
+        self._output = bytearray()
+        self._pending = b''
+        # data requests not answered yet, or streaming
+        self._requests = 0
+        self._streaming = False
+        # framed data responses and their sequence number
+        self._framing = False
+        self._sequence = 0
+        self._paused = False
+        self._pausedAt = 0
+        self._started = False
+        # next frame to send, the clock() time the first frame was due at
+        self._position = 0
+        self._origin = 0
+        self._deadline = None
+
+    def _initialIntTime(self):
+        # the firmware default unless an integration time was set in the session
+        for timestamp, command in self.session.commands():
+            if command[:1] == protocol.CMD_INTTIME:
+                return protocol.decodeIntTime(command[1:])
+        return 100
+
+    def __len__(self):
+        return len(self.session)
+
+    @property
+    def position(self):
+        return self._position
+
+    def seek(self, n):
+        # continue from frame n, frames are numbered from 0
+        with self._condition:
+            self._position = max(0, min(len(self.session) - 1, n))
+            self._origin = clock() - self._elapsed(self._position)
+            self._pausedAt = clock()
+            self._condition.notify_all()
+
+    def seekTime(self, timestamp):
+        # continue from the first frame at or after timestamp (seconds since the
+        # start of the session)
+        self.seek(self.session.findFrame(timestamp))
+
+    def pause(self):
+        with self._condition:
+            if not self._paused:
+                self._paused = True
+                self._pausedAt = clock()
+
+    def resume(self):
+        with self._condition:
+            if self._paused:
+                self._paused = False
+                # the time spent paused doesn't count
+                self._origin += clock() - self._pausedAt
+                self._condition.notify_all()
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def _elapsed(self, n):
+        # replay time from the first frame to frame n
+        if not self.speed:
+            return 0
+        return (self.session.frameTime(n) - self.session.frameTime(0)) / self.speed
+
+    # serial.Serial interface used by the application
+
+    @property
+    def in_waiting(self):
+        return len(self._output)
+
+    def write(self, data):
+        with self._condition:
+            self._pending += bytes(data)
+            self._process()
+            self._condition.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _process(self):
+        while self._pending:
+            command = self._pending[:1]
+            size = 1 + protocol.COMMAND_ARGUMENTS.get(command, 0)
+            if len(self._pending) < size:
+                break
+            args = self._pending[1:size]
+            self._pending = self._pending[size:]
+            if command in (protocol.CMD_DATA, protocol.CMD_STREAM) and not self._started:
+                # the recorded pace is followed from the first frame asked for
+                self._started = True
+                self.seek(self._position)
+            if command == protocol.CMD_DATA:
+                self._requests += 1
+            elif command == protocol.CMD_CONFIG:
+                self._output += bytearray([self.intTime >> 8, self.intTime & 0xff])
+            elif command == protocol.CMD_INTTIME:
+                self.intTime = protocol.decodeIntTime(args)
+            elif command == protocol.CMD_STREAM:
+                self._streaming = True
+            elif command == protocol.CMD_FRAMING:
+                self._framing = bool(bytearray(args)[0])
+                self._sequence = 0
+            elif command == protocol.CMD_COMPRESSION:
+                # nothing to save without a link, frames are keyframes
+                pass
+            elif command == protocol.CMD_STREAM_STOP:
+                self._streaming = False
+            elif command == protocol.CMD_RESET:
+                self._streaming = self._framing = False
+
+    def _nextFrame(self):
+        # append the next frame to the output once it is due, returns False if
+        # the read timed out first or the session is over
+        while True:
+            if not self.is_open:
+                return False
+            if self._position >= len(self.session):
+                if not self.loop:
+                    return False
+                self.seek(0)
+            if not self._framing and self.session.isIrOnly(self._position):
+                # unframed IR responses can't be told apart from data
+                # responses, only the camera frames are replayed
+                self._position += 1
+                continue
+            if self._paused:
+                # a paused replay never times out, reads wait for it to resume
+                self._condition.wait()
+                self._deadline = None if self.timeout is None else clock() + self.timeout
+                continue
+            due = None
+            if self._requests or self._streaming:
+                due = self._origin + self._elapsed(self._position)
+                if due <= clock():
+                    break
+            wait = None if due is None else due - clock()
+            if self._deadline is not None:
+                if self._deadline <= clock():
+                    return False
+                wait = self._deadline - clock() if wait is None else min(wait, self._deadline - clock())
+            self._condition.wait(wait)
+        frame = self.session.frame(self._position)
+        data = frame.data
+        if self._framing:
+            if frame.irOnly:
+                data = data[protocol.CAMERA_PIXELS:]
+            data = protocol.encodeFrame(self._sequence, data)
+            self._sequence = (self._sequence + 1) & 0xff
+        self._output += data
+        self._position += 1
+        if self._requests:
+            self._requests -= 1
+        return True
+
+    def read(self, size=1):
+        with self._condition:
+            self._deadline = None if self.timeout is None else clock() + self.timeout
+            while len(self._output) < size:
+                if not self._nextFrame():
+                    break
+            data = bytes(self._output[:size])
+            del self._output[:size]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._condition:
+            del self._output[:]
+
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+        self.session.close()
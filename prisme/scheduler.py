@@ -0,0 +1,154 @@
+# outgoing commands ordered by urgency instead of arrival: a stop goes before
+# anything else, only the newest speed and integration time still waiting are
+# sent, and everything else keeps its order
+#
+#   scheduler.put(protocol.speedCommand(20, 20))
+#   scheduler.put(protocol.speedCommand(0, 0))    replaces the one above
+#   scheduler.take()                              b's\x00\x00'
+import threading, collections
+from timeit import default_timer as clock
+
+from prisme import protocol
+
+STOP = protocol.speedCommand(0, 0)
+
+def isStop(command):
+    # zero speed, or a reset which also stops the wheels (and brings the link
+    # back to its defaults, it is only sent to end a session)
+    return command == STOP or command == protocol.CMD_RESET
+
+class CommandScheduler(object):
+    def __init__(self, history=1000):
+        self._condition = threading.Condition()
+        # (time queued, command) waiting in each class, in the order they go
+        # out: stops, the newest speed, other commands in order then the newest
+        # integration time
+        self._stops = collections.deque()
+        self._speed = None
+        self._commands = collections.deque()
+        self._intTime = None
+        # integration time last taken, an equal one isn't sent again
+        self._lastIntTime = None
+        self._closed = False
+
+        # statistics
+        self.queued = 0
+        self.sent = 0
+        # commands replaced by a newer one or dropped as duplicates
+        self.coalesced = 0
+        self.maxDepth = 0
+        # seconds the last commands spent queued, newest last
+        self.latencies = collections.deque(maxlen=history)
+
+    def __len__(self):
+        # commands waiting
+        return len(self._stops) + len(self._commands) + (self._speed is not None) + (self._intTime is not None)
+
+    def put(self, command, timestamp=None):
+        # can be called from any thread, timestamp is the clock() time the
+        # command was given at (a key press for example), now by default
+        command = bytes(command)
+        entry = (clock() if timestamp is None else timestamp, command)
+        with self._condition:
+            self.queued += 1
+            if isStop(command):
+                # the speeds waiting are stale now
+                if self._speed is not None:
+                    self._speed = None
+                    self.coalesced += 1
+                if self._stops and self._stops[-1][1] == command:
+                    self.coalesced += 1
+                else:
+                    self._stops.append(entry)
+            elif command[:1] == protocol.CMD_SPEED:
+                if self._speed is not None:
+                    self.coalesced += 1
+                self._speed = entry
+            elif command[:1] == protocol.CMD_INTTIME:
+                if self._intTime is not None:
+                    self.coalesced += 1
+                    self._intTime = None
+                if command == self._lastIntTime:
+                    self.coalesced += 1
+                else:
+                    self._intTime = entry
+            else:
+                self._commands.append(entry)
+            self.maxDepth = max(self.maxDepth, len(self))
+            self._condition.notify()
+
+    def take(self, timeout=None):
+        # most urgent command, waiting up to timeout seconds for one (for ever
+        # with None), None if none came or the scheduler was closed
+        entry = self.takeEntry(timeout)
+        return None if entry is None else entry[1]
+
+    def takeEntry(self, timeout=None):
+        # take() with the time the command was queued at, as a (time, command)
+        # pair
+        with self._condition:
+            if not len(self) and not self._closed and timeout != 0:
+                self._condition.wait(timeout)
+            if self._stops:
+                entry = self._stops.popleft()
+            elif self._speed is not None:
+                entry, self._speed = self._speed, None
+            elif self._commands:
+                entry = self._commands.popleft()
+            elif self._intTime is not None:
+                entry, self._intTime = self._intTime, None
+                self._lastIntTime = entry[1]
+            else:
+                return None
+            self.sent += 1
+            self.latencies.append(clock() - entry[0])
+            return entry
+
+    def close(self):
+        # wake up any thread waiting in take(), commands still queued can be taken
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def latency(self):
+        # median of the recent queueing latencies in seconds, 0 before any
+        with self._condition:
+            values = sorted(self.latencies)
+        return values[len(values) // 2] if values else 0.0
+
+class RequestScheduler(object):
+    # data requests and IR requests (see protocol.CMD_IR) when polling, each
+    # at a rate of its own: obstacles are then seen as often as needed without
+    # waiting for camera integrations nor whole frames on the link
+    #
+    #   requests = RequestScheduler(cameraRate=5, irRate=50)
+    #   requests.take(clock())        CMD_DATA, CMD_IR or None when none is due
+    #   requests.due                  clock() time the next one is due at
+    def __init__(self, cameraRate=None, irRate=None):
+        # requests per second, None for as many as the link allows, no IR
+        # requests at all when irRate is None: data responses carry IR values
+        # as well
+        self.cameraInterval = 1.0 / cameraRate if cameraRate else 0.0
+        self.irInterval = 1.0 / irRate if irRate else None
+        self._cameraDue = 0.0
+        self._irDue = 0.0 if irRate else float('inf')
+        self.requested = {protocol.CMD_DATA: 0, protocol.CMD_IR: 0}
+
+    @property
+    def due(self):
+        return min(self._cameraDue, self._irDue)
+
+    def take(self, now):
+        # the request due the longest, None before the next one is due, rates
+        # aren't caught up with after a delay
+        if self.due > now:
+            return None
+        if self._irDue < self._cameraDue:
+            command = protocol.CMD_IR
+            self._irDue = max(self._irDue + self.irInterval, now)
+        else:
+            command = protocol.CMD_DATA
+            self._cameraDue = max(self._cameraDue + self.cameraInterval, now)
+        self.requested[command] += 1
+        return command
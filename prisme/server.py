@@ -0,0 +1,318 @@
+# local frame server: any number of clients (loggers, vision scripts,
+# dashboards) subscribe to the frames of one acquisition over TCP or a Unix
+# socket and send it commands through its scheduler, the serial port stays
+# with the acquisition
+#
+# A client receives a session file header then one session file record per
+# frame (see prisme.recorder), each frame is packed once for all clients. A
+# client that doesn't keep up loses its oldest frames, never whole records
+# and without slowing the others. IR responses come as frame records with
+# FLAG_IR_ONLY set, their camera pixels are those of the frame before. Clients send commands as on the serial
+# link, only speeds and integration times, other commands manage the link.
+#
+#   server = FrameServer(acquisition, '127.0.0.1:5757')   or '/tmp/prisme.sock'
+#   acquisition.onFrame = server.publish
+#   server.start()
+#
+#   client = FrameClient('127.0.0.1:5757')
+#   frame = client.next()
+#   client.queueCommand(protocol.speedCommand(20, 20))
+import os, stat, time, errno, socket, threading, collections, selectors
+from timeit import default_timer as clock
+
+from prisme import protocol
+from prisme.frame import Frame
+from prisme.recorder import packHeader, packRecord, frameFlags, HEADER, HEADER_SIZE, MAGIC, VERSION, RECORD_HEADER, RECORD_SIZE, RECORD_FRAME, FLAG_IR_ONLY
+
+DEFAULT_ADDRESS = '127.0.0.1:5757'
+# frames waiting for a client before its oldest are dropped
+CLIENT_QUEUE = 32
+# commands clients may send
+CLIENT_COMMANDS = (protocol.CMD_SPEED, protocol.CMD_INTTIME)
+
+def parseAddress(address):
+    # (family, address) of host:port or a Unix socket path
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and not address.startswith('/'):
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+def socketIdentity(path):
+    # (device, inode) of the Unix socket at path, None when there is none
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return (status.st_dev, status.st_ino) if stat.S_ISSOCK(status.st_mode) else None
+
+def removeStaleSocket(path):
+    # a socket left over by a server that didn't end cleanly is removed, a
+    # file that isn't a socket or a socket a server still listens on isn't
+    if not os.path.lexists(path):
+        return
+    if socketIdentity(path) is None:
+        raise OSError(errno.EEXIST, '%s exists and is not a socket' % path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, 'a server already listens on %s' % path)
+
+def listen(address):
+    family, address = parseAddress(address)
+    if family == socket.AF_UNIX:
+        removeStaleSocket(address)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen(8)
+    server.setblocking(False)
+    return server
+
+class Client(object):
+    def __init__(self, connection, address, header):
+        self.connection = connection
+        self.address = address
+        # frame records waiting, the oldest go first when the client lags
+        self.records = collections.deque(maxlen=CLIENT_QUEUE)
+        # bytes of the record being sent, a record is never cut short
+        self.output = bytearray(header)
+        # command bytes received, until a command is complete
+        self.input = bytearray()
+        self.frames = 0
+        self.dropped = 0
+        self.commands = 0
+        # commands not allowed to clients
+        self.rejected = 0
+
+    def push(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+    def pending(self):
+        return bool(self.output or self.records)
+
+    def flush(self):
+        # send as much as the socket takes, returns whether all was sent
+        while len(self.output) < 4096 and self.records:
+            self.output += self.records.popleft()
+            self.frames += 1
+        try:
+            sent = self.connection.send(self.output)
+        except (BlockingIOError, InterruptedError):
+            return False
+        del self.output[:sent]
+        return not self.pending()
+
+    def commandsReceived(self, data):
+        # complete commands among the bytes received, raises ValueError on
+        # bytes that aren't a command
+        self.input += data
+        commands = []
+        while self.input:
+            command = bytes(self.input[:1])
+            if command not in protocol.COMMAND_ARGUMENTS:
+                raise ValueError('unknown command %r' % command)
+            size = 1 + protocol.COMMAND_ARGUMENTS[command]
+            if len(self.input) < size:
+                break
+            if command in CLIENT_COMMANDS:
+                commands.append(bytes(self.input[:size]))
+                self.commands += 1
+            else:
+                self.rejected += 1
+            del self.input[:size]
+        return commands
+
+class FrameServer(threading.Thread):
+    def __init__(self, source, address=DEFAULT_ADDRESS):
+        # source is an Acquisition or a Device, anything with queueCommand()
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.source = source
+        self.address = address
+        self.clients = []
+        self.selector = selectors.DefaultSelector()
+        self.published = 0
+        # clients served so far, and the frames the ones gone lost
+        self.served = 0
+        self.dropped = 0
+        self._listener = listen(address)
+        # only this very socket is removed at the end, another server may
+        # have replaced it in the meantime
+        family, path = parseAddress(address)
+        self._socketIdentity = socketIdentity(path) if family == socket.AF_UNIX else None
+        self.selector.register(self._listener, selectors.EVENT_READ, self._listener)
+        self._clockStart = clock()
+        self._header = packHeader(time.time())
+        self._stopping = False
+        # records published by the acquisition thread, not fanned out yet
+        self._published = collections.deque(maxlen=CLIENT_QUEUE)
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        os.set_blocking(self._wakeupRead, False)
+        os.set_blocking(self._wakeupWrite, False)
+        self.selector.register(self._wakeupRead, selectors.EVENT_READ, None)
+
+    def publish(self, frame):
+        # from the acquisition thread, the frame is packed (and so copied) once
+        # for every client
+        self._published.append(bytes(packRecord(RECORD_FRAME, frame.sequence,
+            (frame.timestamp or clock()) - self._clockStart, frame.data, frameFlags(frame))))
+        self.published += 1
+        self.wakeup()
+
+    def stop(self):
+        self._stopping = True
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self._wakeupWrite, b'\0')
+        except OSError:
+            # the pipe is full, the server will wake up anyway
+            pass
+
+    def drainWakeup(self):
+        try:
+            while os.read(self._wakeupRead, 4096):
+                pass
+        except OSError:
+            pass
+
+    def accept(self):
+        try:
+            connection, address = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        connection.setblocking(False)
+        client = Client(connection, address, self._header)
+        self.clients.append(client)
+        self.served += 1
+        self.watch(client)
+
+    def close(self, client):
+        self.clients.remove(client)
+        self.selector.unregister(client.connection)
+        client.connection.close()
+        self.dropped += client.dropped
+
+    def watch(self, client):
+        # readable always, writable only while records are pending
+        events = selectors.EVENT_READ
+        if client.pending():
+            events |= selectors.EVENT_WRITE
+        try:
+            if self.selector.get_key(client.connection).events != events:
+                self.selector.modify(client.connection, events, client)
+        except KeyError:
+            self.selector.register(client.connection, events, client)
+
+    def receive(self, client):
+        # returns False when the client went away or sent garbage
+        try:
+            data = client.connection.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return True
+        if not data:
+            return False
+        try:
+            commands = client.commandsReceived(data)
+        except ValueError:
+            return False
+        for command in commands:
+            self.source.queueCommand(command)
+        return True
+
+    def run(self):
+        try:
+            while not self._stopping:
+                for key, mask in self.selector.select():
+                    if key.data is None:
+                        self.drainWakeup()
+                    elif key.data is self._listener:
+                        self.accept()
+                    else:
+                        client = key.data
+                        if client not in self.clients:
+                            continue
+                        try:
+                            if mask & selectors.EVENT_READ and not self.receive(client):
+                                self.close(client)
+                                continue
+                            if mask & selectors.EVENT_WRITE:
+                                client.flush()
+                        except OSError:
+                            self.close(client)
+                            continue
+                        self.watch(client)
+                # fan the new frames out, a client gets all of them or its
+                # queue drops its oldest
+                while self._published:
+                    record = self._published.popleft()
+                    for client in self.clients:
+                        client.push(record)
+                for client in list(self.clients):
+                    if not client.pending():
+                        continue
+                    try:
+                        client.flush()
+                    except OSError:
+                        self.close(client)
+                        continue
+                    self.watch(client)
+        finally:
+            for client in list(self.clients):
+                self.close(client)
+            self.selector.close()
+            self._listener.close()
+            os.close(self._wakeupRead)
+            os.close(self._wakeupWrite)
+            family, address = parseAddress(self.address)
+            if self._socketIdentity is not None and socketIdentity(address) == self._socketIdentity:
+                os.unlink(address)
+
+class FrameClient(object):
+    # subscriber to a FrameServer, frames come as Frame objects with the
+    # sequence number, the seconds since the start of the server and irOnly
+    # set for IR responses
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, address = parseAddress(address)
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(address)
+        header = self._read(HEADER_SIZE)
+        magic, version, recordSize, self.startTime = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION or recordSize != RECORD_SIZE:
+            raise ValueError('%s is not a PRisme frame server' % (address,))
+
+    def _read(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError('the frame server went away')
+            data += chunk
+        return data
+
+    def next(self):
+        # next frame, waiting for it up to the timeout (socket.timeout is
+        # raised) or for ever
+        record = self._read(RECORD_SIZE)
+        kind, length, flags, sequence, timestamp = RECORD_HEADER.unpack_from(record)
+        frame = Frame(record[RECORD_HEADER.size:RECORD_HEADER.size + length])
+        frame.sequence = sequence
+        frame.timestamp = timestamp
+        frame.irOnly = bool(flags & FLAG_IR_ONLY)
+        return frame
+
+    def queueCommand(self, command):
+        self.connection.sendall(command)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,200 @@
+# newest frames in shared memory for other processes on the same host, an
+# analysis process then works on them without serializing anything and
+# without contending with the acquisition for the interpreter lock
+#
+# The block holds a ring of slots, each with a seqlock counter: the writer
+# makes it odd before changing the slot and even again after, a reader that
+# sees it odd or changed across its read got a torn frame and tries again.
+#
+#   writer = SharedFrameWriter('prisme')              acquisition process
+#   acquisition.onFrame = writer.publish
+#
+#   reader = SharedFrameReader('prisme')              any other process
+#   frame = reader.wait(1.0)                          newest frame or None
+#   frame.camera, frame.ir                            numpy views, no copy
+#   frame.irOnly                                      an IR response, the camera
+#                                                     is the frame before's
+#   reader.valid(frame)                               not overwritten since
+import time, struct
+
+import numpy
+
+from prisme import protocol
+
+MAGIC = b'PRSF'
+VERSION = 2
+# magic, version, slots, slot size, frame size
+HEADER = struct.Struct('<4sHHHH')
+# frames published so far, the newest is in slot (count - 1) % slots
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 16
+HEADER_SIZE = 64
+# seqlock counter, frame sequence number, clock() time the frame was read at,
+# flags
+SLOT_HEADER = struct.Struct('<QQdI')
+# the frame is an IR response (see protocol.CMD_IR)
+FLAG_IR_ONLY = 0x01
+# a slot per pair of cache lines
+SLOT_SIZE = 192
+DEFAULT_SLOTS = 16
+# seconds between checks for a new frame while waiting
+POLL_INTERVAL = 0.0005
+
+def _attach(name):
+    # existing block, not removed when this process ends: only the writer
+    # owns it (Python before 3.13 tracks every process attaching to it)
+    from multiprocessing import shared_memory, resource_tracker
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # unregistering afterwards would drop the writer's registration when both
+    # processes share a tracker (multiprocessing children), don't register
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def isFrameRing(name):
+    # whether the existing block name holds a frame ring, whoever wrote it
+    memory = _attach(name)
+    try:
+        return memory.size >= HEADER.size and HEADER.unpack_from(memory.buf)[0] == MAGIC
+    finally:
+        memory.close()
+
+class SharedFrameWriter(object):
+    def __init__(self, name='prisme', slots=DEFAULT_SLOTS, replace=False):
+        # a ring under the same name is refused unless replace is set, it may
+        # be another writer's still publishing; a block without a ring header
+        # is left over and replaced
+        from multiprocessing import shared_memory
+        self.name = name
+        self.slots = slots
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        try:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace and isFrameRing(name):
+                raise FileExistsError('frames are already published as %s, by another writer or one that '
+                    "didn't end cleanly" % name)
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.count = 0
+        self._buffer = self.memory.buf
+        HEADER.pack_into(self._buffer, 0, MAGIC, VERSION, slots, SLOT_SIZE, protocol.FRAME_SIZE)
+        COUNT.pack_into(self._buffer, COUNT_OFFSET, 0)
+
+    def publish(self, frame):
+        # from a single thread, the acquisition's onFrame for example
+        buffer = self._buffer
+        offset = HEADER_SIZE + (self.count % self.slots) * SLOT_SIZE
+        counter = 2 * self.count
+        flags = FLAG_IR_ONLY if frame.irOnly else 0
+        SLOT_HEADER.pack_into(buffer, offset, counter + 1, frame.sequence, frame.timestamp, flags)
+        start = offset + SLOT_HEADER.size
+        buffer[start:start + protocol.FRAME_SIZE] = frame.data
+        SLOT_HEADER.pack_into(buffer, offset, counter + 2, frame.sequence, frame.timestamp, flags)
+        self.count += 1
+        COUNT.pack_into(buffer, COUNT_OFFSET, self.count)
+
+    def close(self):
+        # readers still attached keep their mapping, new ones can't attach
+        if self.memory is None:
+            return
+        self._buffer = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+class SharedFrame(object):
+    # a frame in a slot: camera, ir and data are numpy views of the shared
+    # memory unless copied, the writer overwrites them after slots newer frames
+    __slots__ = ('count', 'sequence', 'timestamp', 'data', 'camera', 'ir', 'irOnly')
+
+    def __init__(self, count, sequence, timestamp, data, irOnly=False):
+        # count is the publication number, sequence the frame's own
+        self.count = count
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.irOnly = irOnly
+        self.data = data
+        self.camera = data[:protocol.CAMERA_PIXELS]
+        self.ir = data[protocol.CAMERA_PIXELS:]
+
+class SharedFrameReader(object):
+    def __init__(self, name='prisme'):
+        self.name = name
+        self.memory = _attach(name)
+        self._buffer = self.memory.buf
+        magic, version, self.slots, slotSize, frameSize = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION or slotSize != SLOT_SIZE or frameSize != protocol.FRAME_SIZE:
+            self.close()
+            raise ValueError('%s is not a PRisme frame ring' % name)
+        # numpy views of the data of every slot, made once
+        self._views = [numpy.ndarray((protocol.FRAME_SIZE,), dtype=numpy.uint8, buffer=self._buffer,
+            offset=HEADER_SIZE + slot * SLOT_SIZE + SLOT_HEADER.size) for slot in range(self.slots)]
+        # publication number of the last frame returned
+        self.last = 0
+        # reads found torn and done again
+        self.retries = 0
+
+    @property
+    def count(self):
+        # frames published so far
+        return COUNT.unpack_from(self._buffer, COUNT_OFFSET)[0]
+
+    def _counter(self, count):
+        return SLOT_HEADER.unpack_from(self._buffer, HEADER_SIZE + ((count - 1) % self.slots) * SLOT_SIZE)
+
+    def valid(self, frame):
+        # whether the frame's views still hold it, check after using them
+        return self._counter(frame.count)[0] == 2 * frame.count
+
+    def read(self, copy=False):
+        # newest frame, None before the first one, copied frames are
+        # consistent, views are until the writer comes round to their slot
+        while True:
+            count = self.count
+            if not count:
+                return None
+            counter, sequence, timestamp, flags = self._counter(count)
+            if counter == 2 * count:
+                data = self._views[(count - 1) % self.slots]
+                if copy:
+                    data = data.copy()
+                # nothing changed while the header and data were read
+                if self._counter(count)[0] == counter:
+                    self.last = count
+                    return SharedFrame(count, sequence, timestamp, data, bool(flags & FLAG_IR_ONLY))
+            # torn, or overwritten by a newer frame: read that one
+            self.retries += 1
+
+    def poll(self, copy=False):
+        # newest frame if one came since the last one returned, None otherwise
+        if self.count == self.last:
+            return None
+        return self.read(copy)
+
+    def wait(self, timeout=None, copy=False):
+        # poll() until a new frame comes or timeout seconds have passed, the
+        # frames in between are skipped
+        deadline = None if timeout is None else time.time() + timeout
+        while self.count == self.last:
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+        return self.read(copy)
+
+    def close(self):
+        self._views = []
+        self._buffer = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # frames returned still use it, the mapping goes away with them
+            pass
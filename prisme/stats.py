@@ -0,0 +1,132 @@
+# linear camera statistics computed with numpy, for a single frame or for a
+# whole batch of frames (one frame per row) in one vectorized pass
+import collections
+
+import numpy
+
+from prisme import protocol
+
+# every field is a scalar for a single frame and an array for a batch
+Stats = collections.namedtuple('Stats', 'peak subpixelPeak maximum minimum delta average')
+
+def cameraArray(data):
+    # camera pixels as an unsigned byte array, without copying when possible:
+    # accepts frames, their camera views, bytes or arrays of one or more frames
+    camera = getattr(data, 'camera', data)
+    if isinstance(camera, numpy.ndarray):
+        return camera
+    if isinstance(camera, (memoryview, bytes, bytearray)):
+        return numpy.frombuffer(camera, dtype=numpy.uint8)
+    return numpy.asarray(camera, dtype=numpy.uint8)
+
+def cameraStats(data, method='parabolic'):
+    camera = cameraArray(data)
+    pixels = camera.shape[-1]
+    # the peak is the middle of the leftmost and rightmost maximums so that a
+    # saturated plateau gives its center
+    left = numpy.argmax(camera, axis=-1)
+    right = pixels - 1 - numpy.argmax(camera[..., ::-1], axis=-1)
+    peak = (left + right) // 2
+    maximum = camera.max(axis=-1)
+    minimum = camera.min(axis=-1)
+    average = camera.sum(axis=-1, dtype=numpy.uint32) / float(pixels)
+    if method == 'centroid':
+        subpixelPeak = centroidPeak(camera, minimum, maximum)
+    else:
+        subpixelPeak = parabolicPeak(camera, peak)
+    return Stats(peak, subpixelPeak, maximum, minimum,
+        maximum.astype(numpy.int16) - minimum, average)
+
+def parabolicPeak(camera, peak):
+    # vertex of the parabola through the peak pixel and its two neighbours
+    pixels = camera.shape[-1]
+    center = numpy.clip(peak, 1, pixels - 2)
+    rows = numpy.arange(camera.shape[0])[:, None] if camera.ndim > 1 else None
+    if rows is None:
+        y0, y1, y2 = camera[center - 1:center + 2].astype(numpy.float64)
+    else:
+        y0, y1, y2 = camera[rows, center[:, None] + numpy.arange(-1, 2)].astype(numpy.float64).T
+    curvature = y0 - 2 * y1 + y2
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        offset = numpy.where(curvature < 0, 0.5 * (y0 - y2) / curvature, 0.0)
+    return center + numpy.clip(offset, -0.5, 0.5)
+
+def centroidPeak(camera, minimum, maximum):
+    # intensity weighted center of the pixels above half the peak height
+    threshold = (minimum.astype(numpy.float64) + maximum) / 2
+    weights = camera - numpy.expand_dims(threshold, -1)
+    weights[weights < 0] = 0
+    total = weights.sum(axis=-1)
+    position = (weights * numpy.arange(camera.shape[-1])).sum(axis=-1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(total > 0, position / total, (camera.shape[-1] - 1) / 2.0)
+
+class RunningStats(object):
+    # exponential moving average plus rolling minimum, maximum and mean over
+    # the last window values of a series (peak position, intensity...), every
+    # update is O(1) amortized
+    def __init__(self, window=100, alpha=0.1):
+        self.window = window
+        self.alpha = alpha
+        self.count = 0
+        self.ema = None
+        # (index, value) pairs with monotonic values, the front is the extremum
+        self._minimums = collections.deque()
+        self._maximums = collections.deque()
+        self._values = collections.deque()
+        self._sum = 0.0
+
+    def update(self, value):
+        value = float(value)
+        index = self.count
+        self.count += 1
+        self.ema = value if self.ema is None else self.ema + self.alpha * (value - self.ema)
+
+        self._values.append(value)
+        self._sum += value
+        if len(self._values) > self.window:
+            self._sum -= self._values.popleft()
+
+        while self._minimums and self._minimums[-1][1] >= value:
+            self._minimums.pop()
+        self._minimums.append((index, value))
+        while self._maximums and self._maximums[-1][1] <= value:
+            self._maximums.pop()
+        self._maximums.append((index, value))
+        # forget extremums that left the window
+        for extremums in (self._minimums, self._maximums):
+            if extremums[0][0] <= index - self.window:
+                extremums.popleft()
+        return self
+
+    @property
+    def minimum(self):
+        return self._minimums[0][1] if self._minimums else None
+
+    @property
+    def maximum(self):
+        return self._maximums[0][1] if self._maximums else None
+
+    @property
+    def mean(self):
+        return self._sum / len(self._values) if self._values else None
+
+class RunningCameraStats(object):
+    # running statistics of every field of the per-frame camera statistics
+    def __init__(self, window=100, alpha=0.1):
+        self.fields = collections.OrderedDict((field, RunningStats(window, alpha)) for field in Stats._fields)
+
+    def update(self, stats):
+        for field, running in self.fields.items():
+            running.update(getattr(stats, field))
+        return self
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+def batchStats(frames, method='parabolic'):
+    # statistics of many frames at once, frames can be a 2D array (a recorded
+    # session for example) or any sequence of frames
+    if not isinstance(frames, numpy.ndarray):
+        frames = numpy.array([cameraArray(frame) for frame in frames], dtype=numpy.uint8)
+    return cameraStats(frames.reshape(-1, protocol.CAMERA_PIXELS), method)
@@ -0,0 +1,123 @@
+# simulated world for the emulator: a robot driven by the wheel speeds it is
+# sent, a light it sees through the linear camera and round obstacles its IR
+# sensors see, to try controllers without hardware
+#
+#   world = World(light=(1.5, 0.5), obstacles=[(0.8, 0.2, 0.1)])
+#   emulator = PrismeEmulator(camera=world.camera, ir=world.ir)
+#
+# Lengths are in meters and angles in radians, counterclockwise, the robot
+# starts at the origin looking along x.
+import math, random
+from timeit import default_timer as clock
+
+from prisme import protocol
+
+# ground speed at 100%, distance between the wheels and robot radius
+MAX_SPEED = 0.3
+WHEEL_BASE = 0.1
+ROBOT_RADIUS = 0.06
+# camera field of view, its pixels go from left to right
+FIELD_OF_VIEW = math.radians(60)
+# direction of the IR sensors from the left to the right, and their range
+IR_ANGLES = [math.radians(angle) for angle in (60, 30, 0, -30, -60)]
+IR_RANGE = 0.3
+# distance at which the light counts as reached
+REACHED = 0.15
+
+def bearing(x, y, heading, targetX, targetY):
+    # angle of a target from the heading, in ]-pi, pi]
+    angle = math.atan2(targetY - y, targetX - x) - heading
+    return math.atan2(math.sin(angle), math.cos(angle))
+
+def rayDistance(x, y, angle, obstacle):
+    # distance along a ray to a round obstacle, None when it misses
+    ox, oy, radius = obstacle
+    dx, dy = math.cos(angle), math.sin(angle)
+    along = (ox - x) * dx + (oy - y) * dy
+    across = (ox - x) * dy - (oy - y) * dx
+    if along < 0 or abs(across) > radius:
+        return None
+    return max(0.0, along - math.sqrt(radius ** 2 - across ** 2))
+
+class World(object):
+    def __init__(self, light=(1.5, 0.0), obstacles=(), pose=(0.0, 0.0, 0.0), peak=220, floor=20, noise=3, seed=0):
+        self.light = light
+        # (x, y, radius) of every obstacle
+        self.obstacles = list(obstacles)
+        self.x, self.y, self.heading = pose
+        self.peak = peak
+        self.floor = floor
+        self.noise = noise
+        self._random = random.Random(seed)
+        self._clock = None
+        # distance driven, collisions (motion into an obstacle is blocked) and
+        # the time the light was first reached, None before
+        self.travelled = 0.0
+        self.collisions = 0
+        self.reachedAt = None
+        self._colliding = False
+
+    @property
+    def distance(self):
+        return math.hypot(self.light[0] - self.x, self.light[1] - self.y)
+
+    @property
+    def lightBearing(self):
+        return bearing(self.x, self.y, self.heading, self.light[0], self.light[1])
+
+    def step(self, leftSpeed, rightSpeed):
+        # move with the wheel speeds (%) over the time since the last step
+        now = clock()
+        elapsed = 0.0 if self._clock is None else now - self._clock
+        self._clock = now
+        left = leftSpeed / 100.0 * MAX_SPEED
+        right = rightSpeed / 100.0 * MAX_SPEED
+        heading = self.heading + (right - left) / WHEEL_BASE * elapsed
+        forward = (left + right) / 2 * elapsed
+        x = self.x + forward * math.cos(heading)
+        y = self.y + forward * math.sin(heading)
+        colliding = any(math.hypot(x - ox, y - oy) < radius + ROBOT_RADIUS for ox, oy, radius in self.obstacles)
+        if colliding:
+            # turning in place is still possible
+            if not self._colliding:
+                self.collisions += 1
+            x, y = self.x, self.y
+        self._colliding = colliding
+        self.travelled += math.hypot(x - self.x, y - self.y)
+        self.x, self.y, self.heading = x, y, math.atan2(math.sin(heading), math.cos(heading))
+        if self.reachedAt is None and self.distance < REACHED:
+            self.reachedAt = now
+
+    def camera(self, emulator):
+        # the robot moved since the last frame, then sees the light as a spot
+        # whose width grows as it gets closer
+        self.step(emulator.leftSpeed, emulator.rightSpeed)
+        gain = emulator.intTime / 100.0
+        angle = self.lightBearing
+        center = (protocol.CAMERA_PIXELS - 1) / 2.0
+        pixel = center - angle / (FIELD_OF_VIEW / 2) * center
+        width = min(20.0, 1.5 + 0.5 / max(self.distance, 0.05))
+        visible = abs(angle) < FIELD_OF_VIEW / 2 + math.radians(5)
+        data = bytearray(protocol.CAMERA_PIXELS)
+        for i in range(protocol.CAMERA_PIXELS):
+            value = self.floor
+            if visible:
+                value += (self.peak - self.floor) * math.exp(-((i - pixel) / width) ** 2 / 2)
+            if self.noise:
+                value += self._random.uniform(-self.noise, self.noise)
+            data[i] = max(0, min(255, int(value * gain)))
+        return bytes(data)
+
+    def ir(self, emulator):
+        # 255 touching an obstacle down to 0 at the end of the range, IR
+        # readings may be requested alone, more often than frames
+        self.step(emulator.leftSpeed, emulator.rightSpeed)
+        values = bytearray()
+        for angle in IR_ANGLES:
+            nearest = IR_RANGE
+            for obstacle in self.obstacles:
+                distance = rayDistance(self.x, self.y, self.heading + angle, obstacle)
+                if distance is not None:
+                    nearest = min(nearest, max(0.0, distance - ROBOT_RADIUS))
+            values.append(int(255 * (1 - nearest / IR_RANGE)))
+        return bytes(values)
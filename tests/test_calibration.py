@@ -0,0 +1,126 @@
+import numpy
+import pytest
+
+from prisme import protocol
+from prisme.frame import Frame
+from prisme.calibration import Calibration, CalibrationPipeline, EmaFilter, MedianFilter, averageFrames
+
+def noisyScenes(count, seed=0):
+    # a drifting light spot with pixel noise, as floats
+    rand = numpy.random.RandomState(seed)
+    pixels = numpy.arange(protocol.CAMERA_PIXELS)
+    centers = 51 + 20 * numpy.sin(numpy.arange(count) * 0.05)
+    scenes = 20 + 180 * numpy.exp(-((pixels[None, :] - centers[:, None]) / 6.0) ** 2 / 2)
+    return (scenes + rand.uniform(-5, 5, scenes.shape)).astype(numpy.float32)
+
+def streamed(filter, rows):
+    filter.reset()
+    return numpy.array([filter.apply(row).copy() for row in rows])
+
+@pytest.mark.parametrize('alpha', [0.05, 0.2, 0.5, 0.9, 1.0])
+def test_ema_batch_matches_the_recursion(alpha):
+    rows = noisyScenes(3000)
+    filter = EmaFilter(alpha)
+    expected = streamed(filter, rows)
+    batch = filter.applyBatch(rows)
+    assert batch.dtype == numpy.float32
+    assert numpy.abs(batch - expected).max() < 1e-3
+    # the state is the last row's, apply() carries on from it
+    following = rows[0] * 0.5
+    assert numpy.allclose(filter.apply(following), EmaFilter(alpha).applyBatch(numpy.vstack([rows, following]))[-1],
+        atol=1e-3)
+
+def test_ema_batch_over_many_blocks_with_slow_decay():
+    # the blocks are short when alpha is small, their states chain up
+    rows = noisyScenes(5000, 1)
+    filter = EmaFilter(0.001)
+    assert numpy.abs(filter.applyBatch(rows) - streamed(EmaFilter(0.001), rows)).max() < 1e-3
+
+def test_ema_without_memory():
+    rows = noisyScenes(10)
+    assert numpy.array_equal(EmaFilter(1.0).applyBatch(rows), rows)
+    assert numpy.array_equal(EmaFilter(0.0).applyBatch(rows), numpy.repeat(rows[:1], 10, axis=0))
+
+def test_ema_batch_of_nothing():
+    assert EmaFilter(0.2).applyBatch(numpy.zeros((0, protocol.CAMERA_PIXELS))).shape == (0, protocol.CAMERA_PIXELS)
+
+@pytest.mark.parametrize('length', [1, 2, 3, 4, 5, 8])
+def test_median_batch_matches_the_window(length):
+    rows = noisyScenes(200, 2)
+    filter = MedianFilter(length)
+    expected = streamed(filter, rows)
+    assert numpy.array_equal(filter.applyBatch(rows), expected)
+    # against numpy's own median of the trailing windows
+    for i in (0, length - 1, 100, 199):
+        window = rows[max(0, i - length + 1):i + 1]
+        assert numpy.allclose(expected[i], numpy.median(window, axis=0))
+
+def test_median_batch_shorter_than_the_window():
+    rows = noisyScenes(3, 3)
+    assert numpy.array_equal(MedianFilter(5).applyBatch(rows), streamed(MedianFilter(5), rows))
+
+def test_calibration_flattens_offsets_and_gains():
+    rand = numpy.random.RandomState(4)
+    offsets = rand.uniform(5, 20, protocol.CAMERA_PIXELS).astype(numpy.float32)
+    gains = rand.uniform(0.8, 1.2, protocol.CAMERA_PIXELS).astype(numpy.float32)
+    dark = numpy.repeat(offsets[None, :], 8, axis=0).astype(numpy.uint8)
+    flat = numpy.repeat((offsets + 150 * gains)[None, :], 8, axis=0).astype(numpy.uint8)
+    calibration = Calibration.capture(dark, flat)
+    corrected = calibration.applyBatchFloat(flat[:1])[0]
+    # every pixel at the mean response, within the rounding of the bytes
+    assert numpy.abs(corrected - corrected.mean()).max() < 2
+    assert numpy.array_equal(calibration.apply(dark[0]), numpy.zeros(protocol.CAMERA_PIXELS, numpy.uint8))
+
+def test_dead_pixels_keep_their_gain():
+    dark = numpy.zeros((1, protocol.CAMERA_PIXELS), numpy.uint8)
+    flat = numpy.full((1, protocol.CAMERA_PIXELS), 100, numpy.uint8)
+    flat[0, 10] = 1
+    calibration = Calibration.capture(dark, flat)
+    assert calibration.gain[10] == 1
+    assert numpy.allclose(calibration.gain[11:], 1)
+
+def test_save_and_load(tmp_path):
+    rand = numpy.random.RandomState(5)
+    dark = rand.uniform(0, 20, protocol.CAMERA_PIXELS)
+    flat = dark + rand.uniform(100, 150, protocol.CAMERA_PIXELS)
+    path = str(tmp_path / 'calibration' / 'device.npz')
+    Calibration(dark, flat).save(path)
+    loaded = Calibration.load(path)
+    assert numpy.allclose(loaded.dark, dark) and numpy.allclose(loaded.flat, flat)
+    Calibration(dark).save(path)
+    assert Calibration.load(path).flat is None
+    assert Calibration.load(str(tmp_path / 'missing.npz')) is None
+
+def test_single_frames_match_the_batch():
+    rand = numpy.random.RandomState(6)
+    dark = rand.uniform(0, 20, protocol.CAMERA_PIXELS)
+    calibration = Calibration(dark, dark + rand.uniform(100, 150, protocol.CAMERA_PIXELS))
+    cameras = noisyScenes(20, 7).clip(0, 255).astype(numpy.uint8)
+    assert numpy.array_equal(numpy.array([calibration.apply(camera) for camera in cameras]),
+        calibration.applyBatch(cameras))
+
+@pytest.mark.parametrize('makeFilter', [lambda: None, lambda: EmaFilter(0.3), lambda: MedianFilter(3)])
+def test_pipeline_batch_matches_live_frames_around_ir_responses(makeFilter):
+    rand = numpy.random.RandomState(8)
+    dark = rand.uniform(0, 20, protocol.CAMERA_PIXELS)
+    calibration = Calibration(dark, dark + rand.uniform(100, 150, protocol.CAMERA_PIXELS))
+    cameras = noisyScenes(60, 9).clip(0, 255).astype(numpy.uint8)
+    live = CalibrationPipeline(calibration, makeFilter())
+    corrected = []
+    for n, camera in enumerate(cameras):
+        frame = Frame(bytes(bytearray(camera)) + bytes(bytearray(protocol.IR_SENSORS)))
+        live.process(frame)
+        corrected.append(bytearray(frame.camera))
+        # IR responses in between repeat the last camera and leave the filter
+        # alone
+        ir = Frame(frame.data)
+        ir.irOnly = True
+        live.process(ir)
+        assert bytearray(ir.camera) == corrected[-1]
+    batch = CalibrationPipeline(calibration, makeFilter()).processBatch(cameras)
+    assert numpy.abs(batch.astype(int) - numpy.array(corrected, dtype=int)).max() <= 1
+
+def test_average_frames():
+    frames = [Frame(bytearray([value] * protocol.FRAME_SIZE)) for value in (10, 20, 30)]
+    assert numpy.allclose(averageFrames(frames), 20)
+    assert numpy.allclose(averageFrames(numpy.full((4, protocol.FRAME_SIZE), 7, numpy.uint8)), 7)
@@ -0,0 +1,66 @@
+import random
+
+from prisme import protocol
+from prisme.delta import encodeDelta, decodeDelta
+
+def noisyFrame(reference, rand, noise):
+    return bytearray((value + rand.randint(-noise, noise)) & 0xff for value in reference)
+
+def decoded(reference, payload):
+    out = bytearray(len(reference))
+    assert decodeDelta(reference, payload, out)
+    return out
+
+def test_unchanged_frame_is_a_few_zero_runs():
+    frame = bytearray(range(protocol.FRAME_SIZE))
+    payload = encodeDelta(frame, frame)
+    # runs of at most DELTA_RUN_MAX bytes, one token each
+    assert len(payload) == 2
+    assert decoded(frame, payload) == frame
+
+def test_round_trip_of_noisy_frames():
+    rand = random.Random(1)
+    reference = bytearray(rand.randint(0, 255) for i in range(protocol.FRAME_SIZE))
+    for noise in (1, 3, 7, 8, 20, 255):
+        for i in range(50):
+            current = noisyFrame(reference, rand, noise)
+            payload = encodeDelta(reference, current)
+            if payload is None:
+                continue
+            assert len(payload) < protocol.FRAME_SIZE
+            assert decoded(reference, payload) == current
+
+def test_small_noise_compresses():
+    rand = random.Random(2)
+    reference = bytearray(rand.randint(0, 255) for i in range(protocol.FRAME_SIZE))
+    payload = encodeDelta(reference, noisyFrame(reference, rand, 3))
+    assert payload is not None and len(payload) < protocol.FRAME_SIZE * 2 // 3
+
+def test_differences_wrap_around():
+    reference = bytearray([0, 255, 250, 5] * 25)
+    current = bytearray([255, 0, 1, 253] * 25)
+    assert decoded(reference, encodeDelta(reference, current)) == current
+
+def test_unrelated_frames_are_sent_whole():
+    rand = random.Random(3)
+    reference = bytearray(rand.randint(0, 255) for i in range(protocol.FRAME_SIZE))
+    current = bytearray((value + 128) & 0xff for value in reference)
+    assert encodeDelta(reference, current) is None
+
+def test_decoding_in_place():
+    rand = random.Random(4)
+    reference = bytearray(rand.randint(0, 255) for i in range(protocol.FRAME_SIZE))
+    current = noisyFrame(reference, rand, 2)
+    payload = encodeDelta(reference, current)
+    assert decodeDelta(reference, payload, reference)
+    assert reference == current
+
+def test_invalid_payloads_are_refused():
+    reference = bytearray(protocol.FRAME_SIZE)
+    out = bytearray(protocol.FRAME_SIZE)
+    # too short, past the end, truncated data, unknown kind
+    assert not decodeDelta(reference, bytes(bytearray([protocol.DELTA_ZEROS | 9])), out)
+    assert not decodeDelta(reference, bytes(bytearray([protocol.DELTA_ZEROS | 63] * 2)), out)
+    assert not decodeDelta(reference, bytes(bytearray([protocol.DELTA_LITERALS | 3, 1, 2])), out)
+    assert not decodeDelta(reference, bytes(bytearray([protocol.DELTA_NIBBLES | 63])), out)
+    assert not decodeDelta(reference, bytes(bytearray([0xc0])), out)
@@ -0,0 +1,82 @@
+# end to end over the emulated firmware on a pseudo-terminal
+import threading
+
+import pytest
+
+# the acquisition talks to the pseudo-terminal through pyserial
+pytest.importorskip('serial')
+
+from prisme import protocol
+from prisme.acquisition import Acquisition, openLink, handshake, negotiateBaudrate, enableFraming, probeInfrared
+from prisme.emulator import PrismeEmulator
+from prisme.recorder import SessionRecorder, SessionReader
+
+@pytest.fixture
+def emulator():
+    emulator = PrismeEmulator(ir=b'\x01\x02\x03\x04\x05').start()
+    yield emulator
+    emulator.stop()
+
+def acquire(link, count, **options):
+    # the first count frames, copied, then the acquisition is stopped
+    frames = []
+    done = threading.Event()
+    acquisition = Acquisition(link, **options)
+
+    def onFrame(frame):
+        if len(frames) < count:
+            frames.append(frame.copy())
+        if len(frames) == count:
+            done.set()
+    acquisition.onFrame = onFrame
+    acquisition.onDisconnect = lambda reason: done.set()
+    return acquisition, frames, done
+
+def connect(port, speed=1.0):
+    link = openLink(port, speed=speed)
+    assert handshake(link) == 100
+    negotiateBaudrate(link)
+    assert enableFraming(link)
+    return link
+
+def test_framed_compressed_acquisition(emulator):
+    link = connect(emulator.port)
+    acquisition, frames, done = acquire(link, 40, framed=True, compression=protocol.KEYFRAME_INTERVAL)
+    acquisition.start()
+    assert done.wait(20)
+    acquisition.stop()
+    acquisition.join(5)
+    assert len(frames) == 40
+    assert acquisition.parser.deltas > 0 and not acquisition.parser.lost
+    # consecutive numbers, the gaps would be lost frames
+    assert [frame.sequence for frame in frames] == list(range(frames[0].sequence, frames[0].sequence + 40))
+    assert all(bytearray(frame.ir) == bytearray([1, 2, 3, 4, 5]) for frame in frames)
+
+def test_record_ir_responses_and_replay_them(emulator, tmp_path):
+    path = str(tmp_path / 'session.prs')
+    link = connect(emulator.port)
+    assert probeInfrared(link, True)
+    acquisition, frames, done = acquire(link, 60, framed=True, cameraRate=20, irRate=200)
+    recorder = SessionRecorder(path)
+    acquisition.recorder = recorder
+    acquisition.start()
+    assert done.wait(20)
+    acquisition.stop()
+    acquisition.join(5)
+    recorder.close()
+    irOnly = [frame.irOnly for frame in frames]
+    assert any(irOnly) and not all(irOnly)
+
+    with SessionReader(path) as session:
+        recorded = session.irOnlyMask()
+        assert recorded.any() and not recorded.all()
+        assert len(session.frameArray(cameraOnly=True)) == len(session) - recorded.sum()
+
+    # IR responses come back as IR responses
+    link = connect(path, speed=0)
+    acquisition, frames, done = acquire(link, len(recorded), framed=True, pause=0)
+    acquisition.start()
+    done.wait(20)
+    acquisition.stop()
+    acquisition.join(5)
+    assert [frame.irOnly for frame in frames] == list(recorded)
@@ -0,0 +1,126 @@
+import random
+
+from prisme import protocol
+from prisme.delta import encodeDelta
+from prisme.framing import FrameParser, isFramed
+
+def makeFrame(seed):
+    rand = random.Random(seed)
+    return bytearray(rand.randint(0, 255) for i in range(protocol.FRAME_SIZE))
+
+def parseAll(parser, data, chunk=None):
+    # every frame parsed from data fed in chunks of the given size, copied as
+    # the parser reuses them, numbered like the acquisition does
+    frames = []
+    chunk = chunk or len(data) or 1
+    for start in range(0, len(data), chunk):
+        parser.feed(data[start:start + chunk])
+        while True:
+            frame = parser.next()
+            if frame is None:
+                break
+            frame = frame.copy()
+            frame.sequence = parser.sequence
+            frames.append(frame)
+    return frames
+
+def test_round_trip_in_any_chunks():
+    payloads = [makeFrame(i) for i in range(10)]
+    stream = b''.join(protocol.encodeFrame(i, payload) for i, payload in enumerate(payloads))
+    for chunk in (1, 3, protocol.FRAMED_SIZE, 1000):
+        parser = FrameParser()
+        frames = parseAll(parser, stream, chunk)
+        assert [bytearray(frame.data) for frame in frames] == payloads
+        assert [frame.sequence for frame in frames] == list(range(10))
+        assert parser.frames == 10 and not parser.lost and not parser.corrupted and not parser.skipped
+
+def test_resynchronizes_after_garbage():
+    payloads = [makeFrame(i) for i in range(3)]
+    stream = protocol.encodeFrame(0, payloads[0]) + b'\x01\xa5\x02' + protocol.encodeFrame(1, payloads[1]) + \
+        protocol.FRAME_SYNC + protocol.encodeFrame(2, payloads[2])
+    parser = FrameParser()
+    frames = parseAll(parser, b'junk' + stream, 5)
+    assert [bytearray(frame.data) for frame in frames] == payloads
+    assert not parser.lost
+    assert parser.skipped >= 7
+
+def test_corrupted_frame_is_counted_once():
+    payloads = [makeFrame(i) for i in range(3)]
+    damaged = bytearray(protocol.encodeFrame(1, payloads[1]))
+    damaged[10] ^= 0xff
+    stream = protocol.encodeFrame(0, payloads[0]) + bytes(damaged) + protocol.encodeFrame(2, payloads[2])
+    parser = FrameParser()
+    frames = parseAll(parser, stream)
+    assert [bytearray(frame.data) for frame in frames] == [payloads[0], payloads[2]]
+    assert parser.corrupted == 1
+    assert parser.lost == 1
+    # the frame is missing once, not as corrupted and as a gap
+    assert parser.takeMissing() == 1
+    assert [frame.sequence for frame in frames] == [0, 2]
+
+def test_dropped_byte_costs_one_frame():
+    payloads = [makeFrame(i) for i in range(3)]
+    cut = protocol.encodeFrame(1, payloads[1])
+    stream = protocol.encodeFrame(0, payloads[0]) + cut[:50] + cut[51:] + protocol.encodeFrame(2, payloads[2])
+    parser = FrameParser()
+    frames = parseAll(parser, stream, 7)
+    assert [bytearray(frame.data) for frame in frames] == [payloads[0], payloads[2]]
+    assert parser.lost == 1
+
+def test_sequence_numbers_unwrap_past_255():
+    stream = b''.join(protocol.encodeFrame(i & 0xff, makeFrame(0)) for i in range(250, 262) if i != 256)
+    parser = FrameParser()
+    frames = parseAll(parser, stream)
+    assert frames[-1].sequence - frames[0].sequence == 11
+    assert parser.lost == 1
+    assert parser.takeMissing() == 1
+
+def test_ir_responses_keep_the_last_camera():
+    camera = makeFrame(1)
+    ir = bytearray([1, 2, 3, 4, 5])
+    stream = protocol.encodeFrame(0, camera) + protocol.encodeFrame(1, ir)
+    parser = FrameParser()
+    first, second = parseAll(parser, stream)
+    assert not first.irOnly and second.irOnly
+    assert bytearray(second.camera) == camera[:protocol.CAMERA_PIXELS]
+    assert bytearray(second.ir) == ir
+    assert parser.frames == 1 and parser.irFrames == 1
+
+def test_compressed_frames_decode_against_the_previous_one():
+    rand = random.Random(5)
+    frames = [makeFrame(0)]
+    for i in range(5):
+        frames.append(bytearray((value + rand.randint(-2, 2)) & 0xff for value in frames[-1]))
+    stream = protocol.encodeFrame(0, frames[0])
+    for i in range(1, len(frames)):
+        stream += protocol.encodeFrame(i, encodeDelta(frames[i - 1], frames[i]), True)
+    parser = FrameParser()
+    parsed = parseAll(parser, stream, 11)
+    assert [bytearray(frame.data) for frame in parsed] == frames
+    assert parser.deltas == 5
+    assert parser.compressionRatio > 1
+
+def test_compressed_frame_after_a_gap_asks_for_a_keyframe():
+    rand = random.Random(6)
+    frames = [makeFrame(0)]
+    for i in range(3):
+        frames.append(bytearray((value + rand.randint(-2, 2)) & 0xff for value in frames[-1]))
+    # frame 1 never arrives, 2 and 3 can't be decoded
+    stream = protocol.encodeFrame(0, frames[0])
+    for i in (2, 3):
+        stream += protocol.encodeFrame(i, encodeDelta(frames[i - 1], frames[i]), True)
+    parser = FrameParser()
+    parsed = parseAll(parser, stream)
+    assert [bytearray(frame.data) for frame in parsed] == frames[:1]
+    assert parser.takeKeyframeRequest()
+    # once until the keyframe comes
+    assert not parser.takeKeyframeRequest()
+    parsed = parseAll(parser, protocol.encodeFrame(4, frames[3]))
+    assert [bytearray(frame.data) for frame in parsed] == frames[3:]
+    assert parser.lost == 3
+
+def test_is_framed():
+    frame = makeFrame(7)
+    assert isFramed(protocol.encodeFrame(0, frame))
+    assert isFramed(b'\x00' + protocol.encodeFrame(0, frame)[:10])
+    assert not isFramed(frame)
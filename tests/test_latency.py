@@ -0,0 +1,95 @@
+import random
+
+from prisme.frame import Frame
+from prisme.latency import Histogram, Latencies, STAGE_REQUESTED, STAGE_FIRST_BYTE, STAGE_COMPLETE, STAGE_DECODED, \
+    STAGE_POSTED, STAGE_DRAWN
+
+def test_exact_buckets_for_small_values():
+    histogram = Histogram()
+    for value in range(2 * histogram.subBuckets):
+        index = histogram.index(value)
+        assert index == value
+        assert histogram.highestEquivalent(index) == value
+
+def test_buckets_hold_their_values_within_the_precision():
+    histogram = Histogram()
+    rand = random.Random(0)
+    values = list(range(1 << 12)) + [rand.randint(0, 1 << 32) for i in range(10000)]
+    for value in values:
+        index = histogram.index(value)
+        highest = histogram.highestEquivalent(index)
+        assert value <= highest
+        assert highest - value <= value >> histogram.significantBits
+        # the bucket below ends below the value
+        if index:
+            assert histogram.highestEquivalent(index - 1) < value
+
+def test_buckets_are_increasing():
+    histogram = Histogram()
+    highest = [histogram.highestEquivalent(index) for index in range(len(histogram.counts))]
+    assert highest == sorted(set(highest))
+
+def test_larger_values_fall_in_the_last_bucket():
+    histogram = Histogram()
+    histogram.record(1e6)
+    assert histogram.counts[-1] == 1
+    assert histogram.maximum == int(1e12)
+
+def test_percentiles():
+    histogram = Histogram()
+    for microseconds in range(1, 1001):
+        histogram.record(microseconds * 1e-6)
+    assert histogram.count == 1000
+    assert histogram.minimum == 1 and histogram.maximum == 1000
+    assert abs(histogram.mean - 500.5e-6) < 1e-9
+    for p in (1, 50, 90, 99):
+        value = histogram.percentile(p) * 1e6
+        assert p * 10 <= value <= p * 10 * (1 + 2.0 ** -histogram.significantBits)
+    assert histogram.percentile(100) == 1000e-6
+
+def test_add_and_reset():
+    first = Histogram()
+    second = Histogram()
+    first.record(0.001)
+    second.record(0.002)
+    second.record(0.0005)
+    first.add(second)
+    assert first.count == 3 and first.minimum == 500 and first.maximum == 2000
+    assert sum(first.counts) == 3
+    first.reset()
+    assert first.count == 0 and first.minimum is None and not any(first.counts)
+
+def test_distribution_ends_at_100_percent():
+    histogram = Histogram()
+    for value in (10, 10, 200, 5000):
+        histogram.record(value * 1e-6)
+    rows = list(histogram.distribution())
+    assert [count for value, percentile, count in rows] == [2, 3, 4]
+    assert rows[-1][1] == 100.0
+
+def test_frame_stages():
+    latencies = Latencies()
+    frame = Frame()
+    frame.stages[STAGE_REQUESTED] = 1.0
+    frame.stages[STAGE_FIRST_BYTE] = 1.002
+    frame.stages[STAGE_COMPLETE] = 1.003
+    frame.stages[STAGE_DECODED] = 1.003
+    frame.stages[STAGE_POSTED] = 1.004
+    latencies.recordFrame(frame)
+    assert list(latencies.histograms) == ['request to first byte', 'first byte to complete', 'complete to decoded',
+        'decoded to posted']
+    frame.stages[STAGE_DRAWN] = 1.010
+    latencies.recordFrame(frame, STAGE_POSTED, STAGE_DRAWN)
+    assert latencies['posted to drawn'].count == 1
+    assert abs(latencies['request to drawn, overall'].maximum - 10000) <= 1
+
+def test_streamed_frames_skip_the_request():
+    latencies = Latencies()
+    frame = Frame()
+    frame.stages[STAGE_FIRST_BYTE] = 1.0
+    frame.stages[STAGE_COMPLETE] = 1.001
+    frame.stages[STAGE_DRAWN] = 1.005
+    latencies.recordFrame(frame, STAGE_REQUESTED, STAGE_DRAWN)
+    assert 'request to first byte' not in latencies.histograms
+    assert latencies['complete to drawn'].count == 1
+    assert latencies['first byte to drawn, overall'].count == 1
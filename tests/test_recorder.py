@@ -0,0 +1,118 @@
+import numpy
+
+from prisme import protocol
+from prisme.frame import Frame
+from prisme.recorder import SessionRecorder, SessionReader, indexPath, RECORD_COMMAND, RECORD_FRAME
+
+def makeFrame(n, irOnly=False):
+    frame = Frame(bytearray((n + i) & 0xff for i in range(protocol.FRAME_SIZE)))
+    frame.sequence = n
+    frame.timestamp = 100.0 + n * 0.01
+    frame.irOnly = irOnly
+    return frame
+
+def recordSession(path, frames, commandEvery=0):
+    with SessionRecorder(str(path)) as recorder:
+        for n, frame in enumerate(frames):
+            recorder.recordFrame(frame)
+            if commandEvery and n % commandEvery == 0:
+                recorder.recordCommand(protocol.speedCommand(n, -n), frame.timestamp)
+    return recorder
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'session.prs'
+    frames = [makeFrame(n) for n in range(20)]
+    recorder = recordSession(path, frames, 5)
+    assert recorder.frames == 20 and recorder.records == 24 and not recorder.dropped
+    assert (tmp_path / 'session.prs.idx').exists()
+    with SessionReader(str(path)) as session:
+        assert len(session) == 20
+        assert session.recordCount == 24
+        for n, frame in enumerate(frames):
+            read = session[n]
+            assert bytearray(read.data) == frame.data
+            assert read.sequence == n
+            assert not read.irOnly
+        # times are relative to the start of the recorder, in order
+        times = [session.frameTime(n) for n in range(20)]
+        assert times == sorted(times)
+        assert abs((times[-1] - times[0]) - 0.19) < 1e-9
+        commands = list(session.commands())
+        assert [command for timestamp, command in commands] == [protocol.speedCommand(n, -n) for n in range(0, 20, 5)]
+        kinds = [kind for kind, sequence, timestamp, payload in session.records()]
+        assert kinds.count(RECORD_COMMAND) == 4 and kinds.count(RECORD_FRAME) == 20
+
+def test_find_frames_by_time(tmp_path):
+    path = tmp_path / 'session.prs'
+    recordSession(path, [makeFrame(n) for n in range(50)])
+    with SessionReader(str(path)) as session:
+        start = session.frameTime(0)
+        assert session.findFrame(start) == 0
+        assert session.findFrame(start + 0.095) == 10
+        assert session.findFrame(start + 10) == 50
+        assert [frame.sequence for frame in session.framesBetween(start + 0.1 - 1e-6, start + 0.15 - 1e-6)] == \
+            list(range(10, 15))
+
+def test_frame_array_matches_the_frames(tmp_path):
+    path = tmp_path / 'session.prs'
+    frames = [makeFrame(n) for n in range(30)]
+    for commandEvery in (0, 3):
+        recordSession(path, frames, commandEvery)
+        with SessionReader(str(path)) as session:
+            array = session.frameArray()
+            assert array.shape == (30, protocol.FRAME_SIZE)
+            assert numpy.array_equal(array, numpy.array([frame.data for frame in frames], dtype=numpy.uint8))
+            del array
+
+def test_ir_responses_are_flagged(tmp_path):
+    path = tmp_path / 'session.prs'
+    frames = [makeFrame(n, irOnly=n % 4 != 0) for n in range(20)]
+    recorder = recordSession(path, frames, 7)
+    assert recorder.irFrames == 15
+    with SessionReader(str(path)) as session:
+        mask = session.irOnlyMask()
+        assert list(mask) == [frame.irOnly for frame in frames]
+        assert [session.isIrOnly(n) for n in range(20)] == list(mask)
+        assert [session[n].irOnly for n in range(20)] == list(mask)
+        cameras = session.frameArray(cameraOnly=True)
+        assert numpy.array_equal(cameras, numpy.array([frame.data for frame in frames[::4]], dtype=numpy.uint8))
+        assert len(session.frameTimes()) == 20
+        del cameras
+
+def test_records_after_close_are_ignored(tmp_path):
+    path = tmp_path / 'session.prs'
+    recorder = SessionRecorder(str(path))
+    recorder.recordFrame(makeFrame(0))
+    recorder.close()
+    recorder.recordFrame(makeFrame(1))
+    recorder.recordCommand(protocol.CMD_CONFIG)
+    recorder.close()
+    with SessionReader(str(path)) as session:
+        assert len(session) == 1 and session.recordCount == 1
+
+def test_session_in_progress(tmp_path):
+    path = tmp_path / 'session.prs'
+    recorder = SessionRecorder(str(path), batchSize=1)
+    try:
+        recorder.recordFrame(makeFrame(0))
+        session = SessionReader(str(path))
+        recorder.recordFrame(makeFrame(1))
+        recorder.recordFrame(makeFrame(2))
+    finally:
+        recorder.close()
+    session.refresh()
+    assert len(session) == 3
+    assert session[-1].sequence == 2
+    session.close()
+
+def test_not_a_session(tmp_path):
+    path = tmp_path / 'other.prs'
+    path.write_bytes(b'\0' * 200)
+    (tmp_path / 'other.prs.idx').write_bytes(b'')
+    try:
+        SessionReader(str(path))
+    except ValueError:
+        pass
+    else:
+        assert False, 'a file without the header was read as a session'
+    assert indexPath(str(path)).endswith('.prs.idx')
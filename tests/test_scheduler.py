@@ -0,0 +1,98 @@
+from prisme import protocol
+from prisme.scheduler import CommandScheduler, RequestScheduler, STOP
+
+def takeAll(scheduler):
+    commands = []
+    while True:
+        command = scheduler.take(0)
+        if command is None:
+            return commands
+        commands.append(command)
+
+def test_only_the_newest_speed_is_sent():
+    scheduler = CommandScheduler()
+    for speed in (10, 20, 30):
+        scheduler.put(protocol.speedCommand(speed, speed))
+    assert len(scheduler) == 1
+    assert takeAll(scheduler) == [protocol.speedCommand(30, 30)]
+    assert scheduler.coalesced == 2
+    assert scheduler.queued == 3 and scheduler.sent == 1
+
+def test_stop_goes_first_and_drops_waiting_speeds():
+    scheduler = CommandScheduler()
+    scheduler.put(protocol.CMD_CONFIG)
+    scheduler.put(protocol.speedCommand(50, 50))
+    scheduler.put(STOP)
+    scheduler.put(STOP)
+    assert takeAll(scheduler) == [STOP, protocol.CMD_CONFIG]
+    assert scheduler.coalesced == 2
+
+def test_speed_after_a_stop_is_kept():
+    scheduler = CommandScheduler()
+    scheduler.put(STOP)
+    scheduler.put(protocol.speedCommand(-20, 20))
+    assert takeAll(scheduler) == [STOP, protocol.speedCommand(-20, 20)]
+
+def test_order_of_the_classes():
+    scheduler = CommandScheduler()
+    scheduler.put(protocol.intTimeCommand(200))
+    scheduler.put(protocol.CMD_CONFIG)
+    scheduler.put(protocol.CMD_RESET)
+    scheduler.put(protocol.speedCommand(10, 10))
+    scheduler.put(protocol.CMD_DATA)
+    assert takeAll(scheduler) == [protocol.CMD_RESET, protocol.speedCommand(10, 10), protocol.CMD_CONFIG,
+        protocol.CMD_DATA, protocol.intTimeCommand(200)]
+    assert scheduler.maxDepth == 5
+
+def test_integration_time_coalescing():
+    scheduler = CommandScheduler()
+    scheduler.put(protocol.intTimeCommand(100))
+    scheduler.put(protocol.intTimeCommand(300))
+    assert takeAll(scheduler) == [protocol.intTimeCommand(300)]
+    # the one sent last isn't sent again
+    scheduler.put(protocol.intTimeCommand(300))
+    assert takeAll(scheduler) == []
+    scheduler.put(protocol.intTimeCommand(400))
+    scheduler.put(protocol.intTimeCommand(300))
+    assert takeAll(scheduler) == []
+    assert scheduler.coalesced == 4
+
+def test_take_entry_keeps_the_time_queued():
+    scheduler = CommandScheduler()
+    scheduler.put(protocol.CMD_CONFIG, 12.5)
+    assert scheduler.takeEntry(0) == (12.5, protocol.CMD_CONFIG)
+
+def test_close_wakes_up_and_leaves_commands_to_take():
+    scheduler = CommandScheduler()
+    scheduler.close()
+    assert scheduler.take() is None
+    scheduler.put(protocol.CMD_CONFIG)
+    assert scheduler.take() == protocol.CMD_CONFIG
+
+def test_requests_at_their_own_rates():
+    requests = RequestScheduler(cameraRate=5, irRate=50)
+    taken = []
+    now = 0.0
+    while now < 1.0:
+        command = requests.take(now)
+        if command is not None:
+            taken.append(command)
+        now += 0.001
+    assert taken.count(protocol.CMD_DATA) == 5
+    assert taken.count(protocol.CMD_IR) == 50
+    assert requests.requested == {protocol.CMD_DATA: 5, protocol.CMD_IR: 50}
+
+def test_requests_are_not_caught_up_after_a_delay():
+    requests = RequestScheduler(cameraRate=10)
+    assert requests.take(0.0) == protocol.CMD_DATA
+    assert requests.take(0.05) is None
+    # late by a second: the request due and the next one, not the nine
+    # missed, then back to the rate
+    assert requests.take(1.0) == protocol.CMD_DATA
+    assert requests.take(1.0) == protocol.CMD_DATA
+    assert requests.take(1.0) is None
+    assert abs(requests.due - 1.1) < 1e-9
+
+def test_unlimited_requests_without_ir():
+    requests = RequestScheduler()
+    assert [requests.take(0.0) for i in range(3)] == [protocol.CMD_DATA] * 3